@@ -14,4 +14,83 @@ function(create_library lib_name sources)
         PREFIX ""
         OUTPUT_NAME ${lib_name}
     )
+
+    # Batch hand-written sources into unity translation units, SWIG wrappers define
+    # file-local helpers that clash with each other so they are always compiled alone
+    if(TORSION_UNITY_BUILD)
+        set_target_properties(${lib_name}
+            PROPERTIES
+            UNITY_BUILD ON
+            UNITY_BUILD_BATCH_SIZE ${TORSION_UNITY_BATCH_SIZE}
+        )
+        set_source_files_properties("${SWIG_GEN}/${lib_name}_wrap.cpp"
+            PROPERTIES
+            SKIP_UNITY_BUILD_INCLUSION ON
+        )
+    endif()
+
+    # Reuse the shared precompiled header instead of parsing SDL/STL headers per library
+    if(TARGET torsion_pch)
+        target_precompile_headers(${lib_name} REUSE_FROM torsion_pch)
+        target_link_libraries(${lib_name} PRIVATE torsion_pch_usage)
+    endif()
+
+    # Installed libraries load their dependencies from the folder they are installed into
+    if(APPLE)
+        set_target_properties(${lib_name} PROPERTIES INSTALL_RPATH "@loader_path")
+    elseif(UNIX)
+        set_target_properties(${lib_name} PROPERTIES INSTALL_RPATH "$ORIGIN")
+    endif()
+
+    # .NET loads native libraries from next to the managed assemblies, so shared libraries go in bin
+    install(TARGETS ${lib_name}
+        RUNTIME DESTINATION bin
+        LIBRARY DESTINATION bin
+        ARCHIVE DESTINATION lib
+    )
+endfunction()
+
+function(install_runtime_dependencies)
+    foreach(dependency ${ARGN})
+        if(NOT TARGET ${dependency})
+            continue()
+        endif()
+
+        get_target_property(aliased ${dependency} ALIASED_TARGET)
+        if(aliased)
+            set(dependency ${aliased})
+        endif()
+
+        get_target_property(type ${dependency} TYPE)
+        get_target_property(imported ${dependency} IMPORTED)
+        if(type STREQUAL "SHARED_LIBRARY" AND imported)
+            install(IMPORTED_RUNTIME_ARTIFACTS ${dependency}
+                RUNTIME DESTINATION bin
+                LIBRARY DESTINATION bin
+            )
+        elseif(type STREQUAL "INTERFACE_LIBRARY")
+            # Umbrella targets (I.E. SDL3::SDL3) forward to the real shared/static library
+            get_target_property(linked ${dependency} INTERFACE_LINK_LIBRARIES)
+            if(linked)
+                install_runtime_dependencies(${linked})
+            endif()
+        endif()
+    endforeach()
+endfunction()
+
+function(create_precompiled_header header)
+    # Libraries reusing the header need the include directories of everything it includes
+    add_library(torsion_pch_usage INTERFACE)
+    target_link_libraries(torsion_pch_usage INTERFACE ${ARGN})
+
+    # The header is compiled once by this target, which needs a source of its own
+    set(pch_source "${CMAKE_CURRENT_BINARY_DIR}/torsion_pch.cpp")
+    file(CONFIGURE OUTPUT "${pch_source}" CONTENT "// Compiles torsion_pch's precompiled header\n")
+
+    add_library(torsion_pch OBJECT "${pch_source}")
+    target_precompile_headers(torsion_pch PRIVATE "${header}")
+    target_link_libraries(torsion_pch PRIVATE torsion_pch_usage)
+
+    # Flags must match the shared libraries reusing it
+    set_target_properties(torsion_pch PROPERTIES POSITION_INDEPENDENT_CODE ON)
 endfunction()
\ No newline at end of file
@@ -0,0 +1,66 @@
+# Build types on top of CMake's own, Profile is optimized with debug symbols so it can be
+# profiled and Shipping is the fully optimized build that gets distributed
+# CMake creates an empty cache entry for the flags of a custom CMAKE_BUILD_TYPE, so
+# defaults are filled in whenever the entry is empty instead of only when it's missing
+function(default_config_flags variable value docstring)
+    if(NOT ${variable})
+        set(${variable} "${value}" CACHE STRING "${docstring}" FORCE)
+    endif()
+endfunction()
+
+foreach(lang C CXX)
+    default_config_flags(CMAKE_${lang}_FLAGS_PROFILE "${CMAKE_${lang}_FLAGS_RELWITHDEBINFO}" "Flags used by the ${lang} compiler during Profile builds")
+    default_config_flags(CMAKE_${lang}_FLAGS_SHIPPING "${CMAKE_${lang}_FLAGS_RELEASE}" "Flags used by the ${lang} compiler during Shipping builds")
+endforeach()
+foreach(kind EXE SHARED MODULE)
+    default_config_flags(CMAKE_${kind}_LINKER_FLAGS_PROFILE "${CMAKE_${kind}_LINKER_FLAGS_RELWITHDEBINFO}" "Flags used by the linker during Profile builds")
+    default_config_flags(CMAKE_${kind}_LINKER_FLAGS_SHIPPING "${CMAKE_${kind}_LINKER_FLAGS_RELEASE}" "Flags used by the linker during Shipping builds")
+endforeach()
+
+# Imported packages (I.E. from vcpkg) only come in Debug and Release
+set(CMAKE_MAP_IMPORTED_CONFIG_PROFILE Release RelWithDebInfo "")
+set(CMAKE_MAP_IMPORTED_CONFIG_SHIPPING Release "")
+
+if(TORSION_IPO)
+    include(CheckIPOSupported)
+    check_ipo_supported(RESULT ipo_supported OUTPUT ipo_output LANGUAGES C CXX)
+    if(ipo_supported)
+        set(CMAKE_INTERPROCEDURAL_OPTIMIZATION_PROFILE ON)
+        set(CMAKE_INTERPROCEDURAL_OPTIMIZATION_SHIPPING ON)
+    else()
+        message(WARNING "Interprocedural optimization isn't supported by this toolchain: ${ipo_output}")
+    endif()
+endif()
+
+if(TORSION_TARGET_CPU)
+    if(CMAKE_CXX_COMPILER_ID MATCHES "GNU|Clang")
+        add_compile_options(-march=${TORSION_TARGET_CPU})
+    else()
+        message(WARNING "TORSION_TARGET_CPU is only supported with GCC and Clang, ignoring it")
+    endif()
+endif()
+
+# Instrumented builds write profiles while a workload runs, optimized builds read them back.
+# Both phases must build in the same tree since GCC looks profiles up by object path
+if(NOT TORSION_PGO STREQUAL "OFF")
+    if(CMAKE_CXX_COMPILER_ID STREQUAL "GNU")
+        set(pgo_generate_flags -fprofile-generate=${TORSION_PGO_DIR} -fprofile-update=atomic)
+        set(pgo_use_flags -fprofile-use=${TORSION_PGO_DIR} -fprofile-correction -Wno-missing-profile)
+    elseif(CMAKE_CXX_COMPILER_ID MATCHES "Clang")
+        set(pgo_generate_flags -fprofile-generate=${TORSION_PGO_DIR})
+        # Raw profiles are merged into this file by scripts/build/optimization.py
+        set(pgo_use_flags -fprofile-use=${TORSION_PGO_DIR}/torsion.profdata -Wno-profile-instr-unprofiled)
+    else()
+        message(FATAL_ERROR "Profile-guided optimization is only supported with GCC and Clang")
+    endif()
+
+    if(TORSION_PGO STREQUAL "GENERATE")
+        add_compile_options(${pgo_generate_flags})
+        add_link_options(${pgo_generate_flags})
+    elseif(TORSION_PGO STREQUAL "USE")
+        add_compile_options(${pgo_use_flags})
+        add_link_options(${pgo_use_flags})
+    else()
+        message(FATAL_ERROR "Unknown TORSION_PGO phase ${TORSION_PGO}, expected OFF, GENERATE or USE")
+    endif()
+endif()
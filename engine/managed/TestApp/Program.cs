@@ -1,5 +1,8 @@
 ﻿Console.WriteLine("Hello, World!");
 
+// Training runs (I.E. for profile-guided optimization) run headless for a fixed number of frames
+var trainingFrames = int.TryParse(Environment.GetEnvironmentVariable("TORSION_TRAINING_FRAMES"), out var frames) ? frames : 0;
+
 try
 {
     var settings = new WindowSettings
@@ -14,12 +17,16 @@ try
 
     using var window = new Window(settings);
 
-    while (!window.NeedsToClose())
+    var frame = 0;
+    while (!window.NeedsToClose() && (trainingFrames == 0 || frame++ < trainingFrames))
     {
         try
         {
             window.Update();
-            Thread.Sleep(16); // ~60 FPS - prevent tight loop
+            if (trainingFrames == 0)
+            {
+                Thread.Sleep(16); // ~60 FPS - prevent tight loop
+            }
         }
         catch (AccessViolationException ex)
         {
@@ -34,5 +41,8 @@ catch (Exception ex)
 }
 Window.Quit();
 
-Console.WriteLine("Press any key to exit...");
-Console.ReadKey();
\ No newline at end of file
+if (trainingFrames == 0)
+{
+    Console.WriteLine("Press any key to exit...");
+    Console.ReadKey();
+}
\ No newline at end of file
@@ -0,0 +1,17 @@
+#pragma once
+
+// Shared precompiled header, only enabled with TORSION_PRECOMPILED_HEADERS
+
+// C runtime headers the SWIG wrappers include
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+
+// STL
+#include <memory>
+#include <stdexcept>
+#include <string>
+#include <vector>
+
+// SDL
+#include <SDL3/SDL.h>
\ No newline at end of file
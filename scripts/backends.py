@@ -0,0 +1,46 @@
+import importlib.util
+import sys
+
+from types import ModuleType
+
+# The modules that run and configure the build's stages, by the name the entry points use for them
+BACKENDS = {
+    "compiler_cache": "scripts.build.compiler_cache",
+    "cs": "scripts.build.cs",
+    "cxx": "scripts.build.cxx",
+    "optimization": "scripts.build.optimization",
+    "swig": "scripts.build.swig",
+    "vcpkg": "scripts.build.vcpkg",
+}
+
+def load(name: str) -> ModuleType:
+    """Returns a stage backend that's only imported once one of its attributes is used
+
+    Note:
+        Backends pull in most of the build's imports (asyncio through scripts.process, the
+        .NET and native tool lookups...), so --help, --stats and other commands that never
+        touch a backend start without paying for them. The first use has to happen on the
+        main thread (I.E. while the stages are created), lazy modules aren't safe to load
+        from several threads at once
+
+    Args:
+        name: The backend's name in BACKENDS (I.E. cxx)
+
+    Raises:
+        KeyError: If there's no backend with that name
+    """
+    module_name = BACKENDS[name]
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+
+    spec = importlib.util.find_spec(module_name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    loader.exec_module(module)
+
+    # Like a regular import, so "from scripts.build import cxx" finds the same module
+    parent, _, child = module_name.rpartition(".")
+    setattr(sys.modules[parent], child, module)
+    return module
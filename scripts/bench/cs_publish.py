@@ -0,0 +1,153 @@
+from scripts.build import cs
+from scripts.build import optimization
+
+import argparse
+import json
+import shutil
+import statistics
+import time
+
+from pathlib import Path
+
+from scripts import install as installer
+from scripts import process
+from scripts import util
+
+BENCH_FOLDER = util.BUILD_DIRECTORY / "bench" / "cs"
+
+# Publish settings of every variant that gets compared
+VARIANTS = {
+    "jit": cs.CSPublishSettings(cs.CSPublishMode.JIT),
+    "jit+trim": cs.CSPublishSettings(cs.CSPublishMode.JIT, trim=True),
+    "r2r": cs.CSPublishSettings(cs.CSPublishMode.R2R),
+    "r2r+trim": cs.CSPublishSettings(cs.CSPublishMode.R2R, trim=True),
+    "aot": cs.CSPublishSettings(cs.CSPublishMode.AOT),
+}
+
+# How long a single TestApp launch may take before it's considered hung
+STARTUP_TIMEOUT = 60
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compares output size and TestApp startup time between C# publish modes")
+    parser.add_argument(
+        "--config",
+        choices=[config.value for config in util.BuildConfig],
+        default="Release",
+        help="Build configuration to benchmark")
+    parser.add_argument(
+        "--variants",
+        nargs="+",
+        choices=list(VARIANTS),
+        default=list(VARIANTS),
+        help="Which publish modes to compare")
+    parser.add_argument(
+        "--runs",
+        type=int,
+        default=10,
+        help="How many times TestApp is launched per variant, the median startup time is reported")
+    parser.add_argument(
+        "--output",
+        type=Path,
+        default=BENCH_FOLDER / "cs_publish.json",
+        help="Where to write the JSON results")
+    return parser.parse_args()
+
+def publish_variant(out_dir: Path, config: util.BuildConfig, publish: cs.CSPublishSettings) -> bool:
+    """Publishes TestApp from scratch into out_dir/bin next to the packaged native libraries
+
+    Returns:
+        bool: True if publishing succeeded, or False if it failed
+    """
+    # TestApp runs on this machine, dotnet needs a concrete runtime identifier rather than "current"
+    host_platform, host_arch = util.get_host_platform()
+
+    # Intermediates of another publish mode can't be reused
+    if not cs.compile(out_dir, config, host_platform, host_arch, clean_build=True, publish=publish):
+        return False
+    installer.move_tree(util.CSTEMP_OUT_DIR, out_dir / "bin")
+    return True
+
+def install_native_libraries(bin_dir: Path):
+    """Installs the packaged native libraries TestApp loads, keeping the variant's own managed files"""
+    package_bin = util.PACKAGE_DIRECTORY / "bin"
+    for file in package_bin.rglob("*"):
+        dest = bin_dir / file.relative_to(package_bin)
+        if file.is_file() and not dest.exists():
+            installer.install_file(file, dest)
+
+def time_startup(out_dir: Path, runs: int) -> list[float] | None:
+    """Launches TestApp headless for a single frame, timing it from start to exit
+
+    Returns:
+        list[float]|None: Seconds each launch took, or None if TestApp failed
+    """
+    command = optimization.get_training_command(out_dir)
+    if command is None:
+        print(f"TestApp wasn't published to {out_dir / 'bin'}")
+        return None
+
+    env = optimization.get_training_environment(1)
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = process.run(command, cwd=out_dir / "bin", env=env, capture_output=True, timeout=STARTUP_TIMEOUT)
+        elapsed = time.perf_counter() - start
+        if result.returncode != 0:
+            print(f"TestApp failed: {result.describe_failure()}")
+            return None
+        timings.append(elapsed)
+    return timings
+
+def bench():
+    args = parse_args() # Parse arguments from cli
+
+    config = util.BuildConfig(args.config)
+
+    if not (util.PACKAGE_DIRECTORY / "bin").exists():
+        print(f"No package found at {util.PACKAGE_DIRECTORY}, TestApp needs its native libraries. Please build the project first.")
+        return
+
+    results = {}
+    for name in args.variants:
+        publish = VARIANTS[name]
+        out_dir = BENCH_FOLDER / name
+        print(f"Benchmarking {name} ({publish.describe()})...")
+
+        if not publish_variant(out_dir, config, publish):
+            print(f"Variant {name} failed to publish, skipping it")
+            continue
+
+        # Only the managed output is measured, the native libraries are the same for every variant
+        size = util.get_folder_size(out_dir / "bin")
+        install_native_libraries(out_dir / "bin")
+
+        timings = time_startup(out_dir, args.runs)
+        shutil.rmtree(out_dir, ignore_errors=True)
+        if timings is None:
+            print(f"Variant {name} failed to start, skipping it")
+            continue
+
+        results[name] = {
+            "publish_flags": publish.get_publish_flags(),
+            "size": size,
+            "startup": timings,
+            "median_startup": statistics.median(timings),
+        }
+
+    baseline = results.get("jit")
+    print(f"{'variant':<10} {'size':>10} {'startup':>9} {'size vs jit':>12} {'speedup':>8}")
+    for name, result in results.items():
+        size_ratio = baseline and f"{result['size'] / max(1, baseline['size']):.2f}x" or "-"
+        speedup = baseline and f"{baseline['median_startup'] / result['median_startup']:.2f}x" or "-"
+        print(f"{name:<10} {util.format_size(result['size']):>10} {result['median_startup']:>8.3f}s {size_ratio:>12} {speedup:>8}")
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    args.output.write_text(json.dumps({
+        "config": config.value,
+        "runs": args.runs,
+        "variants": results,
+    }, indent=4))
+    print(f"Wrote benchmark results to {args.output}")
+
+if __name__ == "__main__":
+    bench()
@@ -0,0 +1,174 @@
+"""Fast stand-ins for cmake, ninja, swig, vcpkg, dotnet and the C/C++ compilers
+
+Note:
+    The orchestration benchmark copies this script into a bin folder once per tool it replaces,
+    and it decides what to do from the name it was started as. It has to run on its own, so it
+    can't import anything from scripts. TORSION_BENCH_MODULES sets how many native libraries a
+    build produces and TORSION_BENCH_ASSETS how many files a .NET publish produces
+"""
+
+import json
+import os
+import shutil
+import sys
+
+from pathlib import Path
+
+VERSIONS = {
+    "cmake": "cmake version 3.28.0",
+    "ninja": "1.12.1",
+    "swig": "SWIG Version 4.2.0",
+    "vcpkg": "vcpkg package management program version 2024-01-01-fake",
+    "dotnet": "8.0.100",
+    "clang": "clang version 18.1.0",
+    "clang++": "clang version 18.1.0",
+    "gcc": "gcc (GCC) 13.2.0",
+    "g++": "g++ (GCC) 13.2.0",
+}
+
+# Rough sizes of what real builds produce, so copies and hashes do realistic work
+LIBRARY_SIZE = 256 * 1024
+ASSET_SIZE = 8 * 1024
+
+# Folders a publish spreads its assets over, like the runtimes/ and satellite assembly folders of a real one
+ASSET_FOLDERS = ["", "runtimes/linux-x64/lib/net8.0", "runtimes/win-x64/lib/net8.0", "de", "fr", "ja", "zh-Hans"]
+
+def get_count(name: str, default: int) -> int:
+    return int(os.environ.get(name, default))
+
+def get_option(args: list[str], name: str) -> str | None:
+    return name in args and args[args.index(name) + 1] or None
+
+def write_if_missing(file: Path, size: int, label: str | None = None):
+    """Writes a file of the given size starting with a label (its name by default), unless it already exists with
+    that label, so rebuilds leave outputs untouched like Ninja does"""
+    label = (label or file.name).encode()
+    if file.exists():
+        with open(file, "rb") as existing:
+            if existing.read(len(label)) == label:
+                return
+    file.parent.mkdir(parents=True, exist_ok=True)
+    file.write_bytes(label.ljust(size, b"\0"))
+
+def get_pgo_label(build_dir: Path) -> str:
+    """Describes how the configured PGO phase instruments a build (I.E. "GENERATE /path/to/pgo"), like the flags CMake adds"""
+    flags = dict(arg[2:].split("=", 1) for arg in (build_dir / "CMakeCache.txt").read_text().split() if arg.startswith("-D") and "=" in arg)
+    return f"{flags.get('TORSION_PGO', 'OFF')} {flags.get('TORSION_PGO_DIR', '')}"
+
+def write_profiles(bin_dir: Path):
+    """Writes a profile for every instrumented library in a folder, like running code built with -fprofile-generate does"""
+    for library in bin_dir.glob("libmod*.so"):
+        phase, _, pgo_dir = library.read_bytes().split(b"\0", 1)[0].decode().partition(" ")
+        if phase == "GENERATE":
+            Path(pgo_dir).mkdir(parents=True, exist_ok=True)
+            (Path(pgo_dir) / f"{library.stem}.gcda").write_text(library.name)
+
+def cmake(args: list[str]) -> int:
+    if "--build" in args:
+        build_dir = Path(get_option(args, "--build"))
+        label = get_pgo_label(build_dir)
+        for module in range(get_count("TORSION_BENCH_MODULES", 4)):
+            write_if_missing(build_dir / f"mod{module}" / f"libmod{module}.so", LIBRARY_SIZE, label)
+        print(f"ninja: built {build_dir}")
+        return 0
+
+    if "--install" in args:
+        build_dir = Path(get_option(args, "--install"))
+        prefix = Path(get_option(args, "--prefix"))
+        installed = []
+        for library in sorted(build_dir.glob("mod*/libmod*.so")):
+            dest = prefix / "bin" / library.name
+            # CMake skips files that are already up to date
+            if dest.exists() and dest.stat().st_mtime_ns == library.stat().st_mtime_ns:
+                print(f"-- Up-to-date: {dest}")
+            else:
+                dest.parent.mkdir(parents=True, exist_ok=True)
+                shutil.copy2(library, dest)
+                print(f"-- Installing: {dest}")
+            installed.append(str(dest))
+        (build_dir / "install_manifest.txt").write_text("\n".join(installed))
+        return 0
+
+    build_dir = Path(get_option(args, "-B"))
+    build_dir.mkdir(parents=True, exist_ok=True)
+    for name in ("CMakeCache.txt", "build.ninja", "cmake_install.cmake"):
+        (build_dir / name).write_text(" ".join(args))
+    print(f"-- Build files have been written to: {build_dir}")
+    return 0
+
+def swig(args: list[str]) -> int:
+    interface = Path(args[-1])
+    outdir = Path(get_option(args, "-outdir"))
+    module = interface.stem
+    Path(get_option(args, "-o")).write_text(f"// SWIG wrapper of {module}\n{interface.read_text()}")
+    (outdir / f"{module}.cs").write_text(f"public class {module} {{}}\n")
+    (outdir / f"{module}PINVOKE.cs").write_text(f"class {module}PINVOKE {{}}\n")
+    return 0
+
+def vcpkg(args: list[str]) -> int:
+    triplet = [arg.split("=", 1)[1] for arg in args if arg.startswith("--triplet=")][0]
+    installed_root = Path("vcpkg_installed")
+    (installed_root / triplet / "include").mkdir(parents=True, exist_ok=True)
+    (installed_root / triplet / "lib").mkdir(parents=True, exist_ok=True)
+
+    # Record every manifest dependency (and its features) in vcpkg's status database
+    paragraphs = []
+    for dependency in json.loads(Path("vcpkg.json").read_text()).get("dependencies", []):
+        name = isinstance(dependency, str) and dependency or dependency["name"]
+        features = not isinstance(dependency, str) and dependency.get("features", []) or []
+        write_if_missing(installed_root / triplet / "lib" / f"lib{name}.a", LIBRARY_SIZE)
+        paragraphs.append(f"Package: {name}\nVersion: 1.0.0\nArchitecture: {triplet}\nStatus: install ok installed")
+        for feature in features:
+            feature = isinstance(feature, dict) and feature["name"] or feature
+            paragraphs.append(f"Package: {name}\nFeature: {feature}\nArchitecture: {triplet}\nStatus: install ok installed")
+    (installed_root / "vcpkg").mkdir(parents=True, exist_ok=True)
+    (installed_root / "vcpkg" / "status").write_text("\n\n".join(paragraphs) + "\n")
+    print(f"Installed {len(paragraphs)} packages for {triplet}")
+    return 0
+
+def dotnet(args: list[str]) -> int:
+    if args[0] == "build-server":
+        return 0
+    if args[0].endswith(".dll"):
+        # Running TestApp (I.E. a PGO training run) exercises the native libraries next to it
+        write_profiles(Path.cwd())
+        return 0
+
+    out_dir = None
+    for arg in args:
+        if arg.startswith(("-p:PublishDir=", "-p:OutDir=")):
+            out_dir = Path(arg.split("=", 1)[1])
+    if out_dir is None:
+        print("error: the fake dotnet needs -p:PublishDir or -p:OutDir")
+        return 1
+
+    assets = get_count("TORSION_BENCH_ASSETS", 500)
+    for asset in range(assets):
+        folder = ASSET_FOLDERS[asset % len(ASSET_FOLDERS)]
+        write_if_missing(out_dir / folder / f"Asset{asset}.dll", ASSET_SIZE)
+    (out_dir / "TestApp.dll").write_bytes(b"TestApp")
+    print(f"TestApp -> {out_dir} ({assets} assets)")
+    return 0
+
+def main() -> int:
+    tool = Path(sys.argv[0]).name
+    args = sys.argv[1:]
+    if not args or args[0] in ("--version", "-version", "version"):
+        print(VERSIONS.get(tool, f"{tool} 1.0.0"))
+        return 0
+
+    match tool:
+        case "cmake":
+            return cmake(args)
+        case "swig":
+            return swig(args)
+        case "vcpkg":
+            return vcpkg(args)
+        case "dotnet":
+            return dotnet(args)
+        case _:
+            print(f"{tool} isn't faked beyond --version")
+            return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
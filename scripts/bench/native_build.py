@@ -0,0 +1,132 @@
+from scripts.build import cxx
+from scripts.build import swig
+from scripts.build import vcpkg
+
+import argparse
+import json
+import shutil
+import statistics
+import time
+
+from pathlib import Path
+
+from scripts import util
+
+BENCH_FOLDER = util.BUILD_DIRECTORY / "bench"
+
+# (unity build, precompiled headers) for every variant that gets compared
+VARIANTS = {
+    "baseline": (False, False),
+    "unity": (True, False),
+    "pch": (False, True),
+    "unity+pch": (True, True),
+}
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compares clean native build times with unity builds and precompiled headers")
+    parser.add_argument(
+        "--compiler",
+        choices=["gcc", "clang", "any"],
+        default="any",
+        help="What tool to compile C++ with")
+    parser.add_argument(
+        "--config",
+        choices=[config.value for config in util.BuildConfig],
+        default="Debug",
+        help="Build configuration to benchmark")
+    parser.add_argument(
+        "--variants",
+        nargs="+",
+        choices=list(VARIANTS),
+        default=list(VARIANTS),
+        help="Which build variants to compare")
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=1,
+        help="How many clean builds to time per variant, the median is reported")
+    parser.add_argument(
+        "--output",
+        type=Path,
+        default=BENCH_FOLDER / "native_build.json",
+        help="Where to write the JSON results")
+    return parser.parse_args()
+
+def time_clean_build(out_dir: Path,
+                     config: util.BuildConfig,
+                     compiler: cxx.CXXCompiler,
+                     unity_build: bool,
+                     precompiled_headers: bool) -> tuple[float, float] | None:
+    """Configures and builds engine/native from scratch
+
+    Note:
+        No compiler cache is used, otherwise later runs would only measure cache hits
+
+    Returns:
+        tuple[float, float]|None: Configure and build seconds, or None if either failed
+    """
+    # Build for this machine like a regular build, "current" would configure a cross build without a triplet
+    host_platform, host_arch = util.get_host_platform()
+
+    start = time.perf_counter()
+    if not cxx.configure(out_dir, config, compiler, host_platform, host_arch, clean_build=True,
+                         unity_build=unity_build, precompiled_headers=precompiled_headers):
+        return None
+    configured = time.perf_counter()
+    if not cxx.build(out_dir):
+        return None
+    return (configured - start, time.perf_counter() - configured)
+
+def bench():
+    args = parse_args() # Parse arguments from cli
+
+    config = util.BuildConfig(args.config)
+    compiler = cxx.CXXCompiler(args.compiler)
+
+    # Every variant compiles the same generated wrappers and installed packages
+    if not vcpkg.build_packages(vcpkg.get_vcpkg_triplet(*util.get_host_platform())):
+        print("Failed to build vcpkg packages, can't benchmark the native build")
+        return
+    if not swig.generate_cs_from_swig(util.SWIG_OUT_FOLDER):
+        print("Failed to generate SWIG wrappers, can't benchmark the native build")
+        return
+
+    results = {}
+    for name in args.variants:
+        unity_build, precompiled_headers = VARIANTS[name]
+        out_dir = BENCH_FOLDER / name
+        runs = []
+        for run in range(args.repeat):
+            print(f"Benchmarking {name} ({run+1}/{args.repeat})...")
+            timing = time_clean_build(out_dir, config, compiler, unity_build, precompiled_headers)
+            if timing is None:
+                print(f"Variant {name} failed to build, skipping it")
+                break
+            runs.append({"configure": timing[0], "build": timing[1]})
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+        if runs:
+            results[name] = {
+                "unity_build": unity_build,
+                "precompiled_headers": precompiled_headers,
+                "runs": runs,
+                "median_build": statistics.median(run["build"] for run in runs),
+            }
+
+    baseline = results.get("baseline", {}).get("median_build")
+    print(f"{'variant':<12} {'build':>9} {'speedup':>8}")
+    for name, result in results.items():
+        speedup = baseline and f"{baseline / result['median_build']:.2f}x" or "-"
+        print(f"{name:<12} {result['median_build']:>8.2f}s {speedup:>8}")
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    args.output.write_text(json.dumps({
+        "config": config.value,
+        "compiler": compiler.value,
+        "repeat": args.repeat,
+        "variants": results,
+    }, indent=4))
+    print(f"Wrote benchmark results to {args.output}")
+
+if __name__ == "__main__":
+    bench()
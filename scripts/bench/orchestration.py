@@ -0,0 +1,258 @@
+from scripts.build import cs
+from scripts.build import cxx
+from scripts.build import swig
+from scripts.build import vcpkg
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+
+from pathlib import Path
+from typing import Callable
+
+from scripts import util
+
+BENCH_FOLDER = util.BUILD_DIRECTORY / "bench"
+WORKSPACE_FOLDER = BENCH_FOLDER / "orchestration"
+
+# Copied into the workspace's bin folder under the name of every tool it stands in for
+FAKE_TOOLCHAIN = Path(__file__).parent / "fake_toolchain.py"
+FAKE_TOOLS = ["cmake", "ninja", "swig", "vcpkg", "dotnet", "clang", "clang++", "gcc", "g++"]
+
+# (native modules, SWIG interfaces, .NET assets) of every project size that gets measured
+SCALES = {
+    "small": (4, 8, 500),
+    "medium": (16, 32, 2000),
+    "large": (64, 128, 8000),
+}
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Times the build orchestration's hot paths against a fake toolchain, "
+                                                 "so the Python overhead is measured without compiling anything")
+    parser.add_argument(
+        "--scales",
+        nargs="+",
+        choices=list(SCALES),
+        default=list(SCALES),
+        help="Which project sizes to measure")
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=5,
+        help="How many times each step is timed per scale, the median is reported")
+    parser.add_argument(
+        "--output",
+        type=Path,
+        default=BENCH_FOLDER / "orchestration.json",
+        help="Where to write the JSON results")
+    parser.add_argument(
+        "--keep",
+        action="store_true",
+        help="Keep the generated workspaces in out/bench/orchestration instead of removing them")
+    parser.add_argument(
+        "--worker",
+        action="store_true",
+        help=argparse.SUPPRESS) # Set when running inside a generated workspace
+    return parser.parse_args()
+
+def create_workspace(folder: Path, modules: int, interfaces: int):
+    """Generates a project with the given number of native modules and SWIG interfaces, plus a bin folder of fake tools
+
+    Note:
+        The scripts are copied in too, so they run against the workspace instead of this project
+    """
+    if folder.exists():
+        shutil.rmtree(folder)
+    shutil.copytree(util.PROJECT_ROOT / "scripts", folder / "scripts", ignore=shutil.ignore_patterns("__pycache__"))
+    shutil.copytree(util.CMAKE_MODULES_FOLDER, folder / "cmake")
+
+    native = folder / "engine" / "native"
+    native.mkdir(parents=True)
+    for manifest in vcpkg.get_manifest_inputs():
+        if manifest.exists():
+            shutil.copy2(manifest, native / manifest.name)
+    (native / "CMakeLists.txt").write_text("project(native)\n" + "".join(f"add_subdirectory(mod{module})\n" for module in range(modules)))
+    for module in range(modules):
+        module_folder = native / f"mod{module}"
+        module_folder.mkdir()
+        (module_folder / "CMakeLists.txt").write_text(f"create_library(mod{module} SHARED mod{module}.cpp)\n")
+        (module_folder / f"mod{module}.h").write_text(f"#pragma once\n\nint mod{module}_value();\n")
+        (module_folder / f"mod{module}.cpp").write_text(f"#include \"mod{module}.h\"\n\nint mod{module}_value() {{ return {module}; }}\n")
+
+    bindings = folder / "engine" / "bindings"
+    bindings.mkdir(parents=True)
+    for interface in range(interfaces):
+        header = f"mod{interface % modules}/mod{interface % modules}.h"
+        (bindings / f"binding{interface}.i").write_text(
+            f"%module binding{interface}\n\n%{{\n#include \"{header}\"\n%}}\n\n%include \"{header}\"\n")
+
+    managed = folder / "engine" / "managed"
+    shutil.copytree(util.CSSOURCE_FOLDER, managed, ignore=shutil.ignore_patterns("bin", "obj", "out"))
+    (managed / "Torsion.sln").write_text("Microsoft Visual Studio Solution File, Format Version 12.00\n")
+
+    bin_folder = folder / "bin"
+    bin_folder.mkdir()
+    script = f"#!{sys.executable}\n{FAKE_TOOLCHAIN.read_text()}"
+    for tool in FAKE_TOOLS:
+        (bin_folder / tool).write_text(script)
+        (bin_folder / tool).chmod(0o755)
+
+def get_workspace_environment(folder: Path, modules: int, assets: int) -> dict[str, str]:
+    """Returns an environment where only the fake tools can be found"""
+    env = {name: value for name, value in os.environ.items()
+           if name not in ("VCPKG_ROOT", "MAKEFLAGS", "CCACHE_DIR", "SCCACHE_DIR", "PYTHONPATH")}
+    env["PATH"] = str(folder / "bin")
+    env["TORSION_BENCH_MODULES"] = str(modules)
+    env["TORSION_BENCH_ASSETS"] = str(assets)
+    return env
+
+def time_step(action: Callable[[], bool], repeat: int, setup: Callable[[], object] | None = None) -> list[float]:
+    """Times an action, running an untimed setup before every run
+
+    Raises:
+        AssertionError: If the action fails, timings of a broken step mean nothing
+    """
+    timings = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        succeeded = action()
+        timings.append(time.perf_counter() - start)
+        if not succeeded:
+            raise AssertionError("A step failed, see bench.log in the workspace")
+    return timings
+
+def run_worker(repeat: int) -> dict[str, list[float]]:
+    """Times every step inside a generated workspace (the current project root)
+
+    Returns:
+        dict[str, list[float]]: The seconds every run of each step took
+    """
+    triplet = vcpkg.get_host_triplet()
+    # Build for the host like a regular build, "current" would be treated as a cross build
+    host_platform, host_arch = util.get_host_platform()
+    swig_out = util.SWIG_OUT_FOLDER
+    cxx_out = util.CXXOUT_FOLDER
+    cs_out = util.CSOUT_FOLDER
+    package = util.PACKAGE_DIRECTORY
+
+    def reset_package():
+        shutil.rmtree(package, ignore_errors=True)
+        (package / "bin").mkdir(parents=True)
+
+    def publish():
+        return cs.compile(cs_out, util.BuildConfig.DEBUG, host_platform, host_arch, publish_dir=util.CSTEMP_OUT_DIR)
+
+    def compile_project(*flags: str) -> Callable[[], bool]:
+        def run() -> bool:
+            # A separate interpreter, so startup and imports are part of the time like they are for users
+            command = [sys.executable, "-m", "scripts.compile", "--compiler-cache=none", "--no-package-store", *flags]
+            result = subprocess.run(command, stdout=sys.stdout, stderr=subprocess.STDOUT)
+            # A failed build still exits cleanly, but it never gets as far as packaging C#
+            return result.returncode == 0 and (package / "bin" / "TestApp.dll").exists()
+        return run
+
+    if not vcpkg.build_packages(triplet):
+        raise AssertionError("The fake vcpkg failed to install packages")
+    if (not cxx.configure(cxx_out, util.BuildConfig.DEBUG, cxx.CXXCompiler.ANY, host_platform, host_arch)
+            or not cxx.build(cxx_out)):
+        raise AssertionError("The fake CMake failed to build the native modules")
+
+    timings = {
+        "vcpkg.are_packages_installed": time_step(lambda: vcpkg.are_packages_installed(triplet), repeat),
+        "swig.generate_cs_from_swig/clean": time_step(lambda: swig.generate_cs_from_swig(swig_out, clean_build=True), repeat),
+        "swig.generate_cs_from_swig/up-to-date": time_step(lambda: swig.generate_cs_from_swig(swig_out), repeat),
+        "cxx.install/fresh": time_step(lambda: cxx.install(cxx_out, package), repeat, reset_package),
+        "cxx.install/up-to-date": time_step(lambda: cxx.install(cxx_out, package), repeat),
+    }
+
+    def fresh_publish():
+        shutil.rmtree(cs_out, ignore_errors=True)
+        reset_package()
+        publish()
+
+    timings["cs.install/fresh"] = time_step(lambda: cs.install(cs_out, package), repeat, fresh_publish)
+    timings["cs.install/republished"] = time_step(lambda: cs.install(cs_out, package), repeat, publish)
+
+    timings["compile/clean"] = time_step(compile_project("--clean"), repeat)
+    timings["compile/no-op"] = time_step(compile_project(), repeat)
+    return timings
+
+def bench_scale(name: str, repeat: int, keep: bool) -> dict | None:
+    """Generates the workspace of a scale and times every step in it
+
+    Returns:
+        dict|None: The scale's sizes and timings, or None if a step failed
+    """
+    modules, interfaces, assets = SCALES[name]
+    folder = WORKSPACE_FOLDER / name
+    print(f"Benchmarking {name} ({modules} modules, {interfaces} interfaces, {assets} .NET assets)...")
+    create_workspace(folder, modules, interfaces)
+
+    results_file = folder / "results.json"
+    log_file = folder / "bench.log"
+    with open(log_file, "w") as log:
+        result = subprocess.run(
+            [sys.executable, "-m", "scripts.bench.orchestration", "--worker",
+             f"--repeat={repeat}", f"--output={results_file}"],
+            cwd=folder, env=get_workspace_environment(folder, modules, assets), stdout=log, stderr=subprocess.STDOUT)
+
+    if result.returncode != 0:
+        print(f"Scale {name} failed, see {log_file}")
+        return None
+    timings = json.loads(results_file.read_text())
+    if not keep:
+        shutil.rmtree(folder)
+
+    return {
+        "modules": modules,
+        "interfaces": interfaces,
+        "assets": assets,
+        "steps": {step: {"runs": runs, "median": statistics.median(runs)} for step, runs in timings.items()},
+    }
+
+def bench():
+    args = parse_args() # Parse arguments from cli
+
+    if args.worker:
+        try:
+            timings = run_worker(args.repeat)
+        except AssertionError as err:
+            print(f"Benchmark failed: {err}")
+            sys.exit(1)
+        args.output.write_text(json.dumps(timings, indent=4))
+        return
+
+    if os.name != "posix":
+        print("The fake toolchain is started through #! scripts, benchmarking orchestration needs Linux or macOS")
+        return
+
+    results = {}
+    for name in args.scales:
+        result = bench_scale(name, args.repeat, args.keep)
+        if result is not None:
+            results[name] = result
+
+    steps = list(dict.fromkeys(step for result in results.values() for step in result["steps"]))
+    print(f"{'step':<40}" + "".join(f"{name:>10}" for name in results))
+    for step in steps:
+        medians = [result["steps"].get(step, {}).get("median") for result in results.values()]
+        print(f"{step:<40}" + "".join(median is None and f"{'-':>10}" or f"{median * 1000:>8.1f}ms" for median in medians))
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    args.output.write_text(json.dumps({
+        "python": platform.python_version(),
+        "repeat": args.repeat,
+        "scales": results,
+    }, indent=4))
+    print(f"Wrote benchmark results to {args.output}")
+
+if __name__ == "__main__":
+    bench()
@@ -0,0 +1,144 @@
+import argparse
+import compileall
+import json
+import platform
+import subprocess
+import sys
+
+from pathlib import Path
+
+from scripts import backends
+from scripts import util
+
+BENCH_FOLDER = util.BUILD_DIRECTORY / "bench"
+
+# How many milliseconds scripts.compile may spend importing, on top of what the interpreter itself imports
+IMPORT_BUDGET_MS = 120
+
+# Invocations whose startup gets measured, by the arguments scripts.compile gets (none only imports it)
+COMMANDS = {
+    "import": [],
+    "--help": ["--help"],
+}
+
+# Slow to import and only needed once something runs, none of them may be loaded by the commands above
+DEFERRED_MODULES = ["asyncio", "concurrent.futures", "ctypes", "tkinter"]
+
+# Runs a command's startup in-process, then prints which deferred modules and backends ended up loaded
+PROBE = """
+import json, sys, types
+sys.argv = ["compile.py", *{argv!r}]
+import scripts.compile
+if sys.argv[1:]:
+    try:
+        scripts.compile.compile()
+    except SystemExit:
+        pass
+# Backends that were never used are still lazy modules, a loaded one is a plain module
+loaded = [name for name in {modules!r} if type(sys.modules.get(name)) is types.ModuleType]
+print(json.dumps(loaded), file=sys.stderr)
+"""
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Measures how long scripts.compile takes to import and to print --help, "
+                                                 "and fails if it's over budget or loads modules it should defer")
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=15,
+        help="How many times each command is started, the median is reported")
+    parser.add_argument(
+        "--budget",
+        type=float,
+        default=IMPORT_BUDGET_MS,
+        help="How many milliseconds of imports each command may take")
+    parser.add_argument(
+        "--output",
+        type=Path,
+        default=BENCH_FOLDER / "startup.json",
+        help="Where to write the JSON results")
+    return parser.parse_args()
+
+def parse_import_times(output: str) -> dict[str, int]:
+    """Reads the modules imported at the top level, and how many microseconds each took including what it imported
+
+    Args:
+        output: What python -X importtime wrote to stderr
+    """
+    times = {}
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line.split("|")
+        # Nested imports are indented below their importer, and the header isn't a number
+        if name.startswith("  ") or not cumulative.strip().isdigit():
+            continue
+        times[name.strip()] = int(cumulative)
+    return times
+
+def measure(arguments: list[str], repeat: int) -> tuple[float, dict[str, int]]:
+    """Starts the interpreter with the given arguments repeatedly under -X importtime
+
+    Returns:
+        tuple[float, dict[str, int]]: The median milliseconds spent importing, and the top level imports of the median run
+    """
+    runs = []
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, "-X", "importtime", *arguments],
+                                cwd=util.PROJECT_ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        times = parse_import_times(result.stderr)
+        runs.append((sum(times.values()) / 1000, times))
+    runs.sort(key=lambda run: run[0])
+    return runs[len(runs) // 2]
+
+def get_interpreter_arguments(argv: list[str]) -> list[str]:
+    """Returns how the interpreter is started to run scripts.compile with the given arguments, or only import it without any"""
+    return argv and ["-m", "scripts.compile", *argv] or ["-c", "import scripts.compile"]
+
+def get_loaded_modules(argv: list[str]) -> list[str]:
+    """Returns the deferred modules and backends a command loads before it gets to work"""
+    modules = DEFERRED_MODULES + list(backends.BACKENDS.values())
+    result = subprocess.run([sys.executable, "-c", PROBE.format(argv=argv, modules=modules)],
+                            cwd=util.PROJECT_ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    return json.loads(result.stderr.splitlines()[-1])
+
+def bench():
+    args = parse_args() # Parse arguments from cli
+
+    # Measure starts with up to date bytecode like users get, PYTHONDONTWRITEBYTECODE would compile every source each run
+    compileall.compile_dir(util.PROJECT_ROOT / "scripts", quiet=1)
+
+    interpreter, _ = measure(["-c", "pass"], args.repeat)
+    print(f"The interpreter alone imports for {interpreter:.1f}ms, which isn't counted")
+
+    results = {}
+    over_budget = False
+    for name, argv in COMMANDS.items():
+        total, times = measure(get_interpreter_arguments(argv), args.repeat)
+        elapsed = total - interpreter
+        loaded = get_loaded_modules(argv)
+        results[name] = {"import_ms": elapsed, "loaded": loaded, "imports": times}
+
+        status = elapsed <= args.budget and "ok" or "OVER BUDGET"
+        print(f"{name:<10} {elapsed:>7.1f}ms of imports (budget {args.budget:.0f}ms) {status}")
+        slowest = sorted(times.items(), key=lambda item: item[1], reverse=True)[:5]
+        print(f"           slowest: {', '.join(f'{module} {microseconds / 1000:.1f}ms' for module, microseconds in slowest)}")
+        if loaded:
+            print(f"           loads {', '.join(loaded)}, which should only be imported once something runs")
+        over_budget |= elapsed > args.budget or bool(loaded)
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    args.output.write_text(json.dumps({
+        "python": platform.python_version(),
+        "repeat": args.repeat,
+        "budget_ms": args.budget,
+        "interpreter_ms": interpreter,
+        "commands": results,
+    }, indent=4))
+    print(f"Wrote benchmark results to {args.output}")
+
+    if over_budget:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    bench()
@@ -0,0 +1,106 @@
+import os
+
+from enum import Enum
+from pathlib import Path
+
+from scripts import process
+from scripts import toolchain
+from scripts import util
+
+class CompilerCache(Enum):
+    CCACHE = "ccache"
+    SCCACHE = "sccache"
+    AUTO = "auto"
+    NONE = "none"
+
+# Environment variable each tool reads its cache folder from
+CACHE_DIR_VARIABLES = {
+    CompilerCache.CCACHE: "CCACHE_DIR",
+    CompilerCache.SCCACHE: "SCCACHE_DIR",
+}
+
+COMPILER_CACHE_FOLDER = util.CACHE_DIRECTORY / "compiler"
+
+class CompilerCacheSettings:
+    """A compiler cache that was found on this system, along with the folder it caches into
+
+    Args:
+        tool: Which compiler cache this is
+        executable: The path to the compiler cache executable
+        folder: The folder the cache stores objects in
+    """
+
+    def __init__(self, tool: CompilerCache, executable: str, folder: Path):
+        self.tool = tool
+        self.executable = executable
+        self.folder = folder
+
+    def get_configure_flags(self) -> list[str]:
+        """Returns the CMake flags that launch every compile through the cache"""
+        return [
+            f"-DCMAKE_C_COMPILER_LAUNCHER={self.executable}",
+            f"-DCMAKE_CXX_COMPILER_LAUNCHER={self.executable}"
+        ]
+
+    def get_environment(self, env: dict[str, str] | None = None) -> dict[str, str]:
+        """Returns an environment pointing the cache at its folder
+
+        Args:
+            env: The environment to extend, defaults to ours
+
+        Returns:
+            dict[str, str]: A copy of the environment with the cache variables set
+        """
+        env = dict(env or os.environ)
+        env[CACHE_DIR_VARIABLES[self.tool]] = str(self.folder)
+        if self.tool == CompilerCache.CCACHE:
+            # Hash paths relative to the project so different checkouts share hits
+            env["CCACHE_BASEDIR"] = str(util.PROJECT_ROOT)
+        return env
+
+    def zero_stats(self):
+        """Resets the hit/miss counters so the stats printed after a build only cover that build"""
+        self.folder.mkdir(parents=True, exist_ok=True)
+        process.run([self.executable, "--zero-stats"], env=self.get_environment(), capture_output=True)
+
+    def print_stats(self):
+        """Prints the cache's hit/miss statistics"""
+        result = process.run([self.executable, "--show-stats"], env=self.get_environment(), capture_output=True)
+        if result.returncode != 0:
+            print(f"Failed to query {self.tool.value} statistics: {result.stderr}")
+            return
+        print(f"{self.tool.value} statistics ({self.folder}):")
+        print(result.stdout.rstrip())
+
+def find_compiler_cache(choice: CompilerCache, folder: Path, key: str) -> CompilerCacheSettings | None:
+    """Looks for a compiler cache to launch compiles through
+
+    Note:
+        With ccache every key gets its own cache folder, so builds with different compilers or
+        triplets never see each other's objects. sccache's server reads its folder once when it
+        starts and then serves every build, so it keeps a single folder for all keys (its hashes
+        include the compiler and its flags, so different builds still can't share objects)
+
+    Args:
+        choice: The compiler cache to use, AUTO picks ccache then sccache
+        folder: The folder caches are kept in
+        key: What separates this build's cache from others (I.E. "clang++-x64-linux")
+
+    Returns:
+        CompilerCacheSettings|None: The cache to use, or None if caching is off or nothing was found
+    """
+    if choice == CompilerCache.NONE:
+        return None
+
+    candidates = choice == CompilerCache.AUTO and [CompilerCache.CCACHE, CompilerCache.SCCACHE] or [choice]
+    for tool in candidates:
+        executable = toolchain.get_toolchain().which(tool.value)
+        if executable is None:
+            continue
+        if tool == CompilerCache.SCCACHE:
+            return CompilerCacheSettings(tool, executable, folder / tool.value)
+        return CompilerCacheSettings(tool, executable, folder / tool.value / key)
+
+    if choice != CompilerCache.AUTO:
+        print(f"Compiler cache {choice.value} was requested but isn't in PATH, building without it.")
+    return None
@@ -1,13 +1,78 @@
 import os
 import shutil
-import subprocess
+import threading
 
 from enum import Enum
 from pathlib import Path
-from tkinter import NO
 
+from scripts import install as installer
+from scripts import process
+from scripts import toolchain
 from scripts import util
 
+class CSPublishMode(Enum):
+    JIT = "jit" # Framework-dependent IL, compiled by the JIT as it runs
+    R2R = "r2r" # IL shipped with ReadyToRun native code, the JIT only recompiles hot methods
+    AOT = "aot" # NativeAOT, one self-contained native executable without a JIT
+
+class CSPublishSettings:
+    """How C# projects get published
+
+    Note:
+        Trimming needs the runtime to be published alongside the app, so trimmed
+        builds are self-contained, NativeAOT builds are always trimmed
+
+    Args:
+        mode: How managed code gets compiled
+        trim: Whether code the app never references is removed from the output
+        tiered_pgo: Whether the JIT optimizes hot methods with profiles it records as the app runs,
+            None keeps the runtime's default (on since .NET 8), ignored by NativeAOT
+    """
+
+    def __init__(self, mode: CSPublishMode = CSPublishMode.JIT, trim: bool = False, tiered_pgo: bool | None = None):
+        self.mode = mode
+        self.trim = trim
+        self.tiered_pgo = tiered_pgo
+
+    def is_self_contained(self) -> bool:
+        """Returns whether the .NET runtime gets published alongside the app"""
+        return self.mode == CSPublishMode.AOT or self.trim
+
+    def get_publish_flags(self) -> list[str]:
+        """Returns the dotnet publish flags for these settings"""
+        flags = ["--self-contained", self.is_self_contained() and "true" or "false"]
+
+        match self.mode:
+            case CSPublishMode.R2R:
+                flags.append("-p:PublishReadyToRun=true")
+            case CSPublishMode.AOT:
+                flags.append("-p:PublishAot=true")
+
+        if self.trim and self.mode != CSPublishMode.AOT:
+            flags.append("-p:PublishTrimmed=true")
+        if self.tiered_pgo is not None:
+            flags.append(f"-p:TieredPGO={self.tiered_pgo and 'true' or 'false'}")
+        return flags
+
+    def describe(self) -> str:
+        """Summarizes these settings for printing (I.E. "r2r, trimmed")"""
+        parts = [self.mode.value]
+        if self.trim and self.mode != CSPublishMode.AOT:
+            parts.append("trimmed")
+        if self.tiered_pgo is not None:
+            parts.append(f"tiered PGO {self.tiered_pgo and 'on' or 'off'}")
+        return ", ".join(parts)
+
+# Every publish shares the obj folders next to the projects, so only one runs at a time
+_publish_lock = threading.Lock()
+
+# How long output of build() is read after dotnet exits, the build servers it leaves running
+# hold on to its pipes but its own output has long been read by then
+BUILD_SERVER_DRAIN_TIMEOUT = 0.5
+
+# Lists the C# files install() put into a package, so the next install can remove the ones it no longer has
+INSTALL_MANIFEST = ".cs-install-manifest"
+
 def is_dotnet_available() -> bool:
     """Checks if this system installed .NET
 
@@ -15,98 +80,220 @@ def is_dotnet_available() -> bool:
         bool: True if .NET is available, or False if it isn't
     """
 
-    return shutil.which("dotnet") is not None
+    return toolchain.get_toolchain().which("dotnet") is not None
 
 def clean(out_dir: Path):
     if out_dir.exists():
         shutil.rmtree(out_dir)
         print(f"C# output folder at {out_dir} exists, removing...")
 
+def clean_intermediates():
+    """Removes the obj/bin folders MSBuild keeps next to every C# project"""
+    for project in util.CSSOURCE_FOLDER.rglob("*.csproj"):
+        for folder in (project.parent / "obj", project.parent / "bin"):
+            if folder.exists():
+                shutil.rmtree(folder)
+                print(f"C# intermediate folder at {folder} exists, removing...")
+
+def get_project_inputs() -> list[Path]:
+    """Collects every file that can affect the managed build
+
+    Returns:
+        list[Path]: Sources, projects and Directory.Build.props under engine/managed, minus build output
+    """
+    return util.collect_files(util.CSSOURCE_FOLDER, ["bin", "obj", util.CSTEMP_OUT_DIR.name])
+
+def get_dotnet_configuration(config: util.BuildConfig) -> str:
+    """Returns the MSBuild configuration for a build config
+
+    Note:
+        MSBuild only optimizes its Release configuration, so Profile and Shipping builds use it
+
+    Returns:
+        str: Debug or Release
+    """
+    match config:
+        case util.BuildConfig.DEBUG:
+            return "Debug"
+        case _:
+            return "Release"
+
+def get_solution_file() -> Path | None:
+    """Returns the root solution (.sln) in engine/managed, or None if there is none"""
+    for file in util.CSSOURCE_FOLDER.iterdir():
+        if file.name.endswith(".sln"):
+            return file
+    return None
+
+def get_node_count(jobs: int | None) -> int:
+    """Returns how many MSBuild nodes may run at once, all cores but one unless jobs says otherwise"""
+    if jobs is None:
+        cpu_cores = os.cpu_count() or 1
+        return max(1, cpu_cores - 1)
+    return max(1, jobs)
+
 def compile(out_dir: Path, 
             config: util.BuildConfig = util.BuildConfig.DEBUG, 
             target_platform: util.Platform = util.Platform.CURRENT,
-           target_arch: util.Architecture = util.Architecture.CURRENT) -> bool:
+           target_arch: util.Architecture = util.Architecture.CURRENT,
+           clean_build: bool = False,
+           jobs: int | None = None,
+           publish: CSPublishSettings | None = None,
+           publish_dir: Path = util.CSTEMP_OUT_DIR) -> bool:
     """Compiles C# solutions (.sln) and outputs into a directory
 
+    Note:
+        Unless clean_build is set, the obj/bin trees are kept so MSBuild can build incrementally.
+        Publishes of different targets wait for each other since they share those trees
+
     Args:
         out_dir: The path to the output directory
         config: The configuration to use for the build (Debug/Release Build)
+        clean_build: Whether to remove all previous C# build output first
+        jobs: How many MSBuild nodes may run at once, or None to use all cores but one
+        publish: How projects get published (JIT, ReadyToRun or NativeAOT), defaults to framework-dependent JIT
+        publish_dir: Where dotnet publish writes to, install() moves it into out_dir from there
 
     Returns:
         bool: True if .NET compilation succeeded, or False if it failed to compile
     """
 
     # Ensure .NET exists
-    dotnet = shutil.which("dotnet")
+    dotnet = toolchain.get_toolchain().which("dotnet")
     if dotnet is None:
-        print(f"Failed to start compilation due to .NET SDK not being installed, please install it.")
+        print("Failed to start compilation due to .NET SDK not being installed, please install it.")
         return False
     
-    if util.CSTEMP_OUT_DIR.exists():
-        shutil.rmtree(util.CSTEMP_OUT_DIR)
+    if publish_dir.exists():
+        shutil.rmtree(publish_dir)
 
     # Get out directory
-    clean(out_dir)
-    out_dir.mkdir(parents=True)
-
-    # Get optimal core count
-    cpu_cores = os.cpu_count() or 1
-    max_cores = max(1, cpu_cores - 1)
+    if clean_build:
+        clean(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
 
-    # Get root solution
-    solution_file = None
-    for file in util.CSSOURCE_FOLDER.iterdir():
-        if not file.name.endswith(".sln"):
-            continue
-        solution_file = file
-        break
+    max_cores = get_node_count(jobs)
 
+    solution_file = get_solution_file()
     if solution_file is None:
         print(f"No solutions (.sln) found in {util.CSSOURCE_FOLDER}, please create one.")
         return False
 
     dotnet_platform = util.platform_to_cs_platform(target_platform) + "-" + target_arch.value
+    publish = publish or CSPublishSettings()
 
-    print(f"Building C# root solution at {solution_file} with platform {dotnet_platform}")
+    print(f"Building C# root solution at {solution_file} with platform {dotnet_platform} ({publish.describe()})")
 
     # Build project
-    result = subprocess.run([
-        "dotnet", "publish", str(solution_file),
-        "-c", config.value,
-        "--self-contained", "false",
-        "-r", dotnet_platform,
-        f"-maxcpucount:{max_cores}",
-        "--verbosity", "minimal"
-    ])
+    with _publish_lock:
+        if clean_build:
+            clean_intermediates()
+        result = process.run([
+            "dotnet", "publish", str(solution_file),
+            "-c", get_dotnet_configuration(config),
+            *publish.get_publish_flags(),
+            "-r", dotnet_platform,
+            # Overrides Directory.Build.props, MSBuild needs the trailing separator
+            f"-p:PublishDir={publish_dir.absolute()}{os.sep}",
+            f"-maxcpucount:{max_cores}",
+            "--verbosity", "minimal"
+        ])
 
     if result.returncode != 0:
-       print(f"Failed to build {solution_file.name}, {result.stderr}")
+       print(f"Failed to build {solution_file.name}, {result.describe_failure()}")
        return False
 
-    print(f"Successfully built C# project to temporary output {util.CSTEMP_OUT_DIR}")
+    print(f"Successfully built C# project to temporary output {publish_dir} ({util.format_size(util.get_folder_size(publish_dir))})")
 
     return True
 
-def install(out_dir: Path, to_dir: Path) -> bool:
+def build(out_dir: Path,
+          config: util.BuildConfig = util.BuildConfig.DEBUG,
+          target_platform: util.Platform = util.Platform.CURRENT,
+          target_arch: util.Architecture = util.Architecture.CURRENT,
+          jobs: int | None = None,
+          publish_dir: Path = util.CSTEMP_OUT_DIR) -> bool:
+    """Builds C# solutions without publishing them, for quick rebuilds while iterating (I.E. --watch)
+
+    Note:
+        MSBuild's worker nodes and the Roslyn compiler server keep running after the build,
+        so the next one skips SDK and compiler startup. The output is always framework-dependent
+        JIT code, publish modes only apply to compile()
+
+    Args:
+        out_dir: The path to the output directory
+        config: The configuration to use for the build (Debug/Release Build)
+        jobs: How many MSBuild nodes may run at once, or None to use all cores but one
+        publish_dir: Where the build output goes, install() moves it into out_dir from there
+
+    Returns:
+        bool: True if .NET compilation succeeded, or False if it failed to compile
+    """
+    if toolchain.get_toolchain().which("dotnet") is None:
+        print("Failed to start compilation due to .NET SDK not being installed, please install it.")
+        return False
+
+    solution_file = get_solution_file()
+    if solution_file is None:
+        print(f"No solutions (.sln) found in {util.CSSOURCE_FOLDER}, please create one.")
+        return False
+
+    if publish_dir.exists():
+        shutil.rmtree(publish_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    dotnet_platform = util.platform_to_cs_platform(target_platform) + "-" + target_arch.value
+    print(f"Building C# root solution at {solution_file} with platform {dotnet_platform} (build servers kept warm)")
+
+    with _publish_lock:
+        result = process.run([
+            "dotnet", "build", str(solution_file),
+            "-c", get_dotnet_configuration(config),
+            "-r", dotnet_platform,
+            "--self-contained", "false",
+            f"-p:OutDir={publish_dir.absolute()}{os.sep}",
+            "-p:UseSharedCompilation=true",
+            "-nodeReuse:true",
+            f"-maxcpucount:{get_node_count(jobs)}",
+            "--verbosity", "minimal"
+        ], drain_timeout=BUILD_SERVER_DRAIN_TIMEOUT)
+
+    if result.returncode != 0:
+       print(f"Failed to build {solution_file.name}, {result.describe_failure()}")
+       return False
+
+    print(f"Successfully built C# project to temporary output {publish_dir} ({util.format_size(util.get_folder_size(publish_dir))})")
+    return True
+
+def shutdown_build_servers():
+    """Stops the MSBuild nodes and compiler server build() leaves running"""
+    if toolchain.get_toolchain().which("dotnet") is None:
+        return
+    result = process.run(["dotnet", "build-server", "shutdown"], capture_output=True, drain_timeout=BUILD_SERVER_DRAIN_TIMEOUT)
+    if result.returncode != 0:
+        print(f"Failed to shut down .NET build servers: {result.describe_failure()}")
+
+def install(out_dir: Path, to_dir: Path, publish_dir: Path = util.CSTEMP_OUT_DIR) -> bool:
     """Installs all runtime files into a different directory
 
+    Args:
+        out_dir: The C# output folder, fresh output is moved into it first
+        to_dir: The package to install into
+        publish_dir: Where compile() published to
+
     Returns:
         bool: True if installation succeeded, or False if it failed
     """
 
     # Move all files from the temporary output directory to the output directory
-    if not util.CSTEMP_OUT_DIR.exists():
-        print(f"C# temporary output directory not found! {util.CSTEMP_OUT_DIR}")
-        return False
-    for item in util.CSTEMP_OUT_DIR.iterdir():
-        if item.is_file():
-            shutil.copy2(item, out_dir / item.name)
-        elif item.is_dir():
-            shutil.copytree(item, out_dir / item.name)
-    print(f"Moved C# output from {util.CSTEMP_OUT_DIR} to {out_dir}")
-
-    # Remove the temporary output directory
-    shutil.rmtree(util.CSTEMP_OUT_DIR)
+    # (there is nothing to move if compilation was skipped since its output is already in place)
+    # Moving also removes the temporary output directory
+    if publish_dir.exists():
+        # Files only an earlier config or publish mode produced (I.E. the NativeAOT binary) mustn't linger
+        counts = installer.move_tree(publish_dir, out_dir, mirror=True)
+        print(f"Moved C# output from {publish_dir} to {out_dir} ({installer.describe(counts)})")
+    else:
+        print(f"C# temporary output directory not found, installing previous output from {out_dir}")
 
     # Ensure the output exists
     if not out_dir.exists():
@@ -126,11 +313,8 @@ def install(out_dir: Path, to_dir: Path) -> bool:
 
     print(f"Installing C# {out_dir} -> {bin_dir}")
 
-    # Copy all files from C# output folder to packaged directory
-    for item in out_dir.iterdir():
-        if item.is_file():
-            shutil.copy2(item, bin_dir / item.name)
-        elif item.is_dir():
-            shutil.copytree(item, bin_dir / item.name)
-    print(f"Succeeded in installing C# {out_dir} -> {bin_dir}")
+    # Link or copy all files from C# output folder to packaged directory
+    # bin also holds the native libraries, only C# files the last install put there are removed
+    counts = installer.install_tree(out_dir, bin_dir, to_dir / INSTALL_MANIFEST)
+    print(f"Succeeded in installing C# {out_dir} -> {bin_dir} ({installer.describe(counts)})")
     return True
\ No newline at end of file
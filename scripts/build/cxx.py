@@ -1,15 +1,16 @@
 from . import vcpkg
+from .compiler_cache import CompilerCacheSettings
+from .optimization import OptimizationSettings
 
-import glob
-import platform
 import shutil
-import subprocess
 
 from enum import Enum
 from pathlib import Path
 
+from scripts import jobs as job_budget
+from scripts import process
+from scripts import toolchain
 from scripts import util
-import os
 
 class CXXCompiler(Enum):
     GCC = "gcc"
@@ -21,6 +22,9 @@ CXXCOMPILER_MAP = {
     CXXCompiler.CLANG: [("clang", "clang++")]
 }
 
+# Written into the CMake build tree after a successful configure
+CONFIGURE_STAMP = ".torsion-configure"
+
 def get_any_compiler(platform: util.Platform) -> tuple[str, str] | None:
     """Looks for any C and C++ compiler available on the system
     
@@ -48,14 +52,7 @@ def get_c_compilers(compiler: CXXCompiler) -> tuple[Path, Path] | None:
         tuple[Path, Path]|None: paths to the compilers (C compiler Path, C++ compiler path), or None if failed to find both
     """
     
-    for c_compiler, cxx_compiler in CXXCOMPILER_MAP[compiler]:
-        c_path = shutil.which(c_compiler)
-        cxx_path = shutil.which(cxx_compiler)
-
-        if not c_path or not cxx_path:
-            continue
-        return (c_compiler, cxx_compiler)
-    return None
+    return toolchain.get_toolchain().find_compilers(CXXCOMPILER_MAP[compiler])
 
 def clean(out_dir: Path):
     """Cleans the cmake folder at the specified directory"""
@@ -63,25 +60,80 @@ def clean(out_dir: Path):
         shutil.rmtree(out_dir)
         print(f"C++ output folder at {out_dir} exists, removing...")
 
-def compile(out_dir: Path, 
+def get_configure_inputs() -> list[Path]:
+    """Collects every file that CMake reads while configuring the native project
+
+    Returns:
+        list[Path]: The CMakeLists.txt files under engine/native and the helper modules under cmake/
+    """
+    inputs = [
+        item for item in util.CXXSOURCE_FOLDER.rglob("CMakeLists.txt")
+        if "vcpkg_installed" not in item.parts
+    ]
+    inputs.extend(util.CMAKE_MODULES_FOLDER.rglob("*.cmake"))
+    inputs.append(util.CXXSOURCE_FOLDER / "vcpkg.json")
+    return inputs
+
+def get_source_inputs() -> list[Path]:
+    """Collects every file that can affect the native build
+
+    Returns:
+        list[Path]: All files under engine/native (minus installed vcpkg packages) and cmake/
+    """
+    inputs = util.collect_files(util.CXXSOURCE_FOLDER, ["vcpkg_installed"])
+    inputs.extend(util.collect_files(util.CMAKE_MODULES_FOLDER))
+    return inputs
+
+def is_configured(out_dir: Path, fingerprint: str) -> bool:
+    """Checks if the CMake build tree was already configured with the same inputs
+
+    Args:
+        out_dir: The CMake build tree
+        fingerprint: The fingerprint of the current configure inputs
+
+    Returns:
+        bool: True if configuring again would produce the same build tree, or False if it wouldn't
+    """
+    stamp = out_dir / CONFIGURE_STAMP
+    if not stamp.exists():
+        return False
+    if not (out_dir / "CMakeCache.txt").exists() or not (out_dir / "build.ninja").exists():
+        return False
+    return stamp.read_text().strip() == fingerprint
+
+def configure(out_dir: Path, 
                 config: util.BuildConfig = util.BuildConfig.DEBUG, 
                 compiler: CXXCompiler = CXXCompiler.GCC,
                 target_platform: util.Platform = util.Platform.CURRENT,
-                target_arch: util.Architecture = util.Architecture.CURRENT) -> bool:
+                target_arch: util.Architecture = util.Architecture.CURRENT,
+                clean_build: bool = False,
+                compiler_cache: CompilerCacheSettings | None = None,
+                unity_build: bool = False,
+                precompiled_headers: bool = False,
+                optimization: OptimizationSettings | None = None) -> bool:
     """
-    Compiles all engine/native code into a out directory for installation
+    Configures the CMake build tree for engine/native
+
+    Note:
+        Unless clean_build is set, the CMake/Ninja tree is kept between runs and the
+        configure step is skipped when its inputs haven't changed
 
     Args:
-        out_dir: The folder to output the compiled files
+        out_dir: The folder to configure the build tree in
         config: The build config to use
         compiler: The compiler to use
+        clean_build: Whether to remove the previous build tree and configure from scratch
+        compiler_cache: The compiler cache to launch compiles through, or None to compile directly
+        unity_build: Whether to batch each library's sources into unity translation units
+        precompiled_headers: Whether to share one precompiled header of SDL/STL/SWIG runtime headers between libraries
+        optimization: LTO, CPU tuning and PGO settings, or None for the defaults
 
     Returns:
-        bool: True if CMake compilation succeeded, or False if it failed to compile
+        bool: True if CMake configured the project, or False if it failed to
     """
 
     # Ensure CMake exists
-    cmake = shutil.which("cmake")
+    cmake = toolchain.get_toolchain().which("cmake")
     if cmake is None:
         print("CMake cannot be discovered, please install or add it to PATH and run this script again.")
         return False
@@ -105,9 +157,10 @@ def compile(out_dir: Path,
     c_compiler, cxx_compiler = compilers
     
     # Get CMake output folder
-    clean(out_dir)
+    if clean_build:
+        clean(out_dir)
 
-    out_dir.mkdir(parents=True)
+    out_dir.mkdir(parents=True, exist_ok=True)
     
     # Configure CMake build
     configure_cmd = [
@@ -117,14 +170,26 @@ def compile(out_dir: Path,
         "-B", str(out_dir),
         f"-DCMAKE_BUILD_TYPE={config.value}",
         f"-DCMAKE_C_COMPILER={c_compiler}",
-        f"-DCMAKE_CXX_COMPILER={cxx_compiler}"
+        f"-DCMAKE_CXX_COMPILER={cxx_compiler}",
+        # Always passed so turning an option off takes effect in an existing build tree
+        f"-DTORSION_UNITY_BUILD={unity_build and 'ON' or 'OFF'}",
+        f"-DTORSION_PRECOMPILED_HEADERS={precompiled_headers and 'ON' or 'OFF'}",
+        *(optimization or OptimizationSettings()).get_configure_flags()
     ]
 
     # Only add vcpkg toolchain if it exists
-    toolchain = vcpkg.get_toolchain_file()
-    if toolchain:
-        configure_cmd.append(f"-DCMAKE_TOOLCHAIN_FILE={toolchain}")
-        print(f"Using vcpkg toolchain: {toolchain}")
+    toolchain_file = vcpkg.get_toolchain_file()
+    if toolchain_file:
+        configure_cmd.append(f"-DCMAKE_TOOLCHAIN_FILE={toolchain_file}")
+        print(f"Using vcpkg toolchain: {toolchain_file}")
+
+    # Launch compiles through a compiler cache if one was found
+    if compiler_cache:
+        configure_cmd.extend(compiler_cache.get_configure_flags())
+        print(f"Using compiler cache: {compiler_cache.executable} ({compiler_cache.folder})")
+    else:
+        # Clear launchers an earlier configure of this build tree may have cached
+        configure_cmd.extend(["-DCMAKE_C_COMPILER_LAUNCHER=", "-DCMAKE_CXX_COMPILER_LAUNCHER="])
 
     # Add cross compilation flags if we are compiling to a different platform/architecture
     if is_cross_compiling:
@@ -133,23 +198,80 @@ def compile(out_dir: Path,
     else:
         print(f"Building for host platform: {target_platform.value}-{target_arch.value}")
 
-    print("Configuring CMake...")
-    result = subprocess.run(configure_cmd)
-    if result.returncode != 0:
-        print(f"CMake failed to configure the project: {result.stderr}")
+    # Skip configuring if nothing that CMake reads has changed since the last run
+    tools = toolchain.get_toolchain()
+    triplet = vcpkg.get_vcpkg_triplet(target_platform, target_arch)
+    fingerprint = util.hash_inputs(
+        get_configure_inputs(),
+        [*configure_cmd, tools.version(c_compiler), tools.version(cxx_compiler), triplet.value])
+    stamp = out_dir / CONFIGURE_STAMP
+
+    if is_configured(out_dir, fingerprint):
+        print("CMake configure inputs are unchanged, skipping configure...")
+    else:
+        stamp.unlink(missing_ok=True)
+
+        print("Configuring CMake...")
+        result = process.run(configure_cmd, env=compiler_cache and compiler_cache.get_environment())
+        if result.returncode != 0:
+            print(f"CMake failed to configure the project: {result.describe_failure()}")
+            return False
+        
+        stamp.write_text(fingerprint)
+        print("CMake successfully configured the project")
+    return True
+
+def build(out_dir: Path,
+          jobs: int | None = None,
+          compiler_cache: CompilerCacheSettings | None = None,
+          jobserver: job_budget.Jobserver | None = None) -> bool:
+    """
+    Builds an already configured CMake build tree
+
+    Note:
+        Ninja 1.13+ joins the jobserver, so every native build running at once shares its
+        jobs. Older versions are given a fixed job count instead
+
+    Args:
+        out_dir: The configured CMake build tree
+        jobs: How many compile jobs Ninja may run at once, or None to use all cores
+        compiler_cache: The compiler cache the tree was configured with, used for its folder and stats
+        jobserver: A jobserver to take jobs from instead of using a fixed count
+
+    Returns:
+        bool: True if CMake built the project, or False if it failed to build
+    """
+
+    # Ensure CMake exists
+    if toolchain.get_toolchain().which("cmake") is None:
+        print("CMake cannot be discovered, please install or add it to PATH and run this script again.")
         return False
-    
-    print("CMake successfully configured the project")
 
     # Build CMake project
     print("Building CMake...")
-    result = subprocess.run([
+    build_cmd = [
         "cmake",
         "--build", str(out_dir),
         "--parallel" # Helps with build times by using all available cores
-    ])
+    ]
+    env = compiler_cache and compiler_cache.get_environment()
+    if jobserver and job_budget.supports_jobserver(toolchain.get_toolchain().version("ninja")):
+        # Ninja only joins the jobserver when it isn't given a job count
+        env = jobserver.get_environment(env)
+        print(f"Ninja is taking its jobs from the build's jobserver ({jobserver.jobs} jobs)")
+    elif jobs is not None:
+        build_cmd.append(str(jobs))
+
+    if compiler_cache:
+        compiler_cache.zero_stats()
+
+    result = process.run(build_cmd, env=env)
+
+    if compiler_cache:
+        compiler_cache.print_stats()
+
     if result.returncode != 0:
-        print(f"CMake failed to build project to {out_dir}, {result.stderr}")
+        print(f"CMake failed to build project to {out_dir}, {result.describe_failure()}")
         return False
     
     print(f"CMake build succeeded, see: {out_dir}")
@@ -184,34 +306,32 @@ def _get_cross_compile_flags(platform: util.Platform, arch: util.Architecture) -
 def install(out_dir: Path, to_dir: Path) -> bool:
     """Installs the built cmake project into a directory
 
+    Note:
+        Only the files named by the install rules create_library generates (the libraries
+        themselves and their shared runtime dependencies) are installed, CMake skips
+        files that are already up to date
+
     Returns:
         bool: True if the installation succeeded, or False if it didn't
     """
 
-    bin_folder = to_dir / "bin"
-    lib_folder = to_dir / "lib"
+    if not (out_dir / "cmake_install.cmake").exists():
+        print(f"CMake build tree at {out_dir} has no install rules, please configure it first.")
+        return False
 
-    bin_folder.mkdir(parents=True, exist_ok=True)
-    lib_folder.mkdir(parents=True, exist_ok=True)
-    
-    # Copy dynamic and static libraries
-    runtime_extensions = {".dll", ".so", ".dylib"}
-    static_extensions = {".lib", ".a"}
-    for item in out_dir.rglob("*"):
-        if item.is_file():
-            if "vcpkg_installed" in item.parts:
-                continue
-
-            file_type = item.suffix.lower() in runtime_extensions and "runtime" or item.suffix.lower() in static_extensions and "static" or "none"
-            if file_type == "none":
-                continue
-            folder_dest = file_type == "runtime" and bin_folder or lib_folder
-            dest_file = folder_dest / item.name
-            shutil.copy2(item, dest_file)
-            print(f"Installed {file_type} library {item.name} from {item.absolute()} to {to_dir}")
-
-            
-
-    print(f"Successfully installed c++ project to {to_dir}")
+    (to_dir / "bin").mkdir(parents=True, exist_ok=True)
+    (to_dir / "lib").mkdir(parents=True, exist_ok=True)
+
+    result = process.run([
+        "cmake",
+        "--install", str(out_dir),
+        "--prefix", str(to_dir)
+    ])
+    if result.returncode != 0:
+        print(f"CMake failed to install project to {to_dir}, {result.describe_failure()}")
+        return False
+
+    manifest = out_dir / "install_manifest.txt"
+    installed = manifest.exists() and manifest.read_text().split() or []
+    print(f"Successfully installed {len(installed)} c++ files to {to_dir}")
     return True
-    
\ No newline at end of file
@@ -0,0 +1,191 @@
+import os
+import shlex
+import shutil
+import sys
+
+from enum import Enum
+from pathlib import Path
+
+from scripts import process
+from scripts import toolchain
+from scripts import util
+
+class PGOPhase(Enum):
+    OFF = "OFF"
+    GENERATE = "GENERATE"
+    USE = "USE"
+
+PGO_FOLDER = util.BUILD_DIRECTORY / "pgo"
+
+# Profiles clang writes while instrumented code runs, and the file they get merged into
+RAW_PROFILE_PATTERN = "*.profraw"
+MERGED_PROFILE_NAME = "torsion.profdata"
+
+# How many frames the default training workload runs before exiting
+TRAINING_FRAMES = 600
+
+# How long a training workload may run before it's considered hung
+TRAINING_TIMEOUT = 600
+
+class OptimizationSettings:
+    """How optimized native code gets built beyond what the build config sets
+
+    Args:
+        ipo: Whether Profile/Shipping builds use interprocedural (link time) optimization
+        target_cpu: The CPU to tune code for (I.E. "native" or "x86-64-v3"), or None for the compiler's default
+        pgo_phase: Which profile-guided optimization phase to build
+        pgo_dir: Where profiles are written to and read from
+    """
+
+    def __init__(self,
+                 ipo: bool = True,
+                 target_cpu: str | None = None,
+                 pgo_phase: PGOPhase = PGOPhase.OFF,
+                 pgo_dir: Path = PGO_FOLDER):
+        self.ipo = ipo
+        self.target_cpu = target_cpu
+        self.pgo_phase = pgo_phase
+        self.pgo_dir = pgo_dir
+
+    def with_pgo(self, phase: PGOPhase) -> "OptimizationSettings":
+        """Returns a copy of these settings building a different PGO phase"""
+        return OptimizationSettings(self.ipo, self.target_cpu, phase, self.pgo_dir)
+
+    def get_configure_flags(self) -> list[str]:
+        """Returns the CMake flags for these settings
+
+        Note:
+            Every flag is always passed so turning an option off takes effect in an existing build tree
+        """
+        return self._get_flags(str(self.pgo_dir))
+
+    def _get_flags(self, pgo_dir: str) -> list[str]:
+        return [
+            f"-DTORSION_IPO={self.ipo and 'ON' or 'OFF'}",
+            f"-DTORSION_TARGET_CPU={self.target_cpu or ''}",
+            f"-DTORSION_PGO={self.pgo_phase.value}",
+            f"-DTORSION_PGO_DIR={pgo_dir}",
+        ]
+
+    def get_fingerprint(self) -> list[str]:
+        """Returns values that change whenever these settings would produce different code
+
+        Note:
+            Optimized PGO builds also depend on the recorded profiles. The profile folder is named
+            relative to the project, it doesn't change the code and would key every checkout differently
+        """
+        values = self._get_flags(util.get_portable_path(self.pgo_dir))
+        if self.pgo_phase == PGOPhase.USE:
+            values.append(util.hash_inputs(get_profiles(self.pgo_dir)))
+        return values
+
+def get_profiles(folder: Path) -> list[Path]:
+    """Collects every profile an instrumented build wrote
+
+    Returns:
+        list[Path]: GCC .gcda files, clang .profraw files and the merged .profdata file
+    """
+    if not folder.exists():
+        return []
+    return [file for file in folder.rglob("*") if file.is_file()]
+
+def clear_profiles(folder: Path):
+    """Removes profiles of earlier training runs, GCC would otherwise add to their counters"""
+    if folder.exists():
+        shutil.rmtree(folder)
+        print(f"Removed previous PGO profiles from {folder}")
+    folder.mkdir(parents=True, exist_ok=True)
+
+def merge_profiles(folder: Path) -> bool:
+    """Merges clang's raw profiles into the file optimized builds read
+
+    Note:
+        GCC reads its .gcda files directly, so there is nothing to do when there are no raw profiles
+
+    Returns:
+        bool: True if the profiles are ready to be used, or False if merging failed
+    """
+    raw_profiles = sorted(folder.glob(RAW_PROFILE_PATTERN))
+    if not raw_profiles:
+        return True
+
+    llvm_profdata = toolchain.get_toolchain().which("llvm-profdata")
+    if llvm_profdata is None:
+        print("llvm-profdata cannot be discovered, it's needed to merge clang profiles. Please install LLVM or add it to PATH.")
+        return False
+
+    result = process.run([
+        llvm_profdata, "merge",
+        f"-output={folder / MERGED_PROFILE_NAME}",
+        *[str(profile) for profile in raw_profiles]
+    ], capture_output=True)
+    if result.returncode != 0:
+        print(f"Failed to merge clang profiles: {result.describe_failure()}")
+        return False
+
+    print(f"Merged {len(raw_profiles)} clang profiles into {folder / MERGED_PROFILE_NAME}")
+    return True
+
+def get_training_command(package_dir: Path) -> list[str] | None:
+    """Finds the default training workload, the TestApp window loop
+
+    Returns:
+        list[str]|None: The command that runs TestApp from the package, or None if it wasn't packaged
+    """
+    bin_dir = package_dir / "bin"
+    executable = bin_dir / (sys.platform == "win32" and "TestApp.exe" or "TestApp")
+    if executable.exists():
+        return [str(executable)]
+
+    library = bin_dir / "TestApp.dll"
+    dotnet = toolchain.get_toolchain().which("dotnet")
+    if library.exists() and dotnet:
+        return [dotnet, str(library)]
+    return None
+
+def get_training_environment(frames: int) -> dict[str, str]:
+    """Returns an environment that runs TestApp headless for a fixed number of frames
+
+    Args:
+        frames: How many frames TestApp runs before exiting
+
+    Returns:
+        dict[str, str]: A copy of our environment with SDL's offscreen drivers selected
+    """
+    env = dict(os.environ)
+    env["SDL_VIDEO_DRIVER"] = "offscreen"
+    env["SDL_AUDIO_DRIVER"] = "dummy"
+    env["TORSION_TRAINING_FRAMES"] = str(frames)
+    return env
+
+def train(package_dir: Path, pgo_dir: Path, workload: str | None = None, frames: int = TRAINING_FRAMES) -> bool:
+    """Runs a training workload against an instrumented package to record profiles
+
+    Note:
+        The workload runs headless, SDL draws into offscreen windows and TestApp exits
+        on its own after the requested number of frames
+
+    Args:
+        package_dir: The package built with PGOPhase.GENERATE
+        pgo_dir: Where the instrumented code writes its profiles
+        workload: The command to train with, defaults to TestApp's window loop
+        frames: How many frames the default workload runs
+
+    Returns:
+        bool: True if the workload ran and left profiles behind, or False if it didn't
+    """
+    command = workload and shlex.split(workload) or get_training_command(package_dir)
+    if command is None:
+        print(f"No training workload was given and TestApp isn't packaged in {package_dir}")
+        return False
+
+    print(f"Training PGO profiles with {shlex.join(command)}...")
+    result = process.run(command, cwd=package_dir / "bin", env=get_training_environment(frames), timeout=TRAINING_TIMEOUT)
+    if result.returncode != 0:
+        print(f"Training workload failed: {result.describe_failure()}")
+        return False
+
+    if not get_profiles(pgo_dir):
+        print(f"Training workload finished without writing profiles to {pgo_dir}, was the native code instrumented?")
+        return False
+    return merge_profiles(pgo_dir)
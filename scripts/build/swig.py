@@ -1,61 +1,283 @@
+import json
+import os
+import re
 import shutil
-import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import NamedTuple
 
+from scripts import process
+from scripts import profiler
+from scripts import toolchain
 from scripts import util
 
-def generate_cs_from_swig(out_dir: Path) -> bool:
+# Remembers which inputs and outputs each interface had when it was last generated
+SWIG_STATE_FILE = ".swig-state.json"
+SWIG_STAGING_FOLDER = util.BUILD_DIRECTORY / "swig-staging"
+
+# Matches SWIG (%include) and preprocessor (#include) directives with either quote style
+INCLUDE_PATTERN = re.compile(r'^\s*[%#]\s*include\s*["<]([^">]+)[">]', re.MULTILINE)
+
+class InterfaceResult(NamedTuple):
+    """The outcome of running SWIG on a single interface"""
+    interface: Path
+    returncode: int
+    stdout: str
+    stderr: str
+    elapsed: float
+    outputs: list[str]
+
+def get_worker_count(interface_count: int, jobs: int | None = None) -> int:
+    """Returns how many SWIG processes to run at once
+
+    Args:
+        interface_count: The number of interfaces waiting to be generated
+        jobs: How many processes may run at once, or None to use the CPU count
+
+    Returns:
+        int: The number of workers, never more than the job count or the number of interfaces
+    """
+    return max(1, min(interface_count, jobs or os.cpu_count() or 1))
+
+def get_interfaces() -> list[Path]:
+    """Collects every SWIG interface in the bindings folder
+
+    Returns:
+        list[Path]: The .i files, sorted so generation order is stable
+    """
+    return sorted(util.SWIG_BINDINGS_FOLDER.rglob("*.i"))
+
+def get_interface_dependencies(interface: Path) -> set[Path]:
+    """Finds the files an interface includes, following includes transitively
+
+    Note:
+        Includes that can't be resolved against the interface's folder or engine/native
+        (I.E. SWIG's own library or system headers) are ignored
+
+    Args:
+        interface: The SWIG interface to scan
+
+    Returns:
+        set[Path]: Every local file the interface depends on, not including the interface itself
+    """
+    search_paths = [interface.parent, util.CXXSOURCE_FOLDER]
+    dependencies: set[Path] = set()
+    pending = [interface]
+
+    while pending:
+        current = pending.pop()
+        try:
+            text = current.read_text(errors="ignore")
+        except OSError:
+            continue
+
+        for include in INCLUDE_PATTERN.findall(text):
+            for folder in (current.parent, *search_paths):
+                candidate = (folder / include).resolve()
+                if candidate.is_file():
+                    if candidate not in dependencies and candidate != interface.resolve():
+                        dependencies.add(candidate)
+                        pending.append(candidate)
+                    break
+    return dependencies
+
+def get_interface_inputs() -> list[Path]:
+    """Collects every file SWIG reads while generating bindings
+
+    Returns:
+        list[Path]: The interfaces along with all the headers they include
+    """
+    inputs: set[Path] = set()
+    for interface in get_interfaces():
+        inputs.add(interface)
+        inputs.update(get_interface_dependencies(interface))
+    return sorted(inputs)
+
+def get_interface_fingerprint(interface: Path) -> str:
+    """Fingerprints an interface, everything it includes and the SWIG version
+
+    Args:
+        interface: The SWIG interface
+
+    Returns:
+        str: A hex digest that changes whenever the generated bindings could change
+    """
+    return util.hash_inputs(
+        [interface, *get_interface_dependencies(interface)],
+        [toolchain.get_toolchain().version("swig")])
+
+def load_state(out_dir: Path) -> dict[str, dict]:
+    """Loads the per-interface generation state from the output folder"""
+    state_file = out_dir / SWIG_STATE_FILE
+    if not state_file.exists():
+        return {}
+    try:
+        return json.loads(state_file.read_text())
+    except (OSError, ValueError):
+        return {}
+
+def save_state(out_dir: Path, state: dict[str, dict]):
+    """Writes the per-interface generation state into the output folder"""
+    (out_dir / SWIG_STATE_FILE).write_text(json.dumps(state, indent=4, sort_keys=True))
+
+def get_stale_interfaces(out_dir: Path,
+                         interfaces: list[Path],
+                         previous_state: dict[str, dict]) -> tuple[list[tuple[Path, str]], dict[str, dict]]:
+    """Finds the interfaces whose bindings are out of date
+
+    Args:
+        out_dir: The folder the bindings were generated into
+        interfaces: Every SWIG interface
+        previous_state: The generation state from load_state()
+
+    Returns:
+        tuple[list[tuple[Path, str]], dict[str, dict]]: The stale interfaces with their current fingerprints,
+        and the state of the interfaces that are up to date
+    """
+    state: dict[str, dict] = {}
+    stale_interfaces: list[tuple[Path, str]] = []
+    for interface in interfaces:
+        key = _interface_key(interface)
+        fingerprint = get_interface_fingerprint(interface)
+        entry = previous_state.get(key)
+
+        if entry and entry["fingerprint"] == fingerprint and all((out_dir / name).exists() for name in entry["outputs"]):
+            state[key] = entry
+            continue
+        stale_interfaces.append((interface, fingerprint))
+    return stale_interfaces, state
+
+def generate_cs_from_swig(out_dir: Path, clean_build: bool = False, jobs: int | None = None) -> bool:
     """Generates C# files from SWIG bindings
 
+    Note:
+        Only interfaces whose own contents or includes changed are regenerated, and
+        generated files are only rewritten when their contents differ
+
     Args:
         out_dir: The path where the generated bindings should go
+        clean_build: Whether to remove all previously generated bindings first
+        jobs: How many SWIG processes may run at once, or None to use the CPU count
 
     Returns:
-        bool: True if the binding generation succeeded, or False if it failed
+        bool: True if every interface generated, or False if any of them failed
     """
 
     # Ensure SWIG is available on this system
-    swig = shutil.which("swig")
+    swig = toolchain.get_toolchain().which("swig")
     if swig is None:
         print("SWIG is not detected on this system, please install or add it to PATH.")
         return False
 
     # Iterate through bindings and collect each file
-    swig_interfaces: list[Path] = []
-
-    for item in util.SWIG_BINDINGS_FOLDER.rglob("*.i"):
-        swig_interfaces.append(item)
+    swig_interfaces = get_interfaces()
 
     # Clean output directory
-    if util.SWIG_OUT_FOLDER.exists():
-        shutil.rmtree(util.SWIG_OUT_FOLDER)
-    util.SWIG_OUT_FOLDER.mkdir(parents=True)
+    if clean_build and out_dir.exists():
+        shutil.rmtree(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    previous_state = load_state(out_dir)
+    stale_interfaces, state = get_stale_interfaces(out_dir, swig_interfaces, previous_state)
+
+    # Remove bindings generated by interfaces that no longer exist
+    current_keys = {_interface_key(interface) for interface in swig_interfaces}
+    for key, entry in previous_state.items():
+        if key in current_keys:
+            continue
+        for name in entry["outputs"]:
+            (out_dir / name).unlink(missing_ok=True)
+        print(f"Removed bindings of deleted interface {key}")
+
+    if not stale_interfaces:
+        save_state(out_dir, state)
+        print(f"All {len(swig_interfaces)} SWIG interfaces are up to date, see: {out_dir}")
+        return True
+
+    print(f"Regenerating {len(stale_interfaces)} of {len(swig_interfaces)} SWIG interfaces...")
 
     successful_generations = 0
+    failed_generations = 0
+    SWIG_STAGING_FOLDER.mkdir(parents=True, exist_ok=True)
 
-    # Iterate through SWIG interfaces and generate C# files
-    for interface in swig_interfaces:
-        result = subprocess.run([
-            "swig",
-            "-c++",
-            "-csharp",
-            "-I" + str(util.CXXSOURCE_FOLDER),
-            "-outdir", str(out_dir),
-            "-o", str(out_dir / f"{interface.stem}_wrap.cpp"),
-            str(interface)
-        ], capture_output=True, text=True)
+    # Run SWIG on every interface concurrently, each process is single-threaded
+    worker_count = get_worker_count(len(stale_interfaces), jobs)
+    with ThreadPoolExecutor(max_workers=worker_count) as pool:
+        # Pool threads don't know which stage they work for, charge their processes to the one running this
+        stage = profiler.get_current_stage()
+        results = list(pool.map(lambda interface: _generate_interface(interface, out_dir, stage), [interface for interface, _ in stale_interfaces]))
 
+    # Report in interface order so output doesn't depend on which process finished first
+    for (interface, fingerprint), result in zip(stale_interfaces, results):
+        key = _interface_key(interface)
         if result.returncode != 0:
-            print(f"SWIG failed to generate C# from interface {interface.name}, {result.stderr}")
+            print(f"SWIG failed to generate C# from interface {result.interface.name}, {result.stderr}")
+            failed_generations += 1
+            # Without a state entry the interface is retried next build, its old bindings no longer match it
+            state.pop(key, None)
+            for name in previous_state.get(key, {}).get("outputs", []):
+                (out_dir / name).unlink(missing_ok=True)
             continue
-        print(f"Successfully generated C# from interface {interface.name}")
+        if result.stderr.strip():
+            print(f"SWIG warnings for interface {result.interface.name}:\n{result.stderr.rstrip()}")
+
+        # Drop files this interface used to generate but doesn't anymore
+        previous_outputs = previous_state.get(key, {}).get("outputs", [])
+        for name in set(previous_outputs) - set(result.outputs):
+            (out_dir / name).unlink(missing_ok=True)
+
+        state[key] = {"fingerprint": fingerprint, "outputs": result.outputs}
+        print(f"Successfully generated C# from interface {result.interface.name}")
         successful_generations += 1
 
-    if successful_generations == 0: # Check C# generation result
-        print("Failed to generate C# files with SWIG")
+    save_state(out_dir, state)
+
+    print(f"SWIG timings ({worker_count} workers):")
+    for result in sorted(results, key=lambda result: result.elapsed, reverse=True):
+        print(f"  {result.elapsed:8.2f}s  {result.interface.name}")
+
+    # Partial bindings would let C# build against a mix of old and new interfaces
+    if failed_generations: # Check C# generation result
+        print(f"Failed to generate C# files with SWIG for {failed_generations} of {len(stale_interfaces)} interfaces")
         return False
     print(f"Generated {successful_generations} C# files, see: {out_dir}")
     return True
 
+def _interface_key(interface: Path) -> str:
+    """Returns the name an interface is stored under in the generation state"""
+    return interface.relative_to(util.SWIG_BINDINGS_FOLDER).as_posix()
+
+def _generate_interface(interface: Path, out_dir: Path, stage: str | None = None) -> InterfaceResult:
+    """Runs SWIG on a single interface into a staging folder, then swaps changed files into the output folder
+
+    Args:
+        interface: The interface to generate bindings from
+        out_dir: The folder the bindings go into
+        stage: The stage SWIG runs for (I.E. swig or pgo-instrumented-swig), so it can be profiled and cancelled with it
+    """
+    start = time.perf_counter()
+    outputs: list[str] = []
+
+    with tempfile.TemporaryDirectory(dir=SWIG_STAGING_FOLDER, prefix=f"{interface.stem}-") as staging:
+        staging_dir = Path(staging)
+        result = process.run([
+            "swig",
+            "-c++",
+            "-csharp",
+            "-I" + str(util.CXXSOURCE_FOLDER),
+            "-outdir", str(staging_dir),
+            "-o", str(staging_dir / f"{interface.stem}_wrap.cpp"),
+            str(interface)
+        ], capture_output=True, stage=stage)
+
+        if result.returncode == 0:
+            for file in sorted(staging_dir.rglob("*")):
+                if not file.is_file():
+                    continue
+                name = file.relative_to(staging_dir).as_posix()
+                util.replace_if_changed(file, out_dir / name)
+                outputs.append(name)
 
-        
+    return InterfaceResult(interface, result.returncode, result.stdout, result.stderr, time.perf_counter() - start, outputs)
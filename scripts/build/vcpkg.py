@@ -1,13 +1,14 @@
+import functools
 import json
 import os
 import platform
-import shutil
-import subprocess
 
 from enum import Enum
 from pathlib import Path
 from scripts.util import Platform, Architecture
 
+from scripts import process
+from scripts import toolchain
 from scripts import util
 
 class VTriplet(Enum):
@@ -34,6 +35,8 @@ class VTriplet(Enum):
     # Unknown or no selection
     NONE = "none"
 
+# Written next to vcpkg's status database after a successful install
+INSTALL_STATE_FILE = "torsion-install-state.json"
 
 def is_vcpkg_available() -> bool:
     """Checks if vcpkg is in PATH
@@ -41,7 +44,7 @@ def is_vcpkg_available() -> bool:
     Returns:
         bool: True if vcpkg is in PATH, or False if it isn't
     """
-    return shutil.which("vcpkg") is not None
+    return toolchain.get_toolchain().which("vcpkg") is not None
 
 def get_toolchain_file() -> Path | None:
     """Queries the filesystem for vcpkg's cmake toolchain
@@ -51,7 +54,7 @@ def get_toolchain_file() -> Path | None:
     """
 
     # Ensure vcpkg exists
-    vcpkg = shutil.which("vcpkg")
+    vcpkg = toolchain.get_toolchain().which("vcpkg")
     if vcpkg == None:
         print("Cannot fetch vcpkg toolchain as it is not added to PATH yet, please install or add it.")
         return None
@@ -65,6 +68,7 @@ def get_toolchain_file() -> Path | None:
         return None
     return vcpkg_toolchain
 
+@functools.cache
 def get_host_triplet() -> VTriplet:
     """Get the host triplet for the current build machine
 
@@ -144,69 +148,250 @@ def get_vcpkg_triplet(platform: Platform, arch: Architecture) -> VTriplet:
         case _:
             return VTriplet.NONE
 
-def get_required_packages() -> list[str]:
-    """Read required packages from vcpkg.json
+def get_manifest_inputs() -> list[Path]:
+    """Collects the manifest files that decide which packages vcpkg installs
 
     Returns:
-        list[str]: The list of vcpkg package names (simplified)
+        list[Path]: vcpkg.json and vcpkg-configuration.json
+    """
+    return [
+        util.CXXSOURCE_FOLDER / "vcpkg.json",
+        util.CXXSOURCE_FOLDER / "vcpkg-configuration.json"
+    ]
+
+def get_installed_root() -> Path:
+    """Returns the folder vcpkg installs manifest packages into"""
+    return util.CXXSOURCE_FOLDER / "vcpkg_installed"
+
+def get_installed_folder(triplet: VTriplet) -> Path:
+    """Returns the folder vcpkg installs a triplet's packages into"""
+    return get_installed_root() / triplet.value
+
+def read_manifest() -> dict:
+    """Reads vcpkg.json
+
+    Returns:
+        dict: The manifest, or an empty dict if it is missing or unreadable
     """
     vcpkg_json = util.CXXSOURCE_FOLDER / "vcpkg.json"
     if not vcpkg_json.exists():
-        return []
-    
+        return {}
+
     try:
         with open(vcpkg_json, 'r') as f:
-            data = json.load(f)
-            dependencies = data.get('dependencies', [])
-            
-            # Handle both string dependencies and object dependencies
-            package_names = []
-            for dep in dependencies:
-                if isinstance(dep, str):
-                    package_names.append(dep)
-                elif isinstance(dep, dict) and 'name' in dep:
-                    package_names.append(dep['name'])
-            
-            return package_names
+            return json.load(f)
     except Exception as e:
         print(f"Error reading vcpkg.json: {e}")
-        return []
+        return {}
+
+def get_required_features() -> dict[str, set[str]]:
+    """Read required packages and the features requested for each from vcpkg.json
+
+    Note:
+        Dependencies only needed on the host (I.E. build tools) are left out
+
+    Returns:
+        dict[str, set[str]]: The lowercase package names mapped to their requested features
+    """
+    required: dict[str, set[str]] = {}
+
+    # Handle both string dependencies and object dependencies
+    for dep in read_manifest().get('dependencies', []):
+        if isinstance(dep, str):
+            required.setdefault(dep.lower(), set())
+        elif isinstance(dep, dict) and 'name' in dep and not dep.get('host', False):
+            features = required.setdefault(dep['name'].lower(), set())
+            for feature in dep.get('features', []):
+                features.add(isinstance(feature, dict) and feature['name'] or feature)
+    return required
+
+def get_required_packages() -> list[str]:
+    """Read required packages from vcpkg.json
+
+    Returns:
+        list[str]: The list of vcpkg package names (simplified)
+    """
+    return list(get_required_features())
+
+def get_manifest_hash(triplet: VTriplet, host_triplet: VTriplet) -> str:
+    """Fingerprints everything that decides what vcpkg installs
+
+    Note:
+        The manifest is hashed after being parsed, so reformatting it doesn't count as a change,
+        while dependencies, features, overrides and the builtin-baseline do
+
+    Returns:
+        str: A hex digest of the manifest, the vcpkg configuration and the triplets
+    """
+    configuration = util.CXXSOURCE_FOLDER / "vcpkg-configuration.json"
+    return util.hash_inputs(
+        [configuration],
+        [json.dumps(read_manifest(), sort_keys=True), triplet.value, host_triplet.value])
+
+def read_install_status(installed_root: Path) -> dict[tuple[str, str], set[str]]:
+    """Reads vcpkg's own record of what is installed
+
+    Note:
+        vcpkg appends changes to vcpkg/updates/ and only occasionally folds them back into
+        vcpkg/status, so both are read in order and later paragraphs win
+
+    Args:
+        installed_root: The vcpkg_installed folder
+
+    Returns:
+        dict[tuple[str, str], set[str]]: (package, triplet) mapped to its installed features ("core" for the package itself)
+    """
+    status_folder = installed_root / "vcpkg"
+    status_files = [status_folder / "status"]
+    if (status_folder / "updates").exists():
+        status_files.extend(sorted((status_folder / "updates").iterdir()))
+
+    installed: dict[tuple[str, str], set[str]] = {}
+    for status_file in status_files:
+        if not status_file.is_file():
+            continue
+
+        for paragraph in status_file.read_text(errors="ignore").split("\n\n"):
+            fields = {}
+            for line in paragraph.splitlines():
+                key, _, value = line.partition(":")
+                fields[key.strip()] = value.strip()
+            if "Package" not in fields or "Architecture" not in fields:
+                continue
+
+            key = (fields["Package"].lower(), fields["Architecture"])
+            feature = fields.get("Feature", "core")
+            features = installed.setdefault(key, set())
+            if fields.get("Status", "").endswith(" installed"):
+                features.add(feature)
+            else:
+                features.discard(feature)
+    return {key: features for key, features in installed.items() if features}
+
+def get_install_state_file() -> Path:
+    """Returns where the manifest hash of the last successful install is kept"""
+    return get_installed_root() / "vcpkg" / INSTALL_STATE_FILE
 
 def are_packages_installed(triplet: VTriplet) -> bool:
     """Checks if all packages from vcpkg.json are installed
 
+    Note:
+        This compares the manifest hash recorded by the last successful install and
+        then confirms every package and feature against vcpkg's status database, so it
+        never has to look at the installed files themselves
+
     Returns:
         bool: True if the packages are installed, or False if not
     """
 
-    vcpkg_installed = util.CXXSOURCE_FOLDER / "vcpkg_installed"
-    triplet_dir = vcpkg_installed / triplet.value
-    if not triplet_dir.exists():
+    if not get_installed_folder(triplet).exists():
+        return False
+
+    # Ensure the manifest hasn't changed since the last install
+    state_file = get_install_state_file()
+    if not state_file.exists():
+        return False
+    try:
+        state = json.loads(state_file.read_text())
+    except (OSError, ValueError):
+        return False
+    if state.get(triplet.value) != get_manifest_hash(triplet, get_host_triplet()):
         return False
     
-    # Check to see if the package is available in either the library or include
-    packages = get_required_packages()
-    for package_name in packages:
-        package_include = triplet_dir / "include" / package_name
-        package_lib = triplet_dir / "lib"
-        
-        if not (package_include.exists() or any(f.name.startswith(package_name) for f in package_lib.glob("*") if f.is_file())):
+    # Ensure vcpkg still considers every package and feature installed
+    installed = read_install_status(get_installed_root())
+    for package_name, features in get_required_features().items():
+        installed_features = installed.get((package_name, triplet.value))
+        if installed_features is None or "core" not in installed_features:
+            return False
+        if not features <= installed_features:
             return False
     return True
 
+def record_install_state(triplet: VTriplet, host_triplet: VTriplet):
+    """Remembers the manifest a triplet was installed from, so the next check can skip vcpkg"""
+    state_file = get_install_state_file()
+    state = {}
+    if state_file.exists():
+        try:
+            state = json.loads(state_file.read_text())
+        except (OSError, ValueError):
+            state = {}
 
-def build_packages(triplet: VTriplet = VTriplet.NONE) -> bool:
+    state[triplet.value] = get_manifest_hash(triplet, host_triplet)
+    state_file.parent.mkdir(parents=True, exist_ok=True)
+    state_file.write_text(json.dumps(state, indent=4))
+
+def get_binary_sources(binary_cache: Path, triplet: VTriplet) -> str:
+    """Returns a VCPKG_BINARY_SOURCES value that only reads and writes a local cache folder
+
+    Args:
+        binary_cache: The root of the binary cache, each triplet gets its own folder inside it
+        triplet: The triplet being installed
+
+    Returns:
+        str: The binary sources for vcpkg
+    """
+    return f"clear;files,{binary_cache.absolute() / triplet.value},readwrite"
+
+def prune_binary_cache(binary_cache: Path, max_size: int) -> int:
+    """Deletes the least recently used packages until the binary cache fits in a size limit
+
+    Note:
+        Files are ordered by the later of their access and modification times, so caches on
+        filesystems mounted with noatime still evict in roughly least recently written order
+
+    Args:
+        binary_cache: The root of the binary cache
+        max_size: The size in bytes the cache must fit into
+
+    Returns:
+        int: The number of bytes removed
+    """
+    if not binary_cache.exists():
+        return 0
+
+    entries = []
+    for file in util.collect_files(binary_cache):
+        try:
+            stat = file.stat()
+        except OSError:
+            continue
+        entries.append((max(stat.st_atime, stat.st_mtime), stat.st_size, file))
+
+    total_size = sum(size for _, size, _ in entries)
+    removed = 0
+    for _, size, file in sorted(entries):
+        if total_size - removed <= max_size:
+            break
+        file.unlink(missing_ok=True)
+        removed += size
+
+    # Drop folders left empty by evictions
+    for folder in sorted((p for p in binary_cache.rglob("*") if p.is_dir()), reverse=True):
+        if not any(folder.iterdir()):
+            folder.rmdir()
+
+    print(f"Pruned {util.format_size(removed)} from vcpkg binary cache {binary_cache}, {util.format_size(total_size - removed)} left")
+    return removed
+
+def build_packages(triplet: VTriplet = VTriplet.NONE, binary_cache: Path | None = None, jobs: int | None = None) -> bool:
     """Builds vcpkg packages
 
     Note:
         Downloading packages will automatically use one less cpu core (CPU_CORES - 1), this may be problematic
 
+    Args:
+        triplet: The triplet to install packages for, defaults to the host's
+        binary_cache: A folder to restore prebuilt packages from and save built ones to, or None to use vcpkg's defaults
+        jobs: How many jobs vcpkg may run at once, or None to use all cores but one
+
     Returns:
         bool: True if vcpkg packages installed successfully, or False if it didn't
     """
 
     # Ensure vcpkg exists
-    vcpkg = shutil.which("vcpkg")
+    vcpkg = toolchain.get_toolchain().which("vcpkg")
     if not vcpkg:
         print("Vcpkg not found in PATH, please install or add it.")
         return False
@@ -221,7 +406,9 @@ def build_packages(triplet: VTriplet = VTriplet.NONE) -> bool:
         return True
 
     cpu_cores = os.cpu_count()
-    if cpu_cores is None:
+    if jobs is not None:
+        cores_used = max(1, jobs)
+    elif cpu_cores is None:
         print("Unable to query cpu cores for vcpkg, defaulting to 1")
         cores_used = 1
     else:
@@ -233,9 +420,12 @@ def build_packages(triplet: VTriplet = VTriplet.NONE) -> bool:
     env = os.environ.copy()
     env["VCPKG_MAX_CONCURRENCY"] = str(cores_used)
 
-    # Move to cxx source folder as it has the vcpkg.json
-    os.chdir(util.CXXSOURCE_FOLDER)
-    
+    # Restore packages from the binary cache instead of building them from source when possible
+    if binary_cache:
+        (binary_cache / triplet.value).mkdir(parents=True, exist_ok=True)
+        env["VCPKG_BINARY_SOURCES"] = get_binary_sources(binary_cache, triplet)
+        print(f"Using vcpkg binary cache: {binary_cache / triplet.value}")
+
     # Build packages
     vcpkg_cmd = [
         vcpkg, "install",
@@ -248,11 +438,15 @@ def build_packages(triplet: VTriplet = VTriplet.NONE) -> bool:
     if triplet != host_triplet:
         vcpkg_cmd.append("--allow-unsupported")
 
-    result = subprocess.run(vcpkg_cmd, capture_output=True, text=True)
+    # Run from the cxx source folder as it has the vcpkg.json
+    # (without changing our own working directory, other stages may be running alongside)
+    result = process.run(vcpkg_cmd, cwd=util.CXXSOURCE_FOLDER, env=env)
 
     if result.returncode != 0:
-        print(f"Failed to build vcpkg packages: {result.stderr}")
+        print(f"Failed to build vcpkg packages: {result.describe_failure()}")
         return False
+
+    record_install_state(triplet, host_triplet)
     print("Successfully built vcpkg packages.")
     return True
 
@@ -0,0 +1,155 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from pathlib import Path
+from typing import Iterable
+
+from scripts import util
+
+STAGE_CACHE_FILE = util.BUILD_DIRECTORY / "stage-cache.json"
+
+def tree_signature(paths: Iterable[Path]) -> str:
+    """Creates a cheap signature of files or folders from their names, sizes and modification times
+
+    Note:
+        This doesn't read file contents, so it stays fast on large output trees like the CMake build folder
+
+    Args:
+        paths: The files/folders to sign
+
+    Returns:
+        str: A hex digest that changes whenever a file is added, removed or rewritten
+    """
+    digest = hashlib.sha256()
+    for path in sorted(Path(p) for p in paths):
+        digest.update(str(path).encode())
+        if not path.exists():
+            digest.update(b"missing")
+            continue
+        if path.is_file():
+            stat = path.stat()
+            digest.update(f"{stat.st_size}:{stat.st_mtime_ns}".encode())
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                file = Path(root) / name
+                try:
+                    stat = file.stat()
+                except OSError:
+                    continue
+                digest.update(f"{file.relative_to(path)}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return digest.hexdigest()
+
+class StageCache:
+    """Persistent manifest remembering the inputs and outputs of every pipeline stage
+
+    A stage is skipped when both the fingerprint of its inputs and the signature
+    of its outputs match what was recorded the last time it succeeded.
+    """
+
+    def __init__(self, path: Path = STAGE_CACHE_FILE):
+        self.path = path
+        self.entries: dict[str, dict] = {}
+        self._pending: dict[str, tuple[str, list[Path]]] = {}
+        self._lock = threading.Lock()
+
+        if path.exists():
+            try:
+                self.entries = json.loads(path.read_text()).get("stages", {})
+            except (OSError, ValueError) as err:
+                print(f"Stage cache at {path} is unreadable, ignoring it: {err}")
+
+    def is_fresh(self, stage: str, fingerprint: str, outputs: list[Path]) -> bool:
+        """Checks if a stage can be skipped
+
+        Args:
+            stage: The name of the stage
+            fingerprint: The fingerprint of the stage's current inputs
+            outputs: The files/folders the stage produces
+
+        Returns:
+            bool: True if neither the inputs nor the outputs changed since the stage last succeeded
+        """
+        entry = self.entries.get(stage)
+        if entry is None or entry.get("fingerprint") != fingerprint:
+            return False
+        if not all(output.exists() for output in outputs):
+            return False
+        return entry.get("outputs") == tree_signature(outputs)
+
+    def record(self, stage: str, fingerprint: str, outputs: list[Path]):
+        """Marks a stage as succeeded, its outputs are signed when the cache is saved
+
+        Note:
+            Signing is deferred so that stages sharing an output folder (like both installs) see each other's files
+
+        Args:
+            stage: The name of the stage
+            fingerprint: The fingerprint of the inputs the stage ran with
+            outputs: The files/folders the stage produced
+        """
+        with self._lock:
+            self._pending[stage] = (fingerprint, outputs)
+
+    def get_fingerprint(self, stage: str) -> str | None:
+        """Returns the fingerprint a stage last succeeded with, or None if it never did
+
+        Note:
+            Unlike is_fresh() this doesn't sign the stage's outputs, so it's cheap enough to predict which stages will run
+        """
+        with self._lock:
+            entry = self.entries.get(stage)
+            return entry and entry.get("fingerprint") or None
+
+    def get_time(self, stage: str) -> float | None:
+        """Returns when a stage last succeeded or was confirmed up to date, or None if it never was"""
+        with self._lock:
+            entry = self.entries.get(stage)
+            return entry and entry.get("time") or None
+
+    def has_completed(self, stage: str) -> bool:
+        """Checks if a stage ever succeeded without being invalidated since, whatever its inputs were"""
+        with self._lock:
+            return stage in self.entries or stage in self._pending
+
+    def invalidate(self, stage: str):
+        """Forgets a stage so it runs again next time"""
+        with self._lock:
+            self.entries.pop(stage, None)
+            self._pending.pop(stage, None)
+
+    def checkpoint(self):
+        """Writes the manifest to disk mid-build, so stages that finished are remembered even if the build is killed
+
+        Note:
+            Recorded stages are signed again when the cache is saved, since later stages may still add to shared outputs
+        """
+        with self._lock:
+            self._sign_pending()
+            self._write()
+
+    def save(self):
+        """Signs the outputs of recorded stages and writes the manifest to disk"""
+        with self._lock:
+            self._sign_pending()
+            self._pending.clear()
+            self._write()
+
+    def _sign_pending(self):
+        for stage, (fingerprint, outputs) in self._pending.items():
+            self.entries[stage] = {
+                "fingerprint": fingerprint,
+                "outputs": tree_signature(outputs),
+                "time": time.time(),
+            }
+
+    def _write(self):
+        # Write next to the manifest and swap it in, a killed build never leaves half a manifest
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temp = self.path.with_name(f".{self.path.name}.tmp")
+        temp.write_text(json.dumps({"stages": self.entries}, indent=4))
+        os.replace(temp, self.path)
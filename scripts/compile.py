@@ -1,18 +1,48 @@
-from scripts.build import cs
-from scripts.build import cxx
-from scripts.build import swig
-from scripts.build import vcpkg
+from __future__ import annotations
 
 import argparse
+import json
 import shutil
 import sys
 import time
 
 from pathlib import Path
-
+from scripts import backends
+from scripts import cache
+from scripts import history
+from scripts import jobs
+from scripts import matrix
+from scripts import plan
+from scripts import process
+from scripts import profiler
+from scripts import scheduler
+from scripts import store
+from scripts import toolchain
 from scripts import util
+from scripts import watch
+
+# Stage backends are imported the first time a build uses them, --help and --stats never do
+compiler_cache = backends.load("compiler_cache")
+cs = backends.load("cs")
+cxx = backends.load("cxx")
+optimization = backends.load("optimization")
+swig = backends.load("swig")
+vcpkg = backends.load("vcpkg")
+
+# Arguments of the last build, so it can be resumed with the same ones
+LAST_BUILD_FILE = util.BUILD_DIRECTORY / "last-build.json"
+
+# Resources the scheduler limits, native builds by the memory budget and C# publishes to one at a time
+NATIVE_RESOURCE = "native"
+DOTNET_RESOURCE = "dotnet"
 
-def parse_args():
+# How the jobs are split between Ninja and MSBuild, which run at the same time
+BUILD_WEIGHTS = {"cxx": 3, "cs": 1}
+
+# Put in front of the stages PGO builds instrumented, keeps them apart from the optimized build in the stage cache and profile
+INSTRUMENTED_PREFIX = "pgo-instrumented-"
+
+def parse_args(argv: list[str] | None = None):
     parser = argparse.ArgumentParser(description="TorsionEngineBuilder")
     parser.add_argument(
         "--compiler",
@@ -21,9 +51,10 @@ def parse_args():
         help="What tool to compile C++ with")
     parser.add_argument(
         "--config",
-        choices=["Debug", "Release"],
+        choices=[config.value for config in util.BuildConfig],
         default="Debug",
-        help="Build configuration (Debug has debug symbols, while Release has none and is ready for distribution)")
+        help="Build configuration (Debug has debug symbols, Release has none and is ready for distribution, "
+             "Profile is optimized with symbols and LTO, Shipping is fully optimized with LTO)")
     parser.add_argument(
         "--platform",
         choices=["windows", "linux", "macos", "current"],
@@ -34,94 +65,743 @@ def parse_args():
         choices=["x64", "x86", "arm64", "arm86", "current"],
         default="current",
         help="The architecture to build for")
-    return parser.parse_args()
+    parser.add_argument(
+        "--matrix",
+        default=None,
+        help="Build several comma separated platform-arch-config targets at once (I.E. linux-x64-Debug,linux-arm64-Release), "
+             "each into its own tree under out/matrix/<target> (overrides --platform, --arch and --config)")
+    parser.add_argument(
+        "--parallel-targets",
+        type=int,
+        default=None,
+        help="How many matrix targets build native code at once, defaults to as many as fit into the available memory")
+    parser.add_argument(
+        "--jobs", "-j",
+        type=int,
+        default=None,
+        help="How many jobs the whole build may run at once, shared between vcpkg, SWIG, Ninja and MSBuild "
+             "(defaults to the CPUs our affinity and cgroup quota allow, capped by memory)")
+    parser.add_argument(
+        "--max-memory",
+        default=None,
+        help="How much memory the build may use (I.E. 16G), limits the job count and how many matrix targets build at once "
+             "(defaults to the available memory or cgroup limit)")
+    parser.add_argument(
+        "--clean",
+        action="store_true",
+        help="Remove all previous build output and rebuild from scratch (builds are incremental by default)")
+    parser.add_argument(
+        "--compiler-cache",
+        choices=["auto", "ccache", "sccache", "none"],
+        default="auto",
+        help="Launch C/C++ compiles through ccache or sccache (auto uses whichever is installed)")
+    parser.add_argument(
+        "--compiler-cache-dir",
+        type=Path,
+        default=None,
+        help="Where the compiler cache keeps its objects, defaults to out/cache/compiler (kept by --clean when inside out/)")
+    parser.add_argument(
+        "--vcpkg-binary-cache",
+        type=Path,
+        default=None,
+        help="Folder (I.E. a shared NFS mount) to restore prebuilt vcpkg packages from and save new ones to")
+    parser.add_argument(
+        "--package-store",
+        type=Path,
+        default=store.STORE_FOLDER,
+        help="Content-addressed store that finished packages are saved to, a later build with the same sources, "
+             "settings and tools restores its package from there instead of building it (kept by --clean when inside out/)")
+    parser.add_argument(
+        "--package-store-size",
+        default=store.DEFAULT_MAX_SIZE,
+        help="How large the package store may grow, the least recently used packages are removed after each build (I.E. 10G)")
+    parser.add_argument(
+        "--no-package-store",
+        action="store_true",
+        help="Always build packages, neither restoring them from the package store nor saving them to it")
+    parser.add_argument(
+        "--unity-build",
+        action="store_true",
+        help="Batch each native library's sources into unity translation units (faster clean builds)")
+    parser.add_argument(
+        "--pch",
+        action="store_true",
+        help="Precompile SDL/STL/SWIG runtime headers once and share them between native libraries")
+    parser.add_argument(
+        "--ipo",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="Use interprocedural (link time) optimization in Profile and Shipping builds")
+    parser.add_argument(
+        "--march",
+        default=None,
+        help="CPU to tune native code for with GCC/Clang (I.E. native or x86-64-v3), binaries may not run on older CPUs")
+    parser.add_argument(
+        "--pgo",
+        action="store_true",
+        help="Profile-guided optimization: build instrumented native code, run a training workload, then rebuild with its profiles")
+    parser.add_argument(
+        "--pgo-workload",
+        default=None,
+        help="Command to train PGO profiles with (runs in the package's bin folder), defaults to TestApp's window loop run headless")
+    parser.add_argument(
+        "--pgo-frames",
+        type=int,
+        default=None,
+        help="How many frames TestApp runs when training PGO profiles (defaults to 600)")
+    parser.add_argument(
+        "--cs-publish",
+        choices=["jit", "r2r", "aot"],
+        default="jit",
+        help="How C# is published: jit (framework-dependent IL), r2r (ReadyToRun precompiled IL, faster startup) "
+             "or aot (NativeAOT native executable, fastest startup and smallest output)")
+    parser.add_argument(
+        "--cs-trim",
+        action="store_true",
+        help="Trim unreferenced code from the C# output (makes it self-contained, always on for aot)")
+    parser.add_argument(
+        "--cs-tiered-pgo",
+        action=argparse.BooleanOptionalAction,
+        default=None,
+        help="Turn the JIT's tiered profile-guided optimization on or off (defaults to the runtime's setting, ignored by aot)")
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Record wall time, CPU time and peak memory of every stage and write a JSON report and Chrome trace to out/profile")
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="Print the latest builds and how long each stage took over time from the build history, then exit")
+    parser.add_argument(
+        "--regression-threshold",
+        type=float,
+        default=history.REGRESSION_THRESHOLD,
+        help="Flag stages that took more than this many percent longer than their median of recent builds")
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep running after the build, rebuilding only the affected stages whenever engine/native, engine/bindings "
+             "or engine/managed change (C# is built with warm build servers instead of published)")
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Print which stages would run and how long they're predicted to take from earlier builds, without running anything")
+    parser.add_argument(
+        "--explain",
+        action="store_true",
+        help="Like --dry-run, and also print why every stage would run: changed inputs, stale SWIG interfaces, "
+             "missing vcpkg packages and the translation units Ninja would compile")
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue the last build with its arguments (minus --clean), stages that already completed are skipped")
+    parser.add_argument(
+        "--from-stage",
+        default=None,
+        help="Run this stage (I.E. cs, or linux-x64-Debug-cs in a matrix) and every stage after it even if they're up to date, "
+             "reusing the last output of the others")
+    return parser.parse_args(argv)
+
+def load_last_build(from_stage: str | None) -> argparse.Namespace | None:
+    """Loads the arguments of the last build that wasn't itself resumed
+
+    Args:
+        from_stage: The stage to start the resumed build from, or None to only run stages that didn't complete
+
+    Returns:
+        argparse.Namespace|None: The arguments to resume with, or None if no build was recorded
+    """
+    try:
+        argv = json.loads(LAST_BUILD_FILE.read_text())["argv"]
+    except (OSError, ValueError, KeyError):
+        print(f"No previous build to resume was found at {LAST_BUILD_FILE}")
+        return None
+
+    args = parse_args(argv)
+    # Cleaning would throw away the stages the last build finished
+    args.clean = False
+    args.from_stage = from_stage
+    print(f"Resuming the last build ({' '.join(argv) or 'default arguments'})")
+    return args
+
+def create_target_stages(args: argparse.Namespace,
+                         target: matrix.BuildTarget,
+                         triplet: vcpkg.VTriplet,
+                         cxx_compiler: cxx.CXXCompiler,
+                         cxx_optimization: optimization.OptimizationSettings,
+                         vcpkg_stage: scheduler.Stage,
+                         swig_stage: scheduler.Stage,
+                         job_shares: dict[str, int],
+                         jobserver: jobs.Jobserver | None = None,
+                         clean_build: bool = False,
+                         prefix: str = "",
+                         instrumented: bool = False) -> list[scheduler.Stage]:
+    """Creates the stages that build and package a single target
+
+    Note:
+        C# doesn't depend on how native code is optimized, so an instrumented PGO build only builds
+        the native code and packages it again, with the C# the optimized build uses too
+
+    Args:
+        args: The parsed command line
+        target: The platform/arch/config to build and the folders it builds into
+        triplet: The triplet vcpkg installs the target's packages for
+        cxx_optimization: How native code gets optimized
+        vcpkg_stage: The stage installing the target's vcpkg packages
+        swig_stage: The stage generating the C# bindings
+        job_shares: How many jobs the cxx and cs stages may each run
+        jobserver: The jobserver native builds take their jobs from, or None to use their share
+        clean_build: Whether stages remove their previous output first
+        prefix: Put in front of every stage name
+        instrumented: Whether these stages build the instrumented code PGO trains with
+
+    Returns:
+        list[scheduler.Stage]: The configure, build and install stages of the target
+    """
+    tools = toolchain.get_toolchain()
+    if cxx_compiler == cxx.CXXCompiler.ANY:
+        compilers = cxx.get_any_compiler(target.platform)
+    else:
+        compilers = cxx.get_c_compilers(cxx_compiler)
+
+    # Keep a separate compiler cache per compiler and triplet so they can't poison each other,
+    # keyed by the compiler actually found since "any" can resolve to a different one on every machine
+    resolved_compiler = compilers and Path(compilers[1]).name or cxx_compiler.value
+    cxx_compiler_cache = compiler_cache.find_compiler_cache(
+        compiler_cache.CompilerCache(args.compiler_cache),
+        args.compiler_cache_dir or compiler_cache.COMPILER_CACHE_FOLDER,
+        f"{resolved_compiler}-{triplet.value}")
+
+    # Fingerprint every stage's inputs, chaining in the stages it depends on
+    configure_inputs = cxx.get_configure_inputs()
+    source_inputs = cxx.get_source_inputs()
+    project_inputs = cs.get_project_inputs()
+    native_fingerprint = util.hash_inputs(
+        configure_inputs,
+        [vcpkg_stage.fingerprint, target.config.value, cxx_compiler.value, target.platform.value, target.arch.value,
+         tools.version("cmake"), *[tools.version(str(compiler)) for compiler in compilers or ()], args.unity_build, args.pch,
+         *cxx_optimization.get_fingerprint()])
+    cxx_fingerprint = util.hash_inputs(
+        source_inputs,
+        [native_fingerprint, swig_stage.fingerprint, tools.version("ninja")])
+    # The compiler cache launcher changes how the build runs but not what it produces, so only the stages running
+    # the build see it. The install, and the package store key chaining from it, stay the same on every machine
+    launcher = [cxx_compiler_cache and cxx_compiler_cache.executable, cxx_compiler_cache and cxx_compiler_cache.folder]
+    configure_fingerprint = util.hash_inputs([], [native_fingerprint, *launcher])
+    cxx_build_fingerprint = util.hash_inputs([], [cxx_fingerprint, *launcher])
+    cs_publish = cs.CSPublishSettings(cs.CSPublishMode(args.cs_publish), args.cs_trim, args.cs_tiered_pgo)
+    cs_fingerprint = util.hash_inputs(
+        project_inputs,
+        [swig_stage.fingerprint, target.config.value, target.platform.value, target.arch.value,
+         tools.version("dotnet"), args.watch, *cs_publish.get_publish_flags()])
+
+    if args.watch:
+        # Watch mode builds with warm build servers instead of publishing, it's much quicker to start
+        cs_action = lambda: cs.build(
+            target.cs_out_dir,
+            target.config,
+            target.platform,
+            target.arch,
+            jobs=job_shares["cs"],
+            publish_dir=target.cs_publish_dir)
+    else:
+        cs_action = lambda: cs.compile(
+            target.cs_out_dir, 
+            target.config, 
+            target.platform, 
+            target.arch,
+            clean_build=clean_build,
+            jobs=job_shares["cs"],
+            publish=cs_publish,
+            publish_dir=target.cs_publish_dir)
+
+    native_prefix = (instrumented and INSTRUMENTED_PREFIX or "") + prefix
+    if instrumented:
+        # The optimized build replaces what the instrumented stages leave behind, so they can never be up to date
+        configure_fingerprint = cxx_build_fingerprint = cxx_install_fingerprint = cs_install_fingerprint = None
+    else:
+        cxx_install_fingerprint, cs_install_fingerprint = cxx_fingerprint, cs_fingerprint
+
+    # C# only needs the generated bindings, so it builds alongside the native code
+    return [
+        scheduler.Stage(
+            native_prefix + "cxx-configure",
+            lambda: cxx.configure(
+                target.cxx_out_dir, 
+                target.config, 
+                cxx_compiler, 
+                target.platform, 
+                target.arch,
+                clean_build=clean_build,
+                compiler_cache=cxx_compiler_cache,
+                unity_build=args.unity_build,
+                precompiled_headers=args.pch,
+                optimization=cxx_optimization),
+            depends_on=[vcpkg_stage.name, swig_stage.name],
+            fingerprint=configure_fingerprint,
+            outputs=[target.cxx_out_dir / "CMakeCache.txt"],
+            description=f"Configuring C++ components for {target.name}...",
+            inputs=configure_inputs,
+            explain=lambda: plan.explain_configure(target.cxx_out_dir)),
+        scheduler.Stage(
+            native_prefix + "cxx",
+            lambda: cxx.build(target.cxx_out_dir, job_shares["cxx"], cxx_compiler_cache, jobserver),
+            depends_on=[native_prefix + "cxx-configure"],
+            fingerprint=cxx_build_fingerprint,
+            outputs=[target.cxx_out_dir],
+            description=f"Compiling C++ components for {target.name}...",
+            resource=NATIVE_RESOURCE,
+            inputs=source_inputs,
+            explain=lambda: plan.explain_native_build(target.cxx_out_dir)),
+        scheduler.Stage(
+            prefix + "cs",
+            cs_action,
+            depends_on=[swig_stage.name],
+            fingerprint=cs_fingerprint,
+            outputs=[target.cs_out_dir],
+            description=f"Compiling C# components for {target.name}...",
+            resource=DOTNET_RESOURCE,
+            inputs=project_inputs),
+        scheduler.Stage(
+            native_prefix + "cxx-install",
+            lambda: cxx.install(target.cxx_out_dir, target.package_dir),
+            depends_on=[native_prefix + "cxx"],
+            fingerprint=cxx_install_fingerprint,
+            outputs=[target.package_dir],
+            description=f"Installing C++ components for {target.name}..."),
+        # The C++ install creates the package's bin folder
+        scheduler.Stage(
+            native_prefix + "cs-install",
+            lambda: cs.install(target.cs_out_dir, target.package_dir, target.cs_publish_dir),
+            depends_on=[prefix + "cs", native_prefix + "cxx-install"],
+            fingerprint=cs_install_fingerprint,
+            outputs=[target.package_dir],
+            description=f"Installing C# components for {target.name}..."),
+    ]
+
+def create_stages(args: argparse.Namespace,
+                  targets: list[matrix.BuildTarget],
+                  cxx_compiler: cxx.CXXCompiler,
+                  cxx_optimization: optimization.OptimizationSettings,
+                  budget: jobs.JobBudget,
+                  jobserver: jobs.Jobserver | None = None,
+                  clean_build: bool = False,
+                  instrumented: bool = False,
+                  parallel_targets: int = 1) -> list[scheduler.Stage]:
+    """Creates the build graph
+
+    Note:
+        SWIG generation is shared by every target, and each distinct triplet installs its
+        vcpkg packages once. Stages of a single target keep their plain names, in a matrix
+        they're prefixed with the target (I.E. linux-x64-Debug-cxx)
+
+    Args:
+        args: The parsed command line
+        targets: The platforms/archs/configs to build
+        cxx_optimization: How native code gets optimized
+        budget: The jobs and memory the whole build may use, split between the tools running at once
+        jobserver: The jobserver native builds take their jobs from, or None to give them fixed shares
+        clean_build: Whether stages remove their previous output first
+        instrumented: Whether native code is built instrumented for PGO to train with, SWIG, vcpkg and C# are
+            the same stages the optimized build uses
+        parallel_targets: How many targets build native code at once, the jobs are split between them
+
+    Returns:
+        list[scheduler.Stage]: Every stage of the build
+    """
+    tools = toolchain.get_toolchain()
+
+    # SWIG and vcpkg start together, before any native build
+    early_shares = budget.split({"vcpkg": 3, "swig": 1})
+    # Ninja and MSBuild run at the same time, give the heavier C++ build most of the jobs
+    # (of the share each target building at once gets)
+    job_shares = budget.split(BUILD_WEIGHTS, parallel_targets)
+    # Only the first triplet installs before any native build, later ones run alongside the native builds of
+    # the targets before them. They take their jobs from the jobserver when Ninja shares it, otherwise from
+    # what the native builds leave of the budget
+    native_jobserver = jobserver and jobs.supports_jobserver(tools.version("ninja")) and jobserver or None
+    remaining_jobs = max(1, budget.jobs - sum(job_shares.values()) * parallel_targets)
+
+    interface_inputs = swig.get_interface_inputs()
+    swig_stage = scheduler.Stage(
+        "swig",
+        lambda: swig.generate_cs_from_swig(util.SWIG_OUT_FOLDER, clean_build=clean_build, jobs=early_shares["swig"]),
+        fingerprint=util.hash_inputs(interface_inputs, [tools.version("swig")]),
+        outputs=[util.SWIG_OUT_FOLDER],
+        description="Generating C# bindings from C++ components...",
+        inputs=interface_inputs,
+        explain=lambda: plan.explain_swig(util.SWIG_OUT_FOLDER))
+    stages = [swig_stage]
+
+    # Triplets share vcpkg's install root (and the host tools built into it), so they install one after another
+    triplets = {target.name: get_installed_triplet(target) for target in targets}
+    vcpkg_stages: dict[vcpkg.VTriplet, scheduler.Stage] = {}
+    for triplet in triplets.values():
+        if triplet in vcpkg_stages:
+            continue
+        previous = list(vcpkg_stages.values())[-1:]
+        if not previous:
+            vcpkg_action = lambda triplet=triplet: vcpkg.build_packages(triplet, args.vcpkg_binary_cache, early_shares["vcpkg"])
+        else:
+            vcpkg_action = lambda triplet=triplet: build_packages_alongside(
+                args, triplet, early_shares["vcpkg"], remaining_jobs, native_jobserver)
+        vcpkg_stage = vcpkg_stages[triplet] = scheduler.Stage(
+            len(targets) == 1 and "vcpkg" or f"vcpkg-{triplet.value}",
+            vcpkg_action,
+            depends_on=[stage.name for stage in previous],
+            fingerprint=util.hash_inputs(vcpkg.get_manifest_inputs(), [triplet.value, tools.version("vcpkg")]),
+            outputs=[vcpkg.get_installed_folder(triplet)],
+            description=f"Building vcpkg packages for {triplet.value}...",
+            inputs=vcpkg.get_manifest_inputs(),
+            explain=lambda triplet=triplet: plan.explain_vcpkg(triplet))
+        stages.append(vcpkg_stage)
+
+    for target in targets:
+        stages.extend(create_target_stages(
+            args, target, triplets[target.name], cxx_compiler, cxx_optimization,
+            vcpkg_stages[triplets[target.name]], swig_stage, job_shares, jobserver, clean_build,
+            get_target_prefix(targets, target), instrumented))
+    return stages
+
+def build_packages_alongside(args: argparse.Namespace,
+                             triplet: vcpkg.VTriplet,
+                             max_jobs: int,
+                             remaining_jobs: int,
+                             jobserver: jobs.Jobserver | None = None) -> bool:
+    """Installs a triplet's vcpkg packages while native builds may be running
+
+    Note:
+        vcpkg passes fixed job counts to the ports it builds, so it can't join the jobserver. It
+        holds the tokens its jobs are worth instead, leaving Ninja fewer until it finishes
+
+    Args:
+        args: The parsed command line
+        triplet: The triplet to install packages for
+        max_jobs: The most jobs vcpkg may run
+        remaining_jobs: What the native builds leave of the budget, used without a jobserver
+        jobserver: The jobserver native builds take their jobs from, or None if they have fixed shares
+
+    Returns:
+        bool: True if vcpkg packages installed successfully, or False if it didn't
+    """
+    if jobserver is None:
+        return vcpkg.build_packages(triplet, args.vcpkg_binary_cache, min(max_jobs, remaining_jobs))
+
+    # Running at all takes one job, like every jobserver client
+    tokens = jobserver.acquire(max_jobs - 1)
+    try:
+        return vcpkg.build_packages(triplet, args.vcpkg_binary_cache, tokens + 1)
+    finally:
+        jobserver.release(tokens)
+
+def get_target_prefix(targets: list[matrix.BuildTarget], target: matrix.BuildTarget) -> str:
+    """Returns what's put in front of a target's stage names, nothing unless it's part of a matrix"""
+    return len(targets) > 1 and f"{target.name}-" or ""
+
+def get_package_key(stages: list[scheduler.Stage], target_prefix: str) -> str:
+    """Fingerprints everything that goes into a target's package, keying it in the package store
+
+    Note:
+        The install stages' fingerprints chain in every stage before them, so this covers the
+        sources, SWIG interfaces, vcpkg manifest, config, platform/arch, compiler and tool versions
+    """
+    fingerprints = {stage.name: stage.fingerprint for stage in stages}
+    return util.hash_inputs([], [fingerprints[target_prefix + "cxx-install"], fingerprints[target_prefix + "cs-install"]])
+
+def can_restore(package_store: store.PackageStore,
+                stage_cache: cache.StageCache,
+                target: matrix.BuildTarget,
+                target_prefix: str,
+                key: str,
+                stages: list[scheduler.Stage]) -> bool:
+    """Checks if a target's package comes from the package store instead of being built
+
+    Note:
+        Packages the stage cache already considers up to date are left alone, restoring them would only
+        turn them into links that have to be removed again before the next build installs into them
+
+    Returns:
+        bool: True if the package was already restored with the same key or the store has it
+    """
+    if store.get_restored_key(target.package_dir) == key:
+        return True
+    installs = [stage for stage in stages if stage.name in (target_prefix + "cxx-install", target_prefix + "cs-install")]
+    if all(stage_cache.is_fresh(stage.name, stage.fingerprint, stage.outputs) for stage in installs):
+        return False
+    return package_store.has(key)
+
+def explain_build(args: argparse.Namespace,
+                  targets: list[matrix.BuildTarget],
+                  cxx_compiler: cxx.CXXCompiler,
+                  budget: jobs.JobBudget,
+                  parallel_targets: int):
+    """Prints which stages a build with these arguments would run and how long it would take, without running anything"""
+    if args.pgo:
+        print("Profile-guided optimization builds every native stage twice with a training run in between, it can't be planned ahead")
+        return
+
+    stage_cache = cache.StageCache()
+    stages = create_stages(args, targets, cxx_compiler, optimization.OptimizationSettings(args.ipo, args.march),
+                           budget, parallel_targets=parallel_targets)
+    print(f"Build plan for {', '.join(target.name for target in targets)}:")
+
+    # Forced stages run no matter what, the others are checked against the stage cache like a real build does
+    forced: dict[str, str] = {}
+    if args.clean:
+        forced = {stage.name: "--clean removes all previous output" for stage in stages}
+    elif args.from_stage:
+        try:
+            build = scheduler.Scheduler(stages, from_stage=args.from_stage)
+        except ValueError as err:
+            print(err)
+            return
+        forced = {name: f"the build starts from {args.from_stage}" for name in build.forced}
+
+    restored = []
+    if not args.no_package_store and not args.from_stage:
+        package_store = store.PackageStore(args.package_store)
+        for target in targets:
+            target_prefix = get_target_prefix(targets, target)
+            if can_restore(package_store, stage_cache, target, target_prefix, get_package_key(stages, target_prefix), stages):
+                restored.append(target)
+        building = [target for target in targets if target not in restored]
+        stages = scheduler.get_required_stages(stages, [get_target_prefix(targets, target) + "cs-install" for target in building])
+
+    build_history = history.open_history()
+    estimates = build_history and build_history.get_estimates(",".join(target.name for target in targets), stages) or {}
+    plans = plan.create_plan(stages, stage_cache, estimates, forced, reuse_others=bool(args.from_stage))
+    plan.print_plan(plans, args.explain, [target.name for target in restored])
+
+    if build_history:
+        build_history.close()
+    toolchain.get_toolchain().save()
+    process.close_logs()
+
+def get_installed_triplet(target: matrix.BuildTarget) -> vcpkg.VTriplet:
+    """Returns the triplet vcpkg installs a target's packages for"""
+    triplet = vcpkg.get_vcpkg_triplet(target.platform, target.arch)
+    return triplet != vcpkg.VTriplet.NONE and triplet or vcpkg.get_host_triplet()
 
 def compile():
     args = parse_args() # Parse arguments from cli
+    if args.stats:
+        build_history = history.open_history()
+        if build_history:
+            history.print_stats(build_history, args.regression_threshold)
+            build_history.close()
+        return
+
+    resuming = args.resume
+    if resuming:
+        args = load_last_build(args.from_stage)
+        if args is None:
+            return
 
     # Get arguments
-    build_config = util.BuildConfig(args.config)
     cxx_compiler = cxx.CXXCompiler(args.compiler)
 
-    platform = util.Platform(args.platform)
-    arch = util.Architecture(args.arch)
+    if args.matrix:
+        try:
+            targets = matrix.parse_matrix(args.matrix)
+        except ValueError as err:
+            print(err)
+            return
+    else:
+        # Replaces "current" with the host platform/architecture
+        platform, arch = matrix.resolve(util.Platform(args.platform), util.Architecture(args.arch))
+        targets = [matrix.BuildTarget(platform, arch, util.BuildConfig(args.config))]
 
-    # Get host platform info
-    host_platform, host_arch = util.get_host_platform()
+    max_memory = None
+    if args.max_memory:
+        try:
+            max_memory = util.parse_size(args.max_memory)
+        except ValueError:
+            print(f"Invalid size {args.max_memory}, expected something like 512M or 16G")
+            return
+    budget = jobs.JobBudget(args.jobs, max_memory)
+    try:
+        package_store_size = util.parse_size(args.package_store_size)
+    except ValueError:
+        print(f"Invalid size {args.package_store_size}, expected something like 512M or 10G")
+        return
+    print(f"Build budget: {budget.describe()}")
+
+    parallel_targets = matrix.get_parallel_targets(len(targets), budget, args.parallel_targets)
+    if args.matrix:
+        print(f"Building {len(targets)} targets, {parallel_targets} at a time: {', '.join(target.name for target in targets)}")
 
-    if arch == util.Architecture.CURRENT:
-        arch = host_arch
-    if platform == util.Platform.CURRENT:
-        platform = host_platform
+    if args.dry_run or args.explain:
+        explain_build(args, targets, cxx_compiler, budget, parallel_targets)
+        return
 
-    vcpkg_triplet = vcpkg.get_vcpkg_triplet(platform, arch)
+    if args.watch and args.pgo:
+        print("Profile-guided optimization rebuilds everything twice, it can't be combined with --watch")
+        return
 
-    start = time.time()
+    # Watch from the start, so edits made during the first build trigger the next one
+    watcher = args.watch and watch.create_watcher() or None
 
-    # Clean build directory
-    if util.BUILD_DIRECTORY.exists():
+    # Clean build directory (except for caches), otherwise keep it around so stages can build incrementally
+    if args.clean and util.BUILD_DIRECTORY.exists():
         print("Cleaning build directory...")
-        shutil.rmtree(util.BUILD_DIRECTORY)
-    util.BUILD_DIRECTORY.mkdir(parents=True)
+        for item in util.BUILD_DIRECTORY.iterdir():
+            if item == util.CACHE_DIRECTORY:
+                continue
+            if item.is_dir():
+                shutil.rmtree(item)
+            else:
+                item.unlink()
+    util.BUILD_DIRECTORY.mkdir(parents=True, exist_ok=True)
+    if not resuming:
+        LAST_BUILD_FILE.write_text(json.dumps({"argv": sys.argv[1:]}, indent=4))
+
+    # Kept for the whole run, so rebuilds in watch mode reuse what earlier builds learned
+    stage_cache = cache.StageCache()
+    build_history = history.open_history()
+    tools = toolchain.get_toolchain()
+    cxx_optimization = optimization.OptimizationSettings(args.ipo, args.march)
+
+    # Every Ninja running at once (one per matrix target building at a time) shares the jobs native code gets out of the budget
+    jobserver = jobs.start_jobserver(budget.split(BUILD_WEIGHTS)["cxx"], parallel_targets)
+
+    # PGO packages depend on the training run, which isn't part of their fingerprint
+    package_store = not args.no_package_store and not args.pgo and store.PackageStore(args.package_store) or None
+
+    # Stages are compared with earlier builds of the same targets
+    history_targets = ",".join(target.name for target in targets)
 
-    did_compilation_succeed = False
-    elapsed = 0
-    status = "unk"
+    def build_stages(settings: optimization.OptimizationSettings,
+                     clean_build: bool,
+                     from_stage: str | None,
+                     stage_results: dict[str, tuple[str, float]],
+                     instrumented: bool = False):
+        stages = create_stages(args, targets, cxx_compiler, settings, budget, jobserver,
+                               clean_build, instrumented, parallel_targets)
+
+        building = targets
+        keys: dict[str, str] = {}
+        if package_store:
+            keys = {target.name: get_package_key(stages, get_target_prefix(targets, target)) for target in targets}
+            # Forcing stages to run means building them, whatever the store has
+            if from_stage is None:
+                building = [target for target in targets if not restore_package(target, keys[target.name], stages)]
+            if not building:
+                return
+
+            # Only the targets that weren't restored (and what they need) are built
+            stages = scheduler.get_required_stages(
+                stages, [get_target_prefix(targets, target) + "cs-install" for target in building])
+            for target in building:
+                store.detach(target.package_dir)
+
+        # Tokens of Ninjas killed in an earlier (cancelled) build never came back
+        if jobserver:
+            jobserver.refill()
+
+        # Stages forced to run can't be predicted from the stage cache
+        estimates = build_history and build_history.get_estimates(
+            history_targets, stages, from_stage is None and stage_cache or None) or None
+        try:
+            build = scheduler.Scheduler(
+                stages, stage_cache,
+                from_stage=from_stage,
+                resource_limits={NATIVE_RESOURCE: parallel_targets, DOTNET_RESOURCE: 1},
+                estimates=estimates)
+        except ValueError as err:
+            raise AssertionError(err)
+        succeeded = build.run()
+        for name, seconds in build.durations.items():
+            # Stages both PGO builds share are skipped by the second one, keep what the first one did
+            if name not in stage_results or build.status[name] != "skipped":
+                stage_results[name] = (build.status[name], seconds)
+        if not succeeded:
+            raise AssertionError(f"Stage {build.failed_stage} failed...")
+
+        if package_store:
+            for target in building:
+                if not package_store.has(keys[target.name]):
+                    package_store.save(keys[target.name], target.package_dir)
+            package_store.collect_garbage(package_store_size, store.DEFAULT_MAX_AGE_DAYS * 24 * 60 * 60)
+
+    def restore_package(target: matrix.BuildTarget, key: str, stages: list[scheduler.Stage]) -> bool:
+        """Restores a target's package from the store unless the last build already left it up to date"""
+        if not can_restore(package_store, stage_cache, target, get_target_prefix(targets, target), key, stages):
+            return False
+        if store.get_restored_key(target.package_dir) == key:
+            print(f"Package {target.package_dir} was already restored from the package store, skipping its stages...")
+            return True
+        return package_store.restore(key, target.package_dir)
+
+    def run_build(clean_build: bool, from_stage: str | None) -> bool:
+        """Runs every stage that's out of date, returning whether the build succeeded"""
+        did_compilation_succeed = False
+        elapsed = 0
+        status = "unk"
+        stage_results: dict[str, tuple[str, float]] = {}
+
+        start = time.time()
+        if args.profile:
+            profiler.enable()
+
+        # Begin building project
+        try:
+            if args.pgo:
+                if len(targets) > 1:
+                    raise AssertionError("Profile-guided optimization trains a single package, it can't be combined with --matrix")
+                target = targets[0]
+                if target.config == util.BuildConfig.DEBUG:
+                    raise AssertionError("Profile-guided optimization needs an optimized config (Release, Profile or Shipping)")
+
+                # Build instrumented code and record how the training workload uses it, then build again in the
+                # same tree with the recorded profiles. Only the optimized build starts from --from-stage, the
+                # stages it shares with the instrumented one run (or are skipped) once
+                instrumented = cxx_optimization.with_pgo(optimization.PGOPhase.GENERATE)
+                optimization.clear_profiles(instrumented.pgo_dir)
+                build_stages(instrumented, clean_build, None, stage_results, instrumented=True)
+                if not optimization.train(target.package_dir, instrumented.pgo_dir, args.pgo_workload,
+                                          args.pgo_frames or optimization.TRAINING_FRAMES):
+                    raise AssertionError("PGO training workload failed...")
+                build_stages(cxx_optimization.with_pgo(optimization.PGOPhase.USE), False, from_stage, stage_results)
+            else:
+                build_stages(cxx_optimization, clean_build, from_stage, stage_results)
+        except AssertionError as err:
+            print(f"Torsion failed to finish compilation: {err}")
+            if not watcher:
+                print("Stages that completed are kept, run again with --resume to continue where this build stopped.")
+        else:
+            packages = ", ".join(str(target.package_dir) for target in targets)
+            print(f"Torsion successfully compiled project to {util.BUILD_DIRECTORY} and packaged it into {packages}.")
+            did_compilation_succeed = True
+        finally:
+            stage_cache.save()
+            tools.save()
+            process.close_logs()
+            if args.profile:
+                # Matrix targets prefix their stages, a PGO build's last pass is the one left in the Ninja log
+                profiler.get_active().write(ninja_logs={
+                    get_target_prefix(targets, target) + "cxx": target.cxx_out_dir / ".ninja_log" for target in targets})
+            elapsed = time.time()-start
+            status = did_compilation_succeed and "succeed" or "fail"
+        print(f"Torsion compilation time took {elapsed:.2f}s to {status}")
+
+        if build_history:
+            build_id = build_history.record(start, elapsed, did_compilation_succeed, history_targets, sys.argv[1:], stage_results)
+            if build_id is not None:
+                history.print_regressions(build_history.find_regressions(build_id, args.regression_threshold), args.regression_threshold)
+        return did_compilation_succeed
 
-    # Begin building project
     try:
-        # Build vcpkg packages (C++ depends on it, unless they have already been built)
-        vcpkg_build_res = vcpkg.build_packages(vcpkg_triplet)
-        if not vcpkg_build_res:
-            raise AssertionError("Failed to build vcpkg packages...")
-        
-        # Generate C# bindings from C++
-        print("Generating C# bindings from C++ components...")
-        swig_generation_res = swig.generate_cs_from_swig(util.SWIG_OUT_FOLDER)
-        if not swig_generation_res:
-            raise AssertionError("Failed to generate C# bindings from C++ components...")
-
-        # Compile C++ (C# depends on it)
-        print("Compiling C++ components...")
-        cxx_compilation_res = cxx.compile(
-            util.CXXOUT_FOLDER, 
-            build_config, 
-            cxx_compiler, 
-            platform, 
-            arch)
-        if not cxx_compilation_res:
-            raise AssertionError("Failed to compile C++ components...")
-    
-        # Compile C#
-        print("Compiling C# components...")
-        cs_compilation_res = cs.compile(
-            util.CSOUT_FOLDER, 
-            build_config, 
-            platform, 
-            arch)
-        if not cs_compilation_res:
-            raise AssertionError("Failed to compile C# components...")
-
-        # Install C++ to package directory
-        print("Installing C++ components...")
-        cxx_installation_res = cxx.install(util.CXXOUT_FOLDER, util.PACKAGE_DIRECTORY)
-        if not cxx_installation_res:
-            raise AssertionError("Failed to install C++ components...")
-    
-        # Install C# to package directory
-        print("Installing C# components...")
-        cs_installation_res = cs.install(util.CSOUT_FOLDER, util.PACKAGE_DIRECTORY)
-        if not cs_installation_res:
-            raise AssertionError("Failed to install C# components...")
-    except AssertionError as err:
-        print(f"Torsion failed to finish compilation: {err}")
-    else:
-        print(f"Torsion successfully compiled project to {util.BUILD_DIRECTORY} and packaged it into {util.PACKAGE_DIRECTORY}.")
-        did_compilation_succeed = True
+        run_build(args.clean, args.from_stage)
+        if watcher:
+            # Only stages whose inputs changed run again, the rest are skipped by the stage cache
+            watch.watch(watcher, lambda: run_build(clean_build=False, from_stage=None))
     finally:
-        elapsed = time.time()-start
-        status = did_compilation_succeed and "succeed" or "fail"
-    print(f"Torsion compilation time took {elapsed:.2f}s to {status}")
+        if watcher:
+            cs.shutdown_build_servers()
+        if jobserver:
+            jobserver.close()
+        if build_history:
+            build_history.close()
 
 if __name__ == "__main__":
     compile()
\ No newline at end of file
@@ -0,0 +1,260 @@
+import json
+import sqlite3
+import statistics
+import subprocess
+import time
+
+from pathlib import Path
+from typing import NamedTuple
+
+from scripts import cache
+from scripts import scheduler
+from scripts import util
+
+HISTORY_FILE = util.CACHE_DIRECTORY / "history.sqlite"
+
+# How many earlier runs of a stage its usual duration is the median of
+ROLLING_WINDOW = 10
+
+# How much slower than usual (in percent) a stage has to get to be flagged
+REGRESSION_THRESHOLD = 25.0
+
+# Stages quicker than this vary too much between runs to call them regressed
+MIN_REGRESSION_SECONDS = 1.0
+
+# Older builds are dropped once the history holds this many
+MAX_BUILDS = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS builds (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started REAL NOT NULL,
+    elapsed REAL NOT NULL,
+    succeeded INTEGER NOT NULL,
+    revision TEXT,
+    targets TEXT NOT NULL,
+    arguments TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS stages (
+    build_id INTEGER NOT NULL REFERENCES builds(id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    status TEXT NOT NULL,
+    elapsed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS stages_by_name ON stages(name, status, build_id);
+"""
+
+class Regression(NamedTuple):
+    """A stage that took longer than usual"""
+    stage: str
+    elapsed: float
+    median: float
+
+    @property
+    def change(self) -> float:
+        """How much slower the stage got, in percent"""
+        return (self.elapsed / self.median - 1) * 100
+
+class BuildHistory:
+    """Every build's per-stage timings, kept in a small SQLite database
+
+    Note:
+        Stages are compared with earlier runs of the same stage for the same targets, and only
+        runs that actually did work count. Stages skipped by the stage cache are recorded as
+        cache hits but never make up a stage's usual duration
+
+    Args:
+        path: The database file, created if it doesn't exist
+
+    Raises:
+        sqlite3.Error: If the database can't be opened
+    """
+
+    def __init__(self, path: Path = HISTORY_FILE):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        # Builds running at the same time wait for each other's writes instead of failing
+        self._db = sqlite3.connect(path, timeout=30)
+        self._db.execute("PRAGMA foreign_keys = ON")
+        self._db.executescript(SCHEMA)
+
+    def close(self):
+        self._db.close()
+
+    def record(self,
+               started: float,
+               elapsed: float,
+               succeeded: bool,
+               targets: str,
+               arguments: list[str],
+               stages: dict[str, tuple[str, float]]) -> int | None:
+        """Records a finished build
+
+        Args:
+            started: When the build started, in seconds since the epoch
+            elapsed: How many seconds the whole build took
+            succeeded: Whether the build succeeded
+            targets: The targets it built (I.E. linux-x64-Debug), comma separated
+            arguments: The command line it was started with
+            stages: Every stage's status (succeeded, skipped, failed...) and seconds it took
+
+        Returns:
+            int|None: The id of the recorded build, or None if it couldn't be recorded
+        """
+        try:
+            return self._record(started, elapsed, succeeded, targets, arguments, stages)
+        except sqlite3.Error as err:
+            print(f"Failed to record the build in {self.path}: {err}")
+            return None
+
+    def _record(self,
+                started: float,
+                elapsed: float,
+                succeeded: bool,
+                targets: str,
+                arguments: list[str],
+                stages: dict[str, tuple[str, float]]) -> int:
+        with self._db:
+            build_id = self._db.execute(
+                "INSERT INTO builds (started, elapsed, succeeded, revision, targets, arguments) VALUES (?, ?, ?, ?, ?, ?)",
+                (started, elapsed, succeeded, get_revision(), targets, json.dumps(arguments))).lastrowid
+            self._db.executemany(
+                "INSERT INTO stages (build_id, name, status, elapsed) VALUES (?, ?, ?, ?)",
+                [(build_id, name, status, seconds) for name, (status, seconds) in stages.items()])
+            self._db.execute("DELETE FROM builds WHERE id <= ?", (build_id - MAX_BUILDS,))
+        return build_id
+
+    def get_durations(self, targets: str, stage: str, before: int | None = None, limit: int = ROLLING_WINDOW) -> list[float]:
+        """Returns how long a stage took in the latest builds of the same targets where it ran, newest first
+
+        Args:
+            targets: The targets of the builds to look at
+            stage: The name of the stage
+            before: Only look at builds older than this build id, or None to look at all of them
+            limit: How many runs to return at most
+        """
+        query = ("SELECT stages.elapsed FROM stages JOIN builds ON builds.id = stages.build_id "
+                 "WHERE builds.targets = ? AND stages.name = ? AND stages.status = 'succeeded'")
+        parameters: list = [targets, stage]
+        if before is not None:
+            query += " AND builds.id < ?"
+            parameters.append(before)
+        rows = self._db.execute(f"{query} ORDER BY builds.id DESC LIMIT ?", (*parameters, limit))
+        return [elapsed for (elapsed,) in rows]
+
+    def get_estimates(self,
+                      targets: str,
+                      stages: list[scheduler.Stage],
+                      stage_cache: cache.StageCache | None = None) -> dict[str, float]:
+        """Predicts how long each stage will take, for the build's ETA
+
+        Args:
+            targets: The targets being built
+            stages: The stages of the build
+            stage_cache: Used to predict which stages get skipped, or None if every stage is going to run
+
+        Returns:
+            dict[str, float]: The expected seconds of every stage that can be predicted, stages that
+            never ran before are left out
+        """
+        estimates: dict[str, float] = {}
+        for stage in stages:
+            if stage_cache and stage.fingerprint is not None and stage_cache.get_fingerprint(stage.name) == stage.fingerprint:
+                estimates[stage.name] = 0.0 # Its inputs didn't change, the stage cache will most likely skip it
+                continue
+            durations = self.get_durations(targets, stage.name)
+            if durations:
+                estimates[stage.name] = statistics.median(durations)
+        return estimates
+
+    def find_regressions(self, build_id: int, threshold: float = REGRESSION_THRESHOLD) -> list[Regression]:
+        """Finds the stages of a build that took more than threshold percent longer than their rolling median
+
+        Returns:
+            list[Regression]: The slower stages, the slowest (relative to usual) first
+        """
+        targets = self._db.execute("SELECT targets FROM builds WHERE id = ?", (build_id,)).fetchone()
+        if targets is None:
+            return []
+
+        regressions = []
+        rows = self._db.execute("SELECT name, elapsed FROM stages WHERE build_id = ? AND status = 'succeeded'", (build_id,))
+        for stage, elapsed in rows.fetchall():
+            durations = self.get_durations(targets[0], stage, before=build_id)
+            if not durations or elapsed < MIN_REGRESSION_SECONDS:
+                continue
+            regression = Regression(stage, elapsed, statistics.median(durations))
+            if regression.median > 0 and regression.change > threshold:
+                regressions.append(regression)
+        return sorted(regressions, key=lambda regression: regression.change, reverse=True)
+
+    def get_recent_builds(self, limit: int) -> list[tuple]:
+        """Returns (id, started, elapsed, succeeded, revision, targets) of the latest builds, newest first"""
+        return self._db.execute(
+            "SELECT id, started, elapsed, succeeded, revision, targets FROM builds ORDER BY id DESC LIMIT ?",
+            (limit,)).fetchall()
+
+    def get_stage_names(self, build_id: int) -> list[str]:
+        """Returns the stages a build ran or skipped, in the order they were recorded"""
+        return [name for (name,) in self._db.execute("SELECT name FROM stages WHERE build_id = ? ORDER BY rowid", (build_id,))]
+
+def open_history(path: Path = HISTORY_FILE) -> BuildHistory | None:
+    """Opens the build history
+
+    Returns:
+        BuildHistory|None: The history, or None if it can't be opened (builds still work without it)
+    """
+    try:
+        return BuildHistory(path)
+    except sqlite3.Error as err:
+        print(f"Build history at {path} can't be opened, timings won't be recorded: {err}")
+        return None
+
+def get_revision() -> str | None:
+    """Returns the checked out git revision (with -dirty if there are local changes), or None outside of a git checkout"""
+    try:
+        result = subprocess.run(["git", "describe", "--always", "--dirty"], cwd=util.PROJECT_ROOT,
+                                capture_output=True, text=True, timeout=10)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    return result.returncode == 0 and result.stdout.strip() or None
+
+def print_regressions(regressions: list[Regression], threshold: float = REGRESSION_THRESHOLD):
+    """Warns about stages that got slower than usual"""
+    if not regressions:
+        return
+    print(f"Stages more than {threshold:.0f}% slower than their median of the last {ROLLING_WINDOW} runs:")
+    for regression in regressions:
+        print(f"  {regression.stage:<32} {util.format_duration(regression.elapsed):>8} "
+              f"(usually {util.format_duration(regression.median)}, {regression.change:+.0f}%)")
+
+def print_stats(history: BuildHistory, threshold: float = REGRESSION_THRESHOLD, limit: int = 10):
+    """Prints the latest builds, then every stage's trend for the latest build's targets
+
+    Args:
+        history: The build history
+        threshold: How much slower than usual (in percent) a stage has to get to be flagged
+        limit: How many builds to list
+    """
+    builds = history.get_recent_builds(limit)
+    if not builds:
+        print(f"No builds recorded in {history.path} yet")
+        return
+
+    print(f"Last {len(builds)} builds:")
+    for build_id, started, elapsed, succeeded, revision, targets in builds:
+        date = time.strftime("%Y-%m-%d %H:%M", time.localtime(started))
+        status = succeeded and "succeeded" or "failed"
+        print(f"  #{build_id:<5} {date}  {revision or '-':<16} {util.format_duration(elapsed):>8}  {status:<9}  {targets}")
+
+    latest_id, _, _, _, _, targets = builds[0]
+    print(f"\nStage trends for {targets} (newest last, median of the last {ROLLING_WINDOW} runs that did work):")
+    flagged = {regression.stage for regression in history.find_regressions(latest_id, threshold)}
+    for stage in history.get_stage_names(latest_id):
+        durations = history.get_durations(targets, stage, before=latest_id + 1)
+        if not durations:
+            print(f"  {stage:<32} always skipped")
+            continue
+        trend = " ".join(util.format_duration(duration) for duration in reversed(durations[:5]))
+        flag = stage in flagged and f"  <-- more than {threshold:.0f}% slower than usual" or ""
+        print(f"  {stage:<32} median {util.format_duration(statistics.median(durations)):>8}  [{trend}]{flag}")
@@ -0,0 +1,227 @@
+import errno
+import filecmp
+import os
+import shutil
+import sys
+import threading
+
+from enum import Enum
+from pathlib import Path
+from typing import Iterable
+
+class InstallMethod(Enum):
+    REFLINK = "reflinked"
+    HARDLINK = "hard-linked"
+    COPY = "copied"
+    MOVE = "moved"
+    UNCHANGED = "unchanged"
+
+# ioctl that clones a file's extents on copy-on-write filesystems (btrfs, xfs, bcachefs...)
+FICLONE = 0x40049409
+
+# Errors meaning a strategy isn't supported between two folders, so it isn't tried there again
+UNSUPPORTED_ERRORS = {errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.EPERM, errno.ENOSYS}
+
+_unsupported: set[tuple[InstallMethod, int, int]] = set()
+_lock = threading.Lock()
+
+def is_unchanged(source: Path, dest: Path) -> bool:
+    """Checks if a destination file already matches its source
+
+    Note:
+        Files with matching sizes and modification times are trusted without reading them,
+        otherwise same-sized files are compared byte for byte
+
+    Returns:
+        bool: True if installing the source again would change nothing
+    """
+    try:
+        source_stat = source.stat()
+        dest_stat = dest.stat()
+    except OSError:
+        return False
+
+    if source_stat.st_ino == dest_stat.st_ino and source_stat.st_dev == dest_stat.st_dev:
+        return True
+    if source_stat.st_size != dest_stat.st_size:
+        return False
+    if source_stat.st_mtime_ns == dest_stat.st_mtime_ns:
+        return True
+    return filecmp.cmp(source, dest, shallow=False)
+
+def install_file(source: Path, dest: Path) -> InstallMethod:
+    """Installs a file, using the cheapest method the filesystem supports
+
+    Note:
+        Reflinks are tried first since they share data without sharing the file, then hard
+        links when both sides are on the same device, and finally a regular copy
+
+    Args:
+        source: The file to install
+        dest: Where to install it
+
+    Returns:
+        InstallMethod: How the file was installed
+    """
+    if is_unchanged(source, dest):
+        return InstallMethod.UNCHANGED
+
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    devices = (source.stat().st_dev, dest.parent.stat().st_dev)
+
+    # Install next to the destination, then swap it in so readers never see a partial file
+    temp = dest.with_name(f".{dest.name}.tmp")
+    temp.unlink(missing_ok=True)
+
+    for method, install in ((InstallMethod.REFLINK, clone_file), (InstallMethod.HARDLINK, _hardlink)):
+        with _lock:
+            if (method, *devices) in _unsupported:
+                continue
+        try:
+            install(source, temp)
+        except OSError as err:
+            temp.unlink(missing_ok=True)
+            if err.errno in UNSUPPORTED_ERRORS:
+                with _lock:
+                    _unsupported.add((method, *devices))
+            continue
+        os.replace(temp, dest)
+        return method
+
+    shutil.copy2(source, temp)
+    os.replace(temp, dest)
+    return InstallMethod.COPY
+
+def install_tree(source_dir: Path, dest_dir: Path, manifest: Path | None = None) -> dict[InstallMethod, int]:
+    """Installs every file in a folder into another folder, keeping the layout
+
+    Note:
+        The destination can hold files from elsewhere (I.E. a package's native libraries), so
+        only files the manifest lists from the last install are removed when the source no
+        longer has them
+
+    Args:
+        source_dir: The folder to install
+        dest_dir: Where to install it
+        manifest: Where the installed files are listed for the next install, or None to leave files
+            the source no longer has in place
+
+    Returns:
+        dict[InstallMethod, int]: How many files were installed with each method
+    """
+    counts = {method: 0 for method in InstallMethod}
+    installed = set()
+    for root, _, files in os.walk(source_dir):
+        relative = Path(root).relative_to(source_dir)
+        for name in files:
+            counts[install_file(Path(root) / name, dest_dir / relative / name)] += 1
+            installed.add((relative / name).as_posix())
+
+    if manifest is not None:
+        try:
+            previous = set(manifest.read_text().splitlines())
+        except OSError:
+            previous = set()
+        remove_files(dest_dir, previous - installed)
+        manifest.parent.mkdir(parents=True, exist_ok=True)
+        manifest.write_text("".join(f"{name}\n" for name in sorted(installed)))
+    return counts
+
+def move_tree(source_dir: Path, dest_dir: Path, mirror: bool = False) -> dict[InstallMethod, int]:
+    """Moves every file in a folder into another folder, then removes the source folder
+
+    Note:
+        Files are renamed into place when both folders are on the same device, unchanged
+        files are left alone so they keep their modification times
+
+    Args:
+        source_dir: The folder to move
+        dest_dir: Where to move it
+        mirror: Whether files in dest_dir the source doesn't have are removed, so it ends up
+            holding exactly what source_dir did
+
+    Returns:
+        dict[InstallMethod, int]: How many files were moved, left unchanged or copied
+    """
+    counts = {method: 0 for method in InstallMethod}
+    moved = set()
+    for root, _, files in os.walk(source_dir):
+        relative = Path(root).relative_to(source_dir)
+        for name in files:
+            source = Path(root) / name
+            dest = dest_dir / relative / name
+            moved.add((relative / name).as_posix())
+            if is_unchanged(source, dest):
+                counts[InstallMethod.UNCHANGED] += 1
+                continue
+
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                os.replace(source, dest)
+                counts[InstallMethod.MOVE] += 1
+            except OSError as err:
+                if err.errno != errno.EXDEV:
+                    raise
+                counts[install_file(source, dest)] += 1
+    shutil.rmtree(source_dir)
+
+    if mirror and dest_dir.exists():
+        extraneous = []
+        for root, _, files in os.walk(dest_dir):
+            relative = Path(root).relative_to(dest_dir)
+            extraneous.extend((relative / name).as_posix() for name in files if (relative / name).as_posix() not in moved)
+        remove_files(dest_dir, extraneous)
+    return counts
+
+def remove_files(folder: Path, names: Iterable[str]) -> int:
+    """Removes files from a folder, then the folders they leave empty
+
+    Args:
+        folder: The folder the files are in
+        names: The files' paths relative to folder
+
+    Returns:
+        int: How many files were removed
+    """
+    removed = 0
+    for name in names:
+        file = folder / name
+        try:
+            file.unlink()
+        except FileNotFoundError:
+            continue
+        removed += 1
+        # Folders a different output used (I.E. runtimes/win-x64) go away with their last file
+        parent = file.parent
+        while parent != folder:
+            try:
+                parent.rmdir()
+            except OSError:
+                break
+            parent = parent.parent
+    return removed
+
+def describe(counts: dict[InstallMethod, int]) -> str:
+    """Summarizes install counts for printing (I.E. "12 files: 10 hard-linked, 2 unchanged")"""
+    parts = [f"{count} {method.value}" for method, count in counts.items() if count]
+    return f"{sum(counts.values())} files: {', '.join(parts) or 'none'}"
+
+def clone_file(source: Path, dest: Path):
+    """Clones a file's data with the FICLONE ioctl (Linux only), both files share it until either is written to
+
+    Raises:
+        OSError: If the platform or filesystem can't clone files (I.E. ext4)
+    """
+    if not sys.platform.startswith("linux"):
+        raise OSError(errno.EOPNOTSUPP, "Reflinks are only supported on Linux")
+
+    import fcntl
+    with open(source, "rb") as src, open(dest, "wb") as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+    shutil.copystat(source, dest)
+
+def _hardlink(source: Path, dest: Path):
+    """Links the destination to the source's data, both must be on the same device"""
+    if os.stat(source).st_dev != os.stat(dest.parent).st_dev:
+        raise OSError(errno.EXDEV, "Hard links can't cross devices")
+    os.link(source, dest)
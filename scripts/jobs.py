@@ -0,0 +1,269 @@
+import math
+import os
+import re
+import shutil
+import tempfile
+
+from pathlib import Path
+
+from scripts import scheduler
+from scripts import util
+
+# Rough peak memory of a single compile job, used to keep the job count within the memory budget
+MEMORY_PER_JOB = 1024 ** 3
+
+# cgroup memory limits at or above this are the kernel's way of saying "no limit"
+UNLIMITED_MEMORY = 1 << 60
+
+# Ninja joins a GNU make jobserver from this version on
+NINJA_JOBSERVER_VERSION = (1, 13)
+
+CGROUP_ROOT = Path("/sys/fs/cgroup")
+
+def _read(file: Path) -> str | None:
+    try:
+        return file.read_text().strip()
+    except OSError:
+        return None
+
+def _get_cgroup_folders(controller: str) -> list[Path]:
+    """Returns the cgroup folders whose limits apply to this process, innermost first
+
+    Note:
+        Limits can be set on any ancestor, so every folder up to the hierarchy's root is
+        checked. Containers usually mount their own cgroup as the root, so the root is
+        always included even if our cgroup's path doesn't exist under it
+
+    Args:
+        controller: The cgroup v1 controller (I.E. cpu or memory), cgroup v2 has a single hierarchy
+    """
+    folders: list[Path] = []
+    for line in (_read(Path("/proc/self/cgroup")) or "").splitlines():
+        _, controllers, path = line.split(":", 2)
+        if controllers == "":
+            root = CGROUP_ROOT # cgroup v2
+        elif controller in controllers.split(","):
+            root = CGROUP_ROOT / controllers
+            if not root.exists():
+                root = CGROUP_ROOT / controller
+        else:
+            continue
+
+        folder = root / path.lstrip("/")
+        while folder != root and root in folder.parents:
+            folders.append(folder)
+            folder = folder.parent
+        folders.append(root)
+    return folders
+
+def get_cgroup_cpu_limit() -> float | None:
+    """Returns how many CPUs our cgroup's quota allows, or None if there is no quota"""
+    limits: list[float] = []
+    for folder in _get_cgroup_folders("cpu"):
+        # cgroup v2: "<quota> <period>" or "max <period>"
+        cpu_max = _read(folder / "cpu.max")
+        if cpu_max:
+            quota, _, period = cpu_max.partition(" ")
+            if quota != "max" and period:
+                limits.append(int(quota) / int(period))
+            continue
+
+        # cgroup v1: a quota of -1 means unlimited
+        quota = _read(folder / "cpu.cfs_quota_us")
+        period = _read(folder / "cpu.cfs_period_us")
+        if quota and period and int(quota) > 0:
+            limits.append(int(quota) / int(period))
+    return limits and min(limits) or None
+
+def get_cgroup_memory_limit() -> int | None:
+    """Returns how much memory our cgroup may still use, or None if it isn't limited"""
+    limits: list[int] = []
+    for folder in _get_cgroup_folders("memory"):
+        for limit_file, usage_file in (("memory.max", "memory.current"), ("memory.limit_in_bytes", "memory.usage_in_bytes")):
+            limit = _read(folder / limit_file)
+            if not limit or limit == "max" or int(limit) >= UNLIMITED_MEMORY:
+                continue
+            usage = _read(folder / usage_file)
+            limits.append(max(0, int(limit) - int(usage or 0)))
+    return limits and min(limits) or None
+
+def get_available_memory() -> int | None:
+    """Returns how much memory can be used without swapping, or None if the OS can't tell"""
+    try:
+        with open("/proc/meminfo") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+def get_usable_cpus() -> int:
+    """Returns how many CPUs this process can actually use
+
+    Note:
+        os.cpu_count() reports every CPU in the machine, even on CI hosts where our
+        affinity mask or cgroup quota only leaves a few of them to us
+    """
+    if hasattr(os, "sched_getaffinity"):
+        cpus = len(os.sched_getaffinity(0))
+    else:
+        cpus = os.cpu_count() or 1
+
+    quota = get_cgroup_cpu_limit()
+    if quota is not None:
+        cpus = min(cpus, math.ceil(quota))
+    return max(1, cpus)
+
+def get_usable_memory() -> int | None:
+    """Returns how much memory this process can use, or None if the OS can't tell"""
+    limits = [limit for limit in (get_available_memory(), get_cgroup_memory_limit()) if limit is not None]
+    return limits and min(limits) or None
+
+class JobBudget:
+    """How many jobs and how much memory the whole build may use, shared between every tool it runs
+
+    Args:
+        jobs: How many jobs may run at once, defaults to the usable CPUs
+        max_memory: How many bytes the build may use, defaults to the usable memory
+    """
+
+    def __init__(self, jobs: int | None = None, max_memory: int | None = None):
+        self.cpus = get_usable_cpus()
+        self.memory = max_memory or get_usable_memory()
+
+        self.jobs = jobs or self.cpus
+        if self.memory is not None and not jobs:
+            # Leave every job enough memory that the build doesn't start swapping
+            self.jobs = min(self.jobs, self.memory // MEMORY_PER_JOB)
+        self.jobs = max(1, self.jobs)
+
+    def describe(self) -> str:
+        """Summarizes the budget for printing (I.E. "8 jobs, 16.0GiB")"""
+        memory = self.memory is not None and util.format_size(self.memory) or "unknown memory"
+        return f"{self.jobs} jobs ({self.cpus} usable CPUs), {memory}"
+
+    def split(self, weights: dict[str, int], parts: int = 1) -> dict[str, int]:
+        """Splits the jobs between tools that run at the same time
+
+        Args:
+            weights: How large a share each tool should get relative to the others
+            parts: How many copies of the tools run at once (I.E. matrix targets), each gets an equal share
+
+        Returns:
+            dict[str, int]: The number of jobs each tool may run, at least 1 each
+        """
+        return scheduler.split_cpu_budget(weights, max(1, self.jobs // max(1, parts)))
+
+class Jobserver:
+    """A GNU make jobserver that Ninja 1.13+ (and make 4.4+) joins, sharing one job budget between every build it starts
+
+    Note:
+        Uses the named pipe protocol, which is POSIX only. Every client gets one job for
+        free and takes a token from the pipe for each job beyond that, so the pipe is
+        filled with one token less than the budget for every client running at once
+
+    Args:
+        jobs: How many jobs the clients may run at once
+        clients: How many clients run at the same time (I.E. one Ninja per matrix target building at once)
+    """
+
+    def __init__(self, jobs: int, clients: int = 1):
+        self.jobs = max(1, jobs)
+        self.tokens = max(0, self.jobs - max(1, clients))
+        self._folder = Path(tempfile.mkdtemp(prefix="torsion-jobserver-"))
+        self.fifo = self._folder / "fifo"
+        os.mkfifo(self.fifo, 0o600)
+
+        # Kept open for reading and writing, so the pipe stays alive between clients and writing never blocks
+        self._fd = os.open(self.fifo, os.O_RDWR | os.O_NONBLOCK)
+        os.write(self._fd, b"+" * self.tokens)
+
+    def refill(self):
+        """Puts the pipe back to its full count of tokens
+
+        Note:
+            Clients that get killed (I.E. a cancelled build) never return the tokens they hold, so this
+            runs before every build to stop a long --watch session from slowly losing its jobs. No
+            client may be running while it does
+        """
+        try:
+            while os.read(self._fd, 4096):
+                pass
+        except BlockingIOError:
+            pass # The pipe is empty
+        os.write(self._fd, b"+" * self.tokens)
+
+    def acquire(self, tokens: int) -> int:
+        """Takes up to the given number of tokens that are free right now, without waiting for more
+
+        Note:
+            For tools that can't join the jobserver themselves (I.E. vcpkg), they hold the taken
+            tokens for as long as they run so the clients that do join get fewer jobs meanwhile
+
+        Returns:
+            int: How many tokens were taken, they must be given back with release()
+        """
+        if tokens <= 0:
+            return 0
+        try:
+            return len(os.read(self._fd, tokens))
+        except BlockingIOError:
+            return 0 # Every token is in use
+
+    def release(self, tokens: int):
+        """Gives back tokens taken with acquire()"""
+        if tokens > 0:
+            os.write(self._fd, b"+" * tokens)
+
+    def get_makeflags(self) -> str:
+        return f"-j{self.jobs} --jobserver-auth=fifo:{self.fifo}"
+
+    def get_environment(self, env: dict[str, str] | None = None) -> dict[str, str]:
+        """Returns an environment that points clients at this jobserver
+
+        Args:
+            env: The environment to extend, defaults to ours
+
+        Returns:
+            dict[str, str]: A copy of the environment with MAKEFLAGS set
+        """
+        env = dict(env or os.environ)
+        # Drop any jobserver we were started under, ours hands out its share
+        makeflags = re.sub(r"\s*(-j\d*|--jobserver-(auth|fds)=\S+)", "", env.get("MAKEFLAGS", "")).strip()
+        env["MAKEFLAGS"] = f"{makeflags} {self.get_makeflags()}".strip()
+        return env
+
+    def close(self):
+        """Closes the pipe and removes it, clients still running lose their tokens"""
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        shutil.rmtree(self._folder, ignore_errors=True)
+
+def start_jobserver(jobs: int, clients: int = 1) -> Jobserver | None:
+    """Starts a jobserver if this platform supports the named pipe protocol
+
+    Args:
+        jobs: How many jobs the clients may run at once
+        clients: How many clients run at the same time
+
+    Returns:
+        Jobserver|None: The jobserver, or None on platforms without named pipes (I.E. Windows)
+    """
+    if not hasattr(os, "mkfifo"):
+        return None
+    try:
+        return Jobserver(jobs, clients)
+    except OSError as err:
+        print(f"Failed to start a jobserver, tools will be given fixed job counts instead: {err}")
+        return None
+
+def supports_jobserver(version: str) -> bool:
+    """Checks if a Ninja version (as toolchain.version() reports it) joins GNU make jobservers"""
+    match = re.search(r"(\d+)\.(\d+)", version.rpartition(":")[2])
+    return match is not None and (int(match[1]), int(match[2])) >= NINJA_JOBSERVER_VERSION
@@ -0,0 +1,120 @@
+from pathlib import Path
+
+from scripts import jobs
+from scripts import util
+
+# Every target of a matrix build gets its own build tree and package in here
+MATRIX_FOLDER = util.BUILD_DIRECTORY / "matrix"
+
+# Rough peak memory of one target's native build, used to decide how many targets build at once
+TARGET_MEMORY_ESTIMATE = 4 * 1024 ** 3
+
+class BuildTarget:
+    """A platform/arch/config combination and the folders it builds into
+
+    Note:
+        Targets without a root keep the single-target layout (out/cmake, out/.net and out/torsion)
+
+    Args:
+        platform: The platform to build for
+        arch: The architecture to build for
+        config: The build config to use
+        root: The folder the target's build trees and package go in, or None for the single-target layout
+    """
+
+    def __init__(self,
+                 platform: util.Platform,
+                 arch: util.Architecture,
+                 config: util.BuildConfig,
+                 root: Path | None = None):
+        self.platform = platform
+        self.arch = arch
+        self.config = config
+        self.root = root
+
+    @property
+    def name(self) -> str:
+        """The target as it's written on the command line (I.E. linux-x64-Debug)"""
+        return f"{self.platform.value}-{self.arch.value}-{self.config.value}"
+
+    @property
+    def cxx_out_dir(self) -> Path:
+        return self.root and self.root / "cmake" or util.CXXOUT_FOLDER
+
+    @property
+    def cs_out_dir(self) -> Path:
+        return self.root and self.root / ".net" or util.CSOUT_FOLDER
+
+    @property
+    def cs_publish_dir(self) -> Path:
+        """Where dotnet publish writes to before the output is moved into cs_out_dir"""
+        return self.root and self.root / "publish" or util.CSTEMP_OUT_DIR
+
+    @property
+    def package_dir(self) -> Path:
+        return self.root and self.root / "torsion" or util.PACKAGE_DIRECTORY
+
+def resolve(platform: util.Platform, arch: util.Architecture) -> tuple[util.Platform, util.Architecture]:
+    """Replaces "current" with the host's platform/architecture"""
+    host_platform, host_arch = util.get_host_platform()
+    return (platform == util.Platform.CURRENT and host_platform or platform,
+            arch == util.Architecture.CURRENT and host_arch or arch)
+
+def parse_target(text: str) -> BuildTarget:
+    """Parses a matrix target like linux-x64-Debug, the config is case insensitive
+
+    Raises:
+        ValueError: If the text isn't a platform, architecture and config separated by dashes
+    """
+    parts = text.strip().split("-")
+    if len(parts) != 3:
+        raise ValueError(f"Matrix target {text} isn't written as platform-arch-config (I.E. linux-x64-Debug)")
+
+    platform_name, arch_name, config_name = parts
+    configs = {config.value.lower(): config for config in util.BuildConfig}
+    try:
+        platform, arch = resolve(util.Platform(platform_name.lower()), util.Architecture(arch_name.lower()))
+    except ValueError:
+        raise ValueError(f"Matrix target {text} has an unknown platform or architecture")
+    if config_name.lower() not in configs:
+        raise ValueError(f"Matrix target {text} has an unknown config, expected one of {', '.join(config.value for config in util.BuildConfig)}")
+
+    target = BuildTarget(platform, arch, configs[config_name.lower()])
+    target.root = MATRIX_FOLDER / target.name
+    return target
+
+def parse_matrix(text: str) -> list[BuildTarget]:
+    """Parses a comma separated list of matrix targets, dropping duplicates
+
+    Raises:
+        ValueError: If a target can't be parsed or the list is empty
+    """
+    targets: dict[str, BuildTarget] = {}
+    for part in text.split(","):
+        if part.strip():
+            target = parse_target(part)
+            targets.setdefault(target.name, target)
+    if not targets:
+        raise ValueError("The build matrix has no targets")
+    return list(targets.values())
+
+def get_parallel_targets(target_count: int, budget: jobs.JobBudget, limit: int | None = None) -> int:
+    """Decides how many targets build their native code at once
+
+    Note:
+        Defaults to as many as fit into the budget's memory at TARGET_MEMORY_ESTIMATE each,
+        and never more than there are jobs
+
+    Args:
+        target_count: How many targets the matrix has
+        budget: The jobs and memory the whole build may use
+        limit: An explicit limit from the command line, or None to work it out
+
+    Returns:
+        int: Between 1 and target_count
+    """
+    if limit is None:
+        limit = budget.jobs
+        if budget.memory is not None:
+            limit = min(limit, budget.memory // TARGET_MEMORY_ESTIMATE)
+    return max(1, min(target_count, limit))
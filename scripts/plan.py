@@ -0,0 +1,219 @@
+from __future__ import annotations
+
+import re
+
+from pathlib import Path
+from typing import NamedTuple
+
+from scripts import backends
+from scripts import cache
+from scripts import process
+from scripts import scheduler
+from scripts import toolchain
+from scripts import util
+
+# Only --explain asks the backends what they would do
+cxx = backends.load("cxx")
+swig = backends.load("swig")
+vcpkg = backends.load("vcpkg")
+
+# What Ninja prints for every translation unit it would compile (I.E. "[3/10] Building CXX object os/CMakeFiles/os.dir/window.cpp.o")
+NINJA_COMPILE_PATTERN = re.compile(r"Building (?:C|CXX) object (\S+)")
+
+# Sources Ninja compiles into translation units, used to count them before the build tree is configured
+TRANSLATION_UNIT_EXTENSIONS = (".c", ".cc", ".cpp", ".cxx")
+
+# How many changed files or translation units are named before the rest are only counted
+MAX_LISTED = 8
+
+# How long a Ninja dry run may take
+NINJA_DRY_RUN_TIMEOUT = 60
+
+class StagePlan(NamedTuple):
+    """What a dry run predicts for a single stage"""
+    stage: scheduler.Stage
+    runs: bool
+    reasons: list[str]
+    estimate: float | None
+
+def list_names(paths: list[Path] | list[str], limit: int = MAX_LISTED) -> str:
+    """Lists file names for printing, counting the ones past the limit (I.E. "a.cpp, b.cpp and 3 more")"""
+    names = [isinstance(path, Path) and path.name or path for path in paths]
+    if len(names) <= limit:
+        return ", ".join(names)
+    return f"{', '.join(names[:limit])} and {len(names) - limit} more"
+
+def get_changed_inputs(stage: scheduler.Stage, stage_cache: cache.StageCache) -> list[Path]:
+    """Returns the stage's inputs that were modified since it last succeeded, or that are gone"""
+    recorded = stage_cache.get_time(stage.name)
+    if recorded is None:
+        return []
+    changed = []
+    for file in stage.inputs:
+        try:
+            if file.stat().st_mtime > recorded:
+                changed.append(file)
+        except OSError:
+            changed.append(file)
+    return changed
+
+def explain_stage(stage: scheduler.Stage,
+                  stage_cache: cache.StageCache,
+                  forced: dict[str, str],
+                  changed_stages: set[str]) -> list[str] | None:
+    """Works out why a stage would run, checking the stage cache the same way the scheduler does
+
+    Args:
+        stage: The stage to check
+        stage_cache: The stage cache the build would use
+        forced: Stages that run no matter what, mapped to why
+        changed_stages: Stages whose inputs changed since they last succeeded
+
+    Returns:
+        list[str]|None: Why the stage would run, or None if it would be skipped
+    """
+    if stage.name in forced:
+        return [forced[stage.name]]
+    if stage.fingerprint is None:
+        return ["it always runs"]
+
+    recorded = stage_cache.get_fingerprint(stage.name)
+    if recorded is None:
+        return ["it never completed"]
+    if recorded == stage.fingerprint:
+        if stage_cache.is_fresh(stage.name, stage.fingerprint, stage.outputs):
+            return None
+        return ["its output was changed or removed since it last ran"]
+
+    reasons = []
+    changed = get_changed_inputs(stage, stage_cache)
+    if changed:
+        reasons.append(f"{len(changed)} input(s) changed: {list_names(changed)}")
+    upstream = [dependency for dependency in stage.depends_on if dependency in changed_stages]
+    if upstream:
+        reasons.append(f"it depends on {', '.join(upstream)}, whose inputs changed")
+    return reasons or ["build settings or tool versions changed"]
+
+def explain_vcpkg(triplet: vcpkg.VTriplet) -> list[str]:
+    """Predicts whether vcpkg would install anything, from vcpkg's status database"""
+    if vcpkg.are_packages_installed(triplet):
+        return [f"vcpkg packages for {triplet.value} match vcpkg.json, vcpkg would skip installing them"]
+    return [f"vcpkg would install packages for {triplet.value} (vcpkg.json changed or packages are missing)"]
+
+def explain_swig(out_dir: Path) -> list[str]:
+    """Predicts which SWIG interfaces would be regenerated"""
+    interfaces = swig.get_interfaces()
+    stale, _ = swig.get_stale_interfaces(out_dir, interfaces, swig.load_state(out_dir))
+    if not stale:
+        return [f"all {len(interfaces)} SWIG interfaces are up to date"]
+    return [f"{len(stale)} of {len(interfaces)} SWIG interfaces would regenerate: {list_names([interface for interface, _ in stale])}"]
+
+def explain_configure(out_dir: Path) -> list[str]:
+    """Predicts whether CMake would configure from scratch"""
+    if not (out_dir / "CMakeCache.txt").exists():
+        return [f"{out_dir} isn't configured yet, CMake would configure it from scratch"]
+    return []
+
+def get_translation_units(out_dir: Path) -> list[str] | None:
+    """Asks Ninja which translation units are out of date, without compiling anything
+
+    Returns:
+        list[str]|None: The sources Ninja would compile, or None if Ninja can't tell
+    """
+    ninja = toolchain.get_toolchain().which("ninja")
+    if ninja is None or not (out_dir / "build.ninja").exists():
+        return None
+    result = process.run([ninja, "-C", str(out_dir), "-n"], capture_output=True, timeout=NINJA_DRY_RUN_TIMEOUT)
+    if result.returncode != 0:
+        return None
+    # Objects are named after their source (I.E. os/CMakeFiles/os.dir/window.cpp.o)
+    return [Path(obj).stem for obj in NINJA_COMPILE_PATTERN.findall(result.stdout)]
+
+def explain_native_build(out_dir: Path) -> list[str]:
+    """Predicts how many translation units Ninja would compile"""
+    units = get_translation_units(out_dir)
+    if units is None:
+        sources = [file for file in cxx.get_source_inputs() if file.suffix in TRANSLATION_UNIT_EXTENSIONS]
+        if not (out_dir / "build.ninja").exists():
+            return [f"the build tree isn't configured yet, all {len(sources)} translation units would compile"]
+        return [f"Ninja couldn't do a dry run, up to {len(sources)} translation units could compile"]
+    if not units:
+        return ["Ninja reports every translation unit is up to date (only linking or nothing would run)"]
+    return [f"{len(units)} translation unit(s) would compile: {list_names(units)}"]
+
+def create_plan(stages: list[scheduler.Stage],
+                stage_cache: cache.StageCache,
+                estimates: dict[str, float],
+                forced: dict[str, str] | None = None,
+                reuse_others: bool = False) -> list[StagePlan]:
+    """Predicts which stages a build would run and why, without running any of them
+
+    Args:
+        stages: The stages of the build
+        stage_cache: The stage cache the build would use
+        estimates: How many seconds each stage usually takes when it runs
+        forced: Stages that run no matter what (I.E. because of --clean), mapped to why
+        reuse_others: Whether stages that aren't forced reuse their last output instead of being checked (--from-stage)
+
+    Returns:
+        list[StagePlan]: Every stage in build order
+    """
+    forced = forced or {}
+    changed_stages = {stage.name for stage in stages
+                      if stage.fingerprint is not None and stage_cache.get_fingerprint(stage.name) not in (None, stage.fingerprint)}
+
+    plans = []
+    for stage in stages:
+        if reuse_others and stage.name not in forced:
+            plans.append(StagePlan(stage, False, [], estimates.get(stage.name)))
+            continue
+        reasons = explain_stage(stage, stage_cache, forced, changed_stages)
+        plans.append(StagePlan(stage, reasons is not None, reasons or [], estimates.get(stage.name)))
+    return plans
+
+def get_predicted_time(plans: list[StagePlan]) -> float | None:
+    """Predicts how long the build would take, following the longest chain of stages that run
+
+    Returns:
+        float|None: The seconds it would take, or None if a stage that runs has no timings yet
+    """
+    build = scheduler.Scheduler([plan.stage for plan in plans],
+                                estimates={plan.stage.name: plan.estimate for plan in plans if plan.estimate is not None})
+    for plan in plans:
+        if not plan.runs:
+            build.status[plan.stage.name] = "skipped"
+    return build.get_remaining_time()
+
+def print_plan(plans: list[StagePlan], explain: bool = False, restored: list[str] | None = None):
+    """Prints which stages would run, and why when explaining
+
+    Args:
+        plans: The plan from create_plan()
+        explain: Whether to print why every stage would run and what its tool would do
+        restored: Targets whose package would be restored from the package store instead of built
+    """
+    for target in restored or []:
+        print(f"{target} would be restored from the package store, none of its stages would run")
+
+    for plan in plans:
+        estimate = plan.estimate is not None and f"~{util.format_duration(plan.estimate)}" or "no timings yet"
+        print(f"  {plan.runs and 'run ' or 'skip'}  {plan.stage.name:<32} {plan.runs and estimate or ''}".rstrip())
+        if not explain or not plan.runs:
+            continue
+        for reason in plan.reasons:
+            print(f"          because {reason}")
+        if plan.stage.explain:
+            for detail in plan.stage.explain():
+                print(f"          {detail}")
+
+    running = [plan for plan in plans if plan.runs]
+    if not running:
+        print("Nothing would run, the build is up to date")
+        return
+
+    predicted = get_predicted_time(plans)
+    unknown = [plan.stage.name for plan in running if plan.estimate is None]
+    if predicted is None:
+        print(f"{len(running)} of {len(plans)} stages would run, there's no prediction until {list_names(unknown)} ran once")
+    else:
+        print(f"{len(running)} of {len(plans)} stages would run, predicted to take about {util.format_duration(predicted)}")
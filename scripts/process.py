@@ -0,0 +1,339 @@
+from __future__ import annotations
+
+import collections
+import os
+import shlex
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+from pathlib import Path
+from typing import IO, TYPE_CHECKING, Callable
+
+from scripts import profiler
+from scripts import util
+
+# asyncio takes longer to import than the rest of the build scripts together, it's only imported once a command runs
+if TYPE_CHECKING:
+    import asyncio
+
+LOG_FOLDER = util.BUILD_DIRECTORY / "logs"
+
+# How many of the last output lines are kept to show when a command fails
+TAIL_LINES = 50
+
+# Longest line read in one piece, longer lines are split instead of buffered whole
+MAX_LINE_LENGTH = 1024 * 1024
+
+# How long a cancelled command gets to exit after SIGTERM before it's killed
+TERMINATE_GRACE = 5
+
+# How long output is still read after a command exits, background servers it started
+# (I.E. MSBuild nodes) can hold its pipes open long after it's gone
+DRAIN_TIMEOUT = 5
+
+# Log file used by commands that run outside of a stage
+DEFAULT_LOG_NAME = "build"
+
+class ProcessResult(subprocess.CompletedProcess):
+    """The result of a command run through run()
+
+    Args:
+        args: The command that ran
+        returncode: Its exit code, negative if it was killed by a signal
+        stdout: Everything it printed to stdout when captured, otherwise None
+        stderr: Everything it printed to stderr when captured, otherwise None
+        tail: Its last lines of output (stdout and stderr interleaved), captured or not
+        log_file: The log its output was written to
+        timed_out: Whether it was killed for running past its timeout
+        cancelled: Whether it was killed by cancel()
+    """
+
+    def __init__(self,
+                 args: list[str],
+                 returncode: int,
+                 stdout: str | None = None,
+                 stderr: str | None = None,
+                 tail: str = "",
+                 log_file: Path | None = None,
+                 timed_out: bool = False,
+                 cancelled: bool = False):
+        super().__init__(args, returncode, stdout, stderr)
+        self.tail = tail
+        self.log_file = log_file
+        self.timed_out = timed_out
+        self.cancelled = cancelled
+
+    def describe_failure(self) -> str:
+        """Explains why the command failed, followed by its last lines of output"""
+        if self.cancelled:
+            reason = "was cancelled"
+        elif self.timed_out:
+            reason = "timed out"
+        else:
+            reason = f"exited with code {self.returncode}"
+
+        lines = [f"{Path(self.args[0]).name} {reason}"]
+        if self.tail:
+            lines.append(self.tail)
+        if self.log_file:
+            lines.append(f"Full output in {self.log_file}")
+        return "\n".join(lines)
+
+class _Logs:
+    """Per-stage log files, each one is started over the first time it's written to"""
+
+    def __init__(self, folder: Path):
+        self.folder = folder
+        self._files: dict[str, IO[str]] = {}
+        self._lock = threading.Lock()
+
+    def get_path(self, name: str) -> Path:
+        return self.folder / f"{name}.log"
+
+    def write(self, name: str, text: str):
+        with self._lock:
+            log = self._files.get(name)
+            if log is None:
+                self.folder.mkdir(parents=True, exist_ok=True)
+                log = self._files[name] = open(self.get_path(name), "w", encoding="utf-8", errors="replace")
+            log.write(text)
+
+    def flush(self):
+        with self._lock:
+            for log in self._files.values():
+                log.flush()
+
+    def close(self):
+        with self._lock:
+            for log in self._files.values():
+                log.close()
+            self._files.clear()
+
+class _Running:
+    """A command that is running, tracked so it can be cancelled from any thread"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, pid: int, stage: str | None):
+        self.loop = loop
+        self.pid = pid
+        self.stage = stage
+        self.cancelled = False
+        self.exited = False
+
+_logs = _Logs(LOG_FOLDER)
+_console_lock = threading.Lock()
+_running: set[_Running] = set()
+_running_lock = threading.Lock()
+
+def run(command: list[str],
+        cwd: Path | None = None,
+        env: dict[str, str] | None = None,
+        capture_output: bool = False,
+        stage: str | None = None,
+        timeout: float | None = None,
+        drain_timeout: float = DRAIN_TIMEOUT) -> ProcessResult:
+    """Runs a command, streaming its output line by line as it runs
+
+    Note:
+        Output is written to out/logs/<stage>.log and, unless captured, printed with a
+        [stage] prefix. Uncaptured output only keeps its last TAIL_LINES lines in memory,
+        so very chatty commands (I.E. vcpkg) don't grow the build's memory
+
+    Args:
+        command: The command and its arguments
+        cwd: The working directory to run it in
+        env: The environment to run it with, defaults to ours
+        capture_output: Whether to collect stdout/stderr as text instead of printing them
+        stage: The stage it belongs to, defaults to the stage running on this thread
+        timeout: Seconds after which the command is killed, or None to wait forever
+        drain_timeout: Seconds output is still read after the command exits, lower it for commands
+            known to leave servers holding their pipes (I.E. dotnet build with node reuse)
+
+    Returns:
+        ProcessResult: The exit code and last lines of output, plus all of it when captured
+    """
+    import asyncio
+
+    stage = stage or profiler.get_current_stage()
+    return asyncio.run(_run(command, cwd, env, capture_output, stage, timeout, drain_timeout))
+
+def cancel(stage: str | None = None) -> int:
+    """Stops running commands, which then return with cancelled set
+
+    Note:
+        Safe to call from any thread. Commands get SIGTERM, and are killed if they
+        haven't exited TERMINATE_GRACE seconds later
+
+    Args:
+        stage: Only cancel the commands of this stage, or None to cancel every command
+
+    Returns:
+        int: How many commands were cancelled
+    """
+    with _running_lock:
+        targets = [running for running in _running if stage is None or running.stage == stage]
+
+    for running in targets:
+        running.cancelled = True
+        try:
+            running.loop.call_soon_threadsafe(_terminate, running)
+        except RuntimeError:
+            pass # Its loop already finished
+    return len(targets)
+
+def close_logs():
+    """Flushes and closes every log file, later output starts its log over"""
+    _logs.close()
+
+async def _run(command: list[str],
+               cwd: Path | None,
+               env: dict[str, str] | None,
+               capture_output: bool,
+               stage: str | None,
+               timeout: float | None,
+               drain_timeout: float) -> ProcessResult:
+    import asyncio
+
+    log_name = stage or DEFAULT_LOG_NAME
+    prefix = stage and f"[{stage}] " or ""
+    tail: collections.deque[str] = collections.deque(maxlen=TAIL_LINES)
+    captured: dict[str, list[str]] = {"stdout": [], "stderr": []}
+
+    def on_line(name: str, line: str):
+        tail.append(line)
+        _logs.write(log_name, f"{line}\n")
+        if capture_output:
+            captured[name].append(line)
+            return
+        with _console_lock:
+            sys.stdout.write(f"{prefix}{line}\n")
+            sys.stdout.flush()
+
+    _logs.write(log_name, f"$ {shlex.join(str(part) for part in command)}\n")
+    start = time.perf_counter()
+
+    process, streams = await _spawn(command, cwd, env)
+    running = _Running(asyncio.get_running_loop(), process.pid, stage)
+    with _running_lock:
+        _running.add(running)
+
+    readers = [asyncio.ensure_future(_read_lines(stream, name, on_line)) for name, stream in streams]
+    waiter = asyncio.ensure_future(_wait(process))
+
+    timed_out = False
+    try:
+        await asyncio.wait_for(asyncio.shield(waiter), timeout)
+    except asyncio.TimeoutError:
+        timed_out = True
+        on_line("stderr", f"{Path(command[0]).name} didn't finish within {timeout}s, killing it...")
+        _terminate(running)
+
+    returncode, cpu, peak_rss_kb = await waiter
+    running.exited = True
+    with _running_lock:
+        _running.discard(running)
+
+    _, pending = await asyncio.wait(readers, timeout=drain_timeout)
+    for reader in pending:
+        reader.cancel()
+
+    end = time.perf_counter()
+    _logs.write(log_name, f"[exit code {returncode} after {end-start:.2f}s]\n\n")
+    _logs.flush()
+
+    profile = profiler.get_active()
+    if profile:
+        profile.record_process(command, start, end, cpu, peak_rss_kb, returncode, stage)
+
+    return ProcessResult(
+        command,
+        returncode,
+        "".join(f"{line}\n" for line in captured["stdout"]) if capture_output else None,
+        "".join(f"{line}\n" for line in captured["stderr"]) if capture_output else None,
+        "\n".join(tail),
+        _logs.get_path(log_name),
+        timed_out,
+        running.cancelled)
+
+async def _spawn(command: list[str], cwd: Path | None, env: dict[str, str] | None):
+    """Starts a command with its output piped into the running loop
+
+    Note:
+        On POSIX the command gets its own process group, so cancelling it also stops the
+        compilers Ninja/MSBuild started, and it's reaped with wait4 to get its rusage
+
+    Returns:
+        The process, and (name, StreamReader) pairs for its stdout and stderr
+    """
+    import asyncio
+
+    if os.name != "posix":
+        process = await asyncio.create_subprocess_exec(
+            *command, cwd=cwd, env=env,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, limit=MAX_LINE_LENGTH)
+        return process, [("stdout", process.stdout), ("stderr", process.stderr)]
+
+    loop = asyncio.get_running_loop()
+    process = subprocess.Popen(command, cwd=cwd, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                               start_new_session=True)
+    streams = []
+    for name, pipe in (("stdout", process.stdout), ("stderr", process.stderr)):
+        reader = asyncio.StreamReader(limit=MAX_LINE_LENGTH)
+        await loop.connect_read_pipe(lambda reader=reader: asyncio.StreamReaderProtocol(reader), pipe)
+        streams.append((name, reader))
+    return process, streams
+
+async def _read_lines(stream: asyncio.StreamReader, name: str, on_line: Callable[[str, str], None]):
+    """Hands every line of a stream to on_line, splitting lines longer than MAX_LINE_LENGTH"""
+    import asyncio
+
+    while True:
+        try:
+            line = await stream.readuntil(b"\n")
+        except asyncio.IncompleteReadError as err:
+            line = err.partial # The stream ended, possibly without a final newline
+        except asyncio.LimitOverrunError as err:
+            line = await stream.readexactly(err.consumed)
+        if not line:
+            return
+        on_line(name, line.decode("utf-8", errors="replace").rstrip("\r\n"))
+
+async def _wait(process: subprocess.Popen | asyncio.subprocess.Process) -> tuple[int, float | None, int | None]:
+    """Waits for a process to exit
+
+    Returns:
+        tuple[int, float|None, int|None]: Its exit code, then CPU seconds and peak RSS in KiB of it and its children, or None where the OS can't tell
+    """
+    import asyncio
+
+    if not isinstance(process, subprocess.Popen):
+        return (await process.wait(), None, None)
+
+    _, status, usage = await asyncio.get_running_loop().run_in_executor(None, os.wait4, process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+
+    # macOS reports ru_maxrss in bytes, Linux in KiB
+    peak_rss_kb = usage.ru_maxrss // 1024 if sys.platform == "darwin" else usage.ru_maxrss
+    return (process.returncode, usage.ru_utime + usage.ru_stime, peak_rss_kb)
+
+def _terminate(running: _Running):
+    """Asks a command and everything it started to stop, then kills them if they don't (runs on the command's loop)"""
+    if running.exited:
+        return
+    _signal(running.pid, signal.SIGTERM)
+    running.loop.call_later(TERMINATE_GRACE, _kill, running)
+
+def _kill(running: _Running):
+    if not running.exited:
+        _signal(running.pid, getattr(signal, "SIGKILL", signal.SIGTERM))
+
+def _signal(pid: int, signum: int):
+    try:
+        if os.name == "posix":
+            os.killpg(pid, signum)
+        else:
+            os.kill(pid, signum)
+    except (ProcessLookupError, PermissionError):
+        pass
@@ -0,0 +1,280 @@
+import json
+import threading
+import time
+
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+from scripts import util
+
+PROFILE_FOLDER = util.BUILD_DIRECTORY / "profile"
+REPORT_FILE = PROFILE_FOLDER / "report.json"
+TRACE_FILE = PROFILE_FOLDER / "trace.json"
+
+# How many of the slowest translation units end up in the report
+SLOWEST_TARGET_COUNT = 20
+
+# Extensions of the object files Ninja writes for each translation unit
+OBJECT_EXTENSIONS = (".o", ".obj")
+
+_local = threading.local()
+
+def get_current_stage() -> str | None:
+    """Returns the name of the stage running on this thread, or None outside of a stage"""
+    return getattr(_local, "stage", None)
+
+class Profiler:
+    """Records wall time, CPU time and peak memory of every stage and subprocess in a build"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages: dict[str, dict] = {}
+        self.processes: list[dict] = []
+        self._lock = threading.Lock()
+
+    def _now(self) -> float:
+        return time.perf_counter() - self.start
+
+    def stage_started(self, stage: str):
+        with self._lock:
+            self.stages[stage] = {
+                "start": self._now(),
+                "end": None,
+                "wall": 0.0,
+                "cpu": 0.0,
+                "peak_rss_kb": 0,
+                "status": "running",
+                "_thread_cpu": time.thread_time(),
+            }
+
+    def stage_finished(self, stage: str, status: str):
+        with self._lock:
+            entry = self.stages[stage]
+            entry["end"] = self._now()
+            entry["wall"] = entry["end"] - entry["start"]
+            # Time spent in Python itself, subprocesses add theirs as they finish
+            entry["cpu"] += time.thread_time() - entry.pop("_thread_cpu")
+            entry["status"] = status
+
+    def record_process(self,
+                       command: list[str],
+                       start: float,
+                       end: float,
+                       cpu: float | None,
+                       peak_rss_kb: int | None,
+                       returncode: int,
+                       stage: str | None = None):
+        """Records a finished subprocess
+
+        Args:
+            command: The command that ran
+            start: When it started, from time.perf_counter()
+            end: When it finished, from time.perf_counter()
+            cpu: User + system CPU seconds used by it and its children, None if unknown
+            peak_rss_kb: Its peak resident memory in KiB, None if unknown
+            returncode: Its exit code
+            stage: The stage it belongs to, defaults to the stage running on this thread
+        """
+        stage = stage or get_current_stage()
+        process = {
+            "stage": stage,
+            "command": [str(part) for part in command],
+            "start": start - self.start,
+            "end": end - self.start,
+            "wall": end - start,
+            "cpu": cpu,
+            "peak_rss_kb": peak_rss_kb,
+            "returncode": returncode,
+        }
+
+        with self._lock:
+            self.processes.append(process)
+            entry = self.stages.get(stage) if stage else None
+            if entry is not None:
+                entry["cpu"] += cpu or 0.0
+                entry["peak_rss_kb"] = max(entry["peak_rss_kb"], peak_rss_kb or 0)
+
+    def report(self, ninja_logs: dict[str, Path] | None = None) -> dict:
+        """Builds the machine-readable profiling report
+
+        Args:
+            ninja_logs: The .ninja_log of every native build stage (I.E. linux-x64-Debug-cxx) to pull per-target timings from
+
+        Returns:
+            dict: Stages, subprocesses and the slowest native targets of this build
+        """
+        targets = []
+        for stage_name, ninja_log in (ninja_logs or {}).items():
+            targets.extend({**target, "stage": stage_name} for target in parse_ninja_log(ninja_log))
+        targets.sort(key=lambda target: target["wall"], reverse=True)
+        with self._lock:
+            return {
+                "version": 1,
+                "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "wall": self._now(),
+                "stages": {name: dict(entry) for name, entry in self.stages.items()},
+                "processes": list(self.processes),
+                "slowest_targets": targets[:SLOWEST_TARGET_COUNT],
+            }
+
+    def write(self, ninja_logs: dict[str, Path] | None = None, report_file: Path = REPORT_FILE, trace_file: Path = TRACE_FILE):
+        """Writes the JSON report and a Chrome trace-event file (open it in chrome://tracing or Perfetto)
+
+        Args:
+            ninja_logs: The .ninja_log of every native build stage, by the stage's name
+            report_file: Where to write the JSON report
+            trace_file: Where to write the trace
+        """
+        report = self.report(ninja_logs)
+        report_file.parent.mkdir(parents=True, exist_ok=True)
+        report_file.write_text(json.dumps(report, indent=4))
+
+        trace_file.parent.mkdir(parents=True, exist_ok=True)
+        trace_file.write_text(json.dumps({"traceEvents": to_trace_events(report, ninja_logs)}))
+
+        _print_summary(report)
+        print(f"Wrote build profile to {report_file} and trace to {trace_file}")
+
+_active: Profiler | None = None
+
+def enable() -> Profiler:
+    """Starts profiling this build"""
+    global _active
+    _active = Profiler()
+    return _active
+
+def get_active() -> Profiler | None:
+    """Returns the profiler of this build, or None if profiling is off"""
+    return _active
+
+@contextmanager
+def stage(name: str) -> Iterator[dict]:
+    """Marks the current thread as running a stage for the duration of the block
+
+    Note:
+        The yielded dict should have its "status" set before the block ends
+    """
+    previous = get_current_stage()
+    _local.stage = name
+    result = {"status": "failed"}
+
+    if _active:
+        _active.stage_started(name)
+    try:
+        yield result
+    finally:
+        if _active:
+            _active.stage_finished(name, result["status"])
+        _local.stage = previous
+
+def parse_ninja_log(ninja_log: Path) -> list[dict]:
+    """Reads the targets of the most recent build from Ninja's log
+
+    Note:
+        Ninja appends to its log in completion order, so the last build starts right
+        after the last point where an end time goes backwards
+
+    Args:
+        ninja_log: The path to .ninja_log
+
+    Returns:
+        list[dict]: Every target built by the last Ninja run, slowest first
+    """
+    if not ninja_log.exists():
+        return []
+
+    entries: list[dict] = []
+    last_end = -1
+    for line in ninja_log.read_text(errors="ignore").splitlines():
+        if line.startswith("#"):
+            continue
+        parts = line.split("\t")
+        if len(parts) < 4:
+            continue
+        try:
+            start_ms, end_ms = int(parts[0]), int(parts[1])
+        except ValueError:
+            continue
+
+        if end_ms < last_end:
+            entries.clear()
+        last_end = end_ms
+
+        output = parts[3]
+        entries.append({
+            "target": output,
+            "start": start_ms / 1000,
+            "end": end_ms / 1000,
+            "wall": (end_ms - start_ms) / 1000,
+            "translation_unit": output.endswith(OBJECT_EXTENSIONS),
+        })
+
+    # The same output can show up twice if it was restarted, keep the latest
+    latest = {entry["target"]: entry for entry in entries}
+    return sorted(latest.values(), key=lambda entry: entry["wall"], reverse=True)
+
+def to_trace_events(report: dict, ninja_logs: dict[str, Path] | None = None) -> list[dict]:
+    """Converts a report into Chrome trace events
+
+    Note:
+        Ninja only logs times relative to its own start, so its targets are placed
+        relative to the start of the stage that ran it
+
+    Args:
+        report: The report from Profiler.report()
+        ninja_logs: The .ninja_log of every native build stage, by the stage's name
+
+    Returns:
+        list[dict]: Complete ("X") events for stages, subprocesses and native targets
+    """
+    events: list[dict] = []
+    lanes = {name: index for index, name in enumerate(report["stages"], start=1)}
+
+    for name, entry in report["stages"].items():
+        if entry["end"] is None:
+            continue
+        events.append({
+            "name": name, "cat": "stage", "ph": "X", "pid": 1, "tid": lanes[name],
+            "ts": entry["start"] * 1e6, "dur": entry["wall"] * 1e6,
+            "args": {"cpu": entry["cpu"], "peak_rss_kb": entry["peak_rss_kb"], "status": entry["status"]},
+        })
+
+    for process in report["processes"]:
+        events.append({
+            "name": Path(process["command"][0]).name, "cat": "process", "ph": "X", "pid": 1,
+            "tid": lanes.get(process["stage"], 0),
+            "ts": process["start"] * 1e6, "dur": process["wall"] * 1e6,
+            "args": {"command": " ".join(process["command"]), "cpu": process["cpu"],
+                     "peak_rss_kb": process["peak_rss_kb"], "returncode": process["returncode"]},
+        })
+
+    # Every native build stage gets its own lane, its Ninja log's times count from when the stage started
+    for lane, (stage_name, ninja_log) in enumerate((ninja_logs or {}).items(), start=1):
+        stage_entry = report["stages"].get(stage_name)
+        if stage_entry is None:
+            continue
+        events.append({"name": "thread_name", "ph": "M", "pid": 2, "tid": lane, "args": {"name": stage_name}})
+        for entry in parse_ninja_log(ninja_log):
+            events.append({
+                "name": entry["target"], "cat": "ninja", "ph": "X", "pid": 2, "tid": lane,
+                "ts": (stage_entry["start"] + entry["start"]) * 1e6, "dur": entry["wall"] * 1e6,
+            })
+
+    events.append({"name": "process_name", "ph": "M", "pid": 1, "args": {"name": "Torsion build"}})
+    events.append({"name": "process_name", "ph": "M", "pid": 2, "args": {"name": "Ninja targets"}})
+    return events
+
+def _print_summary(report: dict):
+    """Prints the per-stage breakdown and the slowest translation units"""
+    width = max([16, *(len(name) + 1 for name in report["stages"])])
+    print("Build profile:")
+    print(f"  {'stage':<{width}}{'wall':>10}{'cpu':>10}{'peak rss':>12}  status")
+    for name, entry in report["stages"].items():
+        print(f"  {name:<{width}}{entry['wall']:>9.2f}s{entry['cpu']:>9.2f}s{entry['peak_rss_kb'] / 1024:>9.1f}MiB  {entry['status']}")
+
+    units = [target for target in report["slowest_targets"] if target["translation_unit"]]
+    if units:
+        print("Slowest translation units:")
+        for target in units[:10]:
+            print(f"  {target['wall']:8.2f}s  {target['target']}")
@@ -0,0 +1,360 @@
+import os
+import threading
+import time
+
+from pathlib import Path
+from typing import Callable, Iterable
+
+from scripts import cache
+from scripts import process
+from scripts import profiler
+from scripts import util
+
+# How often stages still running after a failure are told to cancel again, in case they started another command
+CANCEL_POLL_INTERVAL = 0.5
+
+class Stage:
+    """A unit of work in the build graph
+
+    Args:
+        name: The unique name of the stage
+        action: Runs the stage, returning True if it succeeded
+        depends_on: Names of stages that must succeed before this one starts
+        fingerprint: The fingerprint of the stage's inputs, or None if it should always run
+        outputs: The files/folders the stage produces
+        description: What gets printed when the stage starts
+        resource: A resource the stage holds while it runs (I.E. "native"), the scheduler limits how
+            many stages holding the same resource run at once
+        inputs: The files the fingerprint covers, used to explain why the stage is out of date
+        explain: Describes what the stage's tool would do without running it (I.E. which files
+            Ninja would compile), for dry runs
+    """
+
+    def __init__(self,
+                 name: str,
+                 action: Callable[[], bool],
+                 depends_on: Iterable[str] = (),
+                 fingerprint: str | None = None,
+                 outputs: Iterable[Path] = (),
+                 description: str | None = None,
+                 resource: str | None = None,
+                 inputs: Iterable[Path] = (),
+                 explain: Callable[[], list[str]] | None = None):
+        self.name = name
+        self.action = action
+        self.depends_on = list(depends_on)
+        self.fingerprint = fingerprint
+        self.outputs = list(outputs)
+        self.description = description or f"Running stage {name}..."
+        self.resource = resource
+        self.inputs = list(inputs)
+        self.explain = explain
+
+class Scheduler:
+    """Runs a graph of stages, starting every stage as soon as the stages it depends on succeed
+
+    Note:
+        Once a stage fails no new stages are started, and the commands of stages that are
+        already running are cancelled
+
+    Args:
+        stages: The stages to run
+        stage_cache: Used to skip stages whose inputs and outputs haven't changed
+        max_workers: How many stages can run at once, defaults to all of them
+        from_stage: Run this stage and every stage after it even if they're up to date, and reuse
+            the last output of every other stage, or None to only run stages that are out of date
+        resource_limits: How many stages holding each resource may run at once, resources not listed are unlimited
+        estimates: How many seconds each stage is expected to take (I.E. from the build history), used to
+            print how long the build has left whenever a stage finishes
+    """
+
+    def __init__(self,
+                 stages: list[Stage],
+                 stage_cache: cache.StageCache | None = None,
+                 max_workers: int | None = None,
+                 from_stage: str | None = None,
+                 resource_limits: dict[str, int] | None = None,
+                 estimates: dict[str, float] | None = None):
+        self.stages = {stage.name: stage for stage in stages}
+        self.stage_cache = stage_cache
+        self.max_workers = max_workers or max(1, len(stages))
+        self.status: dict[str, str] = {name: "pending" for name in self.stages}
+        self.failed_stage: str | None = None
+        self.from_stage = from_stage
+        self.resource_limits = resource_limits or {}
+        self.estimates = estimates or {}
+        self.durations: dict[str, float] = {}
+        self._started: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+        for stage in stages:
+            for dependency in stage.depends_on:
+                if dependency not in self.stages:
+                    raise ValueError(f"Stage {stage.name} depends on unknown stage {dependency}")
+        self._check_for_cycles()
+
+        if from_stage is not None and from_stage not in self.stages:
+            raise ValueError(f"Can't start from unknown stage {from_stage}, expected one of {', '.join(self.stages)}")
+        self.forced = from_stage is not None and {from_stage, *self.get_dependents(from_stage)} or set()
+
+    def get_dependents(self, name: str) -> set[str]:
+        """Returns every stage that directly or indirectly depends on a stage"""
+        dependents: set[str] = set()
+        pending = [name]
+        while pending:
+            current = pending.pop()
+            for stage in self.stages.values():
+                if current in stage.depends_on and stage.name not in dependents:
+                    dependents.add(stage.name)
+                    pending.append(stage.name)
+        return dependents
+
+    def _check_for_cycles(self):
+        """Raises ValueError if the stages can't be ordered"""
+        visited: set[str] = set()
+        visiting: set[str] = set()
+
+        def visit(name: str):
+            if name in visited:
+                return
+            if name in visiting:
+                raise ValueError(f"Stage {name} depends on itself")
+            visiting.add(name)
+            for dependency in self.stages[name].depends_on:
+                visit(dependency)
+            visiting.remove(name)
+            visited.add(name)
+
+        for name in self.stages:
+            visit(name)
+
+    def _run_stage(self, stage: Stage) -> bool:
+        """Runs a single stage, tracking it in the build profile"""
+        start = time.time()
+        with self._lock:
+            self._started[stage.name] = start
+        with profiler.stage(stage.name) as result:
+            succeeded = self._run_stage_uncached(stage)
+            result["status"] = self.status[stage.name]
+        with self._lock:
+            self.durations[stage.name] = time.time() - start
+        return succeeded
+
+    def _run_stage_uncached(self, stage: Stage) -> bool:
+        """Runs a single stage unless the stage cache says it's up to date"""
+        if self.from_stage is not None and stage.name not in self.forced:
+            return self._reuse_stage(stage)
+
+        if self.stage_cache and stage.fingerprint is not None and stage.name not in self.forced:
+            if self.stage_cache.is_fresh(stage.name, stage.fingerprint, stage.outputs):
+                print(f"Stage {stage.name} is up to date, skipping...")
+                # Record it again so later stages writing into shared outputs don't make it look stale
+                self.stage_cache.record(stage.name, stage.fingerprint, stage.outputs)
+                with self._lock:
+                    self.status[stage.name] = "skipped"
+                return True
+
+        # Forget the stage until it succeeds again, so a build killed halfway through it can't reuse its output
+        if self.stage_cache:
+            self.stage_cache.invalidate(stage.name)
+            self.stage_cache.checkpoint()
+
+        print(stage.description)
+        start = time.time()
+        succeeded = stage.action()
+
+        with self._lock:
+            if succeeded:
+                self.status[stage.name] = "succeeded"
+            elif self.failed_stage is not None and self.failed_stage != stage.name:
+                self.status[stage.name] = "cancelled"
+            else:
+                self.status[stage.name] = "failed"
+        if succeeded and self.stage_cache:
+            if stage.fingerprint is not None:
+                self.stage_cache.record(stage.name, stage.fingerprint, stage.outputs)
+            # Stages that always run may still add to the outputs of recorded ones (I.E. an install moving them)
+            self.stage_cache.checkpoint()
+
+        print(f"Stage {stage.name} {self.status[stage.name]} in {time.time()-start:.2f}s")
+        return succeeded
+
+    def _reuse_stage(self, stage: Stage) -> bool:
+        """Skips a stage that comes before the stage the build starts from, if it ever completed"""
+        reusable = self.stage_cache is not None and self.stage_cache.has_completed(stage.name)
+        with self._lock:
+            self.status[stage.name] = reusable and "skipped" or "failed"
+
+        if reusable:
+            print(f"Stage {stage.name} isn't part of the build from {self.from_stage}, reusing its last output...")
+        else:
+            print(f"Stage {stage.name} never completed, can't start the build from {self.from_stage} without it")
+        return reusable
+
+    def _ready_stages(self) -> list[Stage]:
+        """Returns pending stages whose dependencies all finished successfully"""
+        done = {"succeeded", "skipped"}
+        return [
+            stage for name, stage in self.stages.items()
+            if self.status[name] == "pending" and all(self.status[dep] in done for dep in stage.depends_on)
+        ]
+
+    def get_remaining_time(self) -> float | None:
+        """Estimates how long the stages that haven't finished yet will take
+
+        Note:
+            Follows the longest chain of unfinished stages, assuming stages run as soon as what
+            they depend on finished. Resource limits can make the build take longer than that
+
+        Returns:
+            float|None: The seconds left, or None if a stage that's left has no estimate
+        """
+        now = time.time()
+        finishes: dict[str, float] = {}
+
+        def finish(name: str) -> float | None:
+            """Returns how many seconds from now a stage should finish"""
+            if name in finishes:
+                return finishes[name]
+            status = self.status[name]
+            if status not in ("pending", "running"):
+                finishes[name] = 0.0
+                return 0.0
+            estimate = self.estimates.get(name)
+            if estimate is None:
+                return None
+
+            if status == "running":
+                remaining = max(0.0, estimate - (now - self._started.get(name, now)))
+            else:
+                dependencies = [finish(dependency) for dependency in self.stages[name].depends_on]
+                if None in dependencies:
+                    return None
+                remaining = max(dependencies, default=0.0) + estimate
+            finishes[name] = remaining
+            return remaining
+
+        remaining = [finish(name) for name in self.stages]
+        return None if None in remaining else max(remaining, default=0.0)
+
+    def _print_progress(self):
+        done = sum(1 for status in self.status.values() if status not in ("pending", "running"))
+        if done == len(self.stages):
+            return
+        eta = ""
+        if self.estimates:
+            remaining = self.get_remaining_time()
+            if remaining is not None:
+                eta = f", about {util.format_duration(remaining)} left"
+        print(f"[{done}/{len(self.stages)} stages done{eta}]")
+
+    def _has_free_slot(self, stage: Stage) -> bool:
+        """Checks if a stage can start without going over its resource's limit"""
+        limit = self.resource_limits.get(stage.resource)
+        if limit is None:
+            return True
+        holding = sum(1 for name, other in self.stages.items()
+                      if other.resource == stage.resource and self.status[name] == "running")
+        return holding < limit
+
+    def run(self) -> bool:
+        """Runs every stage in dependency order
+
+        Returns:
+            bool: True if every stage succeeded or was skipped, or False if any stage failed
+        """
+        # Imported here, concurrent.futures pulls in logging and only building needs it (not --help, --stats or --dry-run)
+        from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+
+        running: dict[Future, Stage] = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while True:
+                if self.failed_stage is None:
+                    for stage in self._ready_stages():
+                        if not self._has_free_slot(stage):
+                            continue
+                        self.status[stage.name] = "running"
+                        running[pool.submit(self._run_stage, stage)] = stage
+
+                if not running:
+                    break
+
+                try:
+                    timeout = self.failed_stage is not None and CANCEL_POLL_INTERVAL or None
+                    finished, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+                except KeyboardInterrupt:
+                    # Commands run in their own process groups, so they don't see Ctrl+C themselves
+                    process.cancel()
+                    raise
+                finished_stages = []
+                for future in finished:
+                    stage = running.pop(future)
+                    finished_stages.append(stage)
+                    try:
+                        succeeded = future.result()
+                    except Exception as err:
+                        print(f"Stage {stage.name} raised an error: {err}")
+                        with self._lock:
+                            self.status[stage.name] = "failed"
+                        succeeded = False
+
+                    if not succeeded and self.failed_stage is None:
+                        self.failed_stage = stage.name
+
+                # Stages skipped by the stage cache finish instantly, progress only moves when work was done
+                if self.failed_stage is None and any(self.status[stage.name] == "succeeded" for stage in finished_stages):
+                    self._print_progress()
+
+                # Fail fast, stages running alongside a failed stage would only waste time
+                if self.failed_stage is not None:
+                    for stage in running.values():
+                        process.cancel(stage.name)
+
+        return self.failed_stage is None and all(
+            status in ("succeeded", "skipped") for status in self.status.values())
+
+def get_required_stages(stages: list[Stage], names: Iterable[str]) -> list[Stage]:
+    """Narrows a build graph down to some stages and everything they depend on
+
+    Args:
+        stages: Every stage of the build
+        names: The stages that have to run
+
+    Returns:
+        list[Stage]: The named stages and their direct and indirect dependencies, in their original order
+    """
+    by_name = {stage.name: stage for stage in stages}
+    required: set[str] = set()
+    pending = list(names)
+    while pending:
+        name = pending.pop()
+        if name in required or name not in by_name:
+            continue
+        required.add(name)
+        pending.extend(by_name[name].depends_on)
+    return [stage for stage in stages if stage.name in required]
+
+def split_cpu_budget(weights: dict[str, int], total: int | None = None) -> dict[str, int]:
+    """Splits the available cores between tools that run at the same time
+
+    Args:
+        weights: How large a share each tool should get relative to the others
+        total: The number of cores to split, defaults to the CPU count
+
+    Returns:
+        dict[str, int]: The number of jobs each tool may run, at least 1 each
+    """
+    total = total or os.cpu_count() or 1
+    weight_sum = sum(weights.values()) or 1
+
+    shares = {name: max(1, total * weight // weight_sum) for name, weight in weights.items()}
+
+    # Hand cores lost to rounding down to the heaviest tools
+    leftover = total - sum(shares.values())
+    for name in sorted(weights, key=weights.get, reverse=True):
+        if leftover <= 0:
+            break
+        shares[name] += 1
+        leftover -= 1
+    return shares
@@ -0,0 +1,253 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import stat
+import time
+
+from pathlib import Path
+
+from scripts import install as installer
+from scripts import util
+
+STORE_FOLDER = util.CACHE_DIRECTORY / "store"
+
+# Written into packages restored from the store, their files are links to the store's blobs
+RESTORED_MARKER = ".torsion-store"
+
+# Limits garbage collection keeps the store within after every build
+DEFAULT_MAX_SIZE = "10G"
+DEFAULT_MAX_AGE_DAYS = 30
+
+# How many bytes are hashed at a time
+HASH_CHUNK_SIZE = 1024 * 1024
+
+class PackageStore:
+    """A content-addressed store of whole packages, keyed by the fingerprint of everything that built them
+
+    Note:
+        Every file is kept once as a read-only blob named after its SHA-256, and an index entry per
+        package lists which blob goes where. Restoring hard-links the blobs into place, so it costs
+        a few syscalls per file no matter how large the package is
+
+    Args:
+        folder: The root of the store
+    """
+
+    def __init__(self, folder: Path = STORE_FOLDER):
+        self.folder = folder
+        self.blob_folder = folder / "blobs"
+        self.index_folder = folder / "index"
+
+    def _get_blob(self, digest: str) -> Path:
+        return self.blob_folder / digest[:2] / digest
+
+    def _get_entry(self, key: str) -> Path:
+        return self.index_folder / f"{key}.json"
+
+    def has(self, key: str) -> bool:
+        return self._get_entry(key).exists()
+
+    def save(self, key: str, package_dir: Path) -> bool:
+        """Stores a package under a key
+
+        Note:
+            Files are copied (or reflinked) into the store rather than hard-linked, later builds
+            overwrite their package in place and would otherwise change the stored blobs
+
+        Returns:
+            bool: True if the package was stored, or False if it doesn't exist
+        """
+        if not package_dir.exists():
+            print(f"Can't store package {package_dir}, it doesn't exist")
+            return False
+
+        files = []
+        for file in sorted(util.collect_files(package_dir)):
+            if file.name == RESTORED_MARKER:
+                continue
+            digest = hash_file(file)
+            blob = self._get_blob(digest)
+            if not blob.exists():
+                self._add_blob(file, blob)
+            files.append({"path": file.relative_to(package_dir).as_posix(), "hash": digest})
+
+        entry = self._get_entry(key)
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        temp = entry.with_name(f".{entry.name}.tmp")
+        temp.write_text(json.dumps({"version": 1, "created": time.time(), "files": files}, indent=4))
+        os.replace(temp, entry)
+        print(f"Stored package {package_dir} ({len(files)} files) in {self.folder}")
+        return True
+
+    def _add_blob(self, file: Path, blob: Path):
+        """Copies a file into the store as a read-only blob"""
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        temp = blob.with_name(f".{blob.name}.tmp")
+        temp.unlink(missing_ok=True)
+        try:
+            installer.clone_file(file, temp)
+        except OSError:
+            temp.unlink(missing_ok=True)
+            shutil.copy2(file, temp)
+
+        # Blobs are shared by every package linking them, read-only keeps them from being edited in place
+        mode = stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH
+        if os.stat(file).st_mode & stat.S_IXUSR:
+            mode |= stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH
+        os.chmod(temp, mode)
+        os.replace(temp, blob)
+
+    def restore(self, key: str, package_dir: Path) -> bool:
+        """Materializes a stored package, replacing whatever is in package_dir
+
+        Note:
+            Files are hard-linked from the store when it's on the same device, otherwise copied.
+            The package is marked as restored, detach() has to run before anything builds into it
+
+        Returns:
+            bool: True if the package was restored, or False if the store doesn't have it
+        """
+        entry = self._get_entry(key)
+        try:
+            files = json.loads(entry.read_text())["files"]
+        except (OSError, ValueError, KeyError):
+            return False
+        if not all(self._get_blob(file["hash"]).exists() for file in files):
+            print(f"Stored package {key[:12]} is missing blobs, building it instead")
+            entry.unlink(missing_ok=True)
+            return False
+
+        if package_dir.exists():
+            shutil.rmtree(package_dir)
+
+        linked = True
+        for file in files:
+            blob = self._get_blob(file["hash"])
+            dest = package_dir / file["path"]
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            if linked:
+                try:
+                    os.link(blob, dest)
+                    continue
+                except OSError:
+                    linked = False # Most likely a different device, copy everything else
+            shutil.copy2(blob, dest)
+
+        (package_dir / RESTORED_MARKER).write_text(key)
+        # Restoring counts as using the package, garbage collection removes the least recently used first
+        os.utime(entry)
+        print(f"Restored package {package_dir} ({len(files)} files {linked and 'hard-linked' or 'copied'}) from {self.folder}")
+        return True
+
+    def collect_garbage(self, max_size: int, max_age: float) -> int:
+        """Removes packages unused for longer than max_age and then the least recently used ones until the store fits in max_size
+
+        Args:
+            max_size: The size in bytes the store's blobs must fit into
+            max_age: How many seconds a package may go unused
+
+        Returns:
+            int: The number of bytes removed
+        """
+        if not self.index_folder.exists():
+            return 0
+
+        entries = []
+        for entry in self.index_folder.glob("*.json"):
+            try:
+                used = entry.stat().st_mtime
+                digests = {file["hash"] for file in json.loads(entry.read_text())["files"]}
+            except (OSError, ValueError, KeyError):
+                entry.unlink(missing_ok=True)
+                continue
+            entries.append((used, entry, digests))
+        entries.sort(key=lambda item: item[0], reverse=True)
+
+        # Keep the most recently used packages that are young enough and fit into the budget
+        now = time.time()
+        kept: set[str] = set()
+        kept_size = 0
+        for used, entry, digests in entries:
+            new_size = sum(self._get_size(digest) for digest in digests - kept)
+            if now - used > max_age or kept_size + new_size > max_size:
+                entry.unlink(missing_ok=True)
+                continue
+            kept |= digests
+            kept_size += new_size
+
+        removed = 0
+        for blob in self.blob_folder.rglob("*") if self.blob_folder.exists() else []:
+            if blob.is_file() and blob.name not in kept:
+                removed += blob.stat().st_size
+                blob.unlink()
+
+        if removed:
+            print(f"Removed {util.format_size(removed)} from package store {self.folder}, {util.format_size(kept_size)} left")
+        return removed
+
+    def _get_size(self, digest: str) -> int:
+        try:
+            return self._get_blob(digest).stat().st_size
+        except OSError:
+            return 0
+
+def hash_file(file: Path) -> str:
+    """Returns the SHA-256 of a file's contents"""
+    digest = hashlib.sha256()
+    with open(file, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def get_restored_key(package_dir: Path) -> str | None:
+    """Returns the key a package was restored from, or None if it was built"""
+    try:
+        return (package_dir / RESTORED_MARKER).read_text().strip()
+    except OSError:
+        return None
+
+def detach(package_dir: Path):
+    """Removes a package restored from the store before a build installs into it
+
+    Note:
+        Installs can overwrite files in place, which would change the blobs a restored package links to
+    """
+    if get_restored_key(package_dir) is not None:
+        print(f"Package {package_dir} was restored from the store, removing it before building into it")
+        shutil.rmtree(package_dir)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="TorsionEngine package store maintenance")
+    parser.add_argument(
+        "--store",
+        type=Path,
+        default=STORE_FOLDER,
+        help="The package store passed to scripts.compile --package-store")
+    parser.add_argument(
+        "--max-size",
+        default=DEFAULT_MAX_SIZE,
+        help="Remove the least recently used packages until the store fits in this size (I.E. 10G)")
+    parser.add_argument(
+        "--max-age",
+        type=float,
+        default=DEFAULT_MAX_AGE_DAYS,
+        help="Remove packages that haven't been used for this many days")
+    return parser.parse_args()
+
+def prune():
+    args = parse_args() # Parse arguments from cli
+
+    try:
+        max_size = util.parse_size(args.max_size)
+    except ValueError:
+        print(f"Invalid size {args.max_size}, expected something like 512M or 10G")
+        return
+
+    removed = PackageStore(args.store).collect_garbage(max_size, args.max_age * 24 * 60 * 60)
+    if not removed:
+        print(f"Nothing to remove from package store {args.store}")
+
+if __name__ == "__main__":
+    prune()
@@ -0,0 +1,134 @@
+import functools
+import json
+import os
+import shutil
+import threading
+
+from pathlib import Path
+
+from scripts import process
+from scripts import util
+
+TOOLCHAIN_CACHE_FILE = util.CACHE_DIRECTORY / "toolchain.json"
+
+# Arguments that make each tool print its version
+TOOL_VERSION_ARGS = {
+    "swig": ["-version"],
+    "vcpkg": ["version"],
+    "cmake": ["--version"],
+    "ninja": ["--version"],
+    "dotnet": ["--version"],
+}
+
+class Toolchain:
+    """Discovers build tools once and shares the results with every build module
+
+    Note:
+        Tool versions are persisted to disk keyed by PATH and each tool's size/modification
+        time, so later builds only probe tools that were updated
+
+    Args:
+        cache_file: Where discovered versions are persisted, or None to keep them in memory only
+    """
+
+    def __init__(self, cache_file: Path | None = TOOLCHAIN_CACHE_FILE):
+        self.cache_file = cache_file
+        self._paths: dict[str, str | None] = {}
+        self._versions: dict[str, dict] = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+
+        if cache_file and cache_file.exists():
+            try:
+                data = json.loads(cache_file.read_text())
+            except (OSError, ValueError):
+                data = {}
+            # Tools may resolve to different executables under another PATH
+            if data.get("path") == os.environ.get("PATH", ""):
+                self._versions = data.get("tools", {})
+
+    def which(self, tool: str) -> str | None:
+        """Finds a tool in PATH, only searching once per tool
+
+        Args:
+            tool: The name of the executable
+
+        Returns:
+            str|None: The path to the executable, or None if it isn't in PATH
+        """
+        with self._lock:
+            if tool not in self._paths:
+                self._paths[tool] = shutil.which(tool)
+            return self._paths[tool]
+
+    def version(self, tool: str) -> str:
+        """Queries a tool for its version, reusing the persisted answer if the executable hasn't changed
+
+        Args:
+            tool: The name of the executable
+
+        Returns:
+            str: The executable's path and the first line of its version output, or "missing" if it isn't installed
+        """
+        executable = self.which(tool)
+        if executable is None:
+            return "missing"
+
+        stat = os.stat(executable)
+        key = f"{executable}:{stat.st_size}:{stat.st_mtime_ns}"
+
+        with self._lock:
+            entry = self._versions.get(tool)
+            if entry and entry.get("key") == key:
+                return entry["version"]
+
+        version = f"{executable}:{_probe_version(executable, tool)}"
+        with self._lock:
+            self._versions[tool] = {"key": key, "version": version}
+            self._dirty = True
+        return version
+
+    def find_compilers(self, pairs: list[tuple[str, str]]) -> tuple[str, str] | None:
+        """Returns the first C/C++ compiler pair that is fully installed
+
+        Args:
+            pairs: (C compiler, C++ compiler) executable names to try in order
+
+        Returns:
+            tuple[str, str]|None: The names of the found compilers, or None if no pair is installed
+        """
+        for c_compiler, cxx_compiler in pairs:
+            if self.which(c_compiler) and self.which(cxx_compiler):
+                return (c_compiler, cxx_compiler)
+        return None
+
+    def save(self):
+        """Persists probed versions so the next build can skip probing"""
+        if not self.cache_file or not self._dirty:
+            return
+        with self._lock:
+            self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+            self.cache_file.write_text(json.dumps({
+                "path": os.environ.get("PATH", ""),
+                "tools": self._versions,
+            }, indent=4))
+            self._dirty = False
+
+def _probe_version(executable: str, tool: str) -> str:
+    """Runs a tool to get the first non-empty line of its version output"""
+    try:
+        result = process.run([executable, *TOOL_VERSION_ARGS.get(tool, ["--version"])], capture_output=True, timeout=30)
+    except OSError:
+        return "unknown"
+    if result.timed_out:
+        return "unknown"
+
+    for line in result.stdout.splitlines():
+        if line.strip():
+            return line.strip()
+    return "unknown"
+
+@functools.cache
+def get_toolchain() -> Toolchain:
+    """Returns the toolchain shared by this build invocation"""
+    return Toolchain()
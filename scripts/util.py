@@ -1,12 +1,20 @@
+import functools
+import hashlib
+import os
 import platform
+import shutil
 
 from enum import Enum
 from pathlib import Path
+from typing import Iterable
 
 PROJECT_ROOT = Path(__file__).parent.parent
 BUILD_DIRECTORY = PROJECT_ROOT / "out"
 PACKAGE_DIRECTORY = BUILD_DIRECTORY / "torsion"
 
+# Caches that survive clean builds
+CACHE_DIRECTORY = BUILD_DIRECTORY / "cache"
+
 # Language-specific folders
 
 # C++
@@ -22,6 +30,9 @@ CSTEMP_OUT_DIR = CSSOURCE_FOLDER / "out"
 SWIG_BINDINGS_FOLDER = PROJECT_ROOT / "engine" / "bindings"
 SWIG_OUT_FOLDER = PROJECT_ROOT / "swig-gen"
 
+# CMake
+CMAKE_MODULES_FOLDER = PROJECT_ROOT / "cmake"
+
 # Enums
 
 class Platform(Enum):
@@ -34,6 +45,8 @@ class Platform(Enum):
 class BuildConfig(Enum):
     DEBUG = "Debug"
     RELEASE = "Release"
+    PROFILE = "Profile" # Optimized with debug symbols and link time optimization
+    SHIPPING = "Shipping" # Fully optimized with link time optimization, for distribution
 
 class Architecture(Enum):
     X64 = "x64"
@@ -68,6 +81,7 @@ def platform_to_vcpkg_platform(platform: Platform) -> str:
         case _:
             return platform.value
 
+@functools.cache
 def get_host_platform() -> tuple[Platform, Architecture]:
     """Get the current host platform and architecture
 
@@ -109,4 +123,122 @@ def get_host_platform() -> tuple[Platform, Architecture]:
         # Default case for unknown systems
         case _:
             print(f"Warning: Unknown platform {system}-{machine}, defaulting to Linux x64")
-            return (Platform.LINUX, Architecture.X64)
\ No newline at end of file
+            return (Platform.LINUX, Architecture.X64)
+
+def get_portable_path(path: Path) -> str:
+    """Names a path the same way in every checkout, relative to the project root if it's inside the project"""
+    return path.is_relative_to(PROJECT_ROOT) and path.relative_to(PROJECT_ROOT).as_posix() or str(path)
+
+def hash_inputs(files: Iterable[Path], extra: Iterable[str] = ()) -> str:
+    """Hashes the contents of files along with any extra strings into a single fingerprint
+
+    Note:
+        Missing files are hashed by name only, so adding or removing a file still changes the fingerprint.
+        Files inside the project are named relative to its root, so the same sources in another checkout
+        get the same fingerprint
+
+    Args:
+        files: The files whose contents make up the fingerprint
+        extra: Additional values (compiler names, triplets, flags...) to mix into the fingerprint
+
+    Returns:
+        str: A hex digest that only changes when an input changes
+    """
+    digest = hashlib.sha256()
+    for file in sorted(Path(f) for f in files):
+        digest.update(get_portable_path(file).encode())
+        if file.is_file():
+            digest.update(file.read_bytes())
+        digest.update(b"\0")
+    for value in extra:
+        digest.update(str(value).encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+def collect_files(folder: Path, excluded_folders: Iterable[str] = ()) -> list[Path]:
+    """Recursively collects files in a folder without descending into excluded folders
+
+    Args:
+        folder: The folder to walk
+        excluded_folders: Folder names that are skipped entirely (I.E. build output)
+
+    Returns:
+        list[Path]: Every file found, sorted
+    """
+    excluded = set(excluded_folders)
+    files: list[Path] = []
+    for root, dirs, names in os.walk(folder):
+        dirs[:] = [d for d in dirs if d not in excluded]
+        files.extend(Path(root) / name for name in names)
+    return sorted(files)
+
+def replace_if_changed(source: Path, dest: Path) -> bool:
+    """Moves a freshly generated file over its destination only if the contents differ
+
+    Note:
+        Leaving byte-identical files untouched keeps their modification time, so build
+        tools that depend on them (CMake, MSBuild) don't rebuild anything
+
+    Args:
+        source: The newly generated file, it is consumed either way
+        dest: Where the file should end up
+
+    Returns:
+        bool: True if the destination was written, or False if it was already identical
+    """
+    if dest.is_file() and dest.stat().st_size == source.stat().st_size:
+        if dest.read_bytes() == source.read_bytes():
+            source.unlink()
+            return False
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    shutil.move(str(source), str(dest))
+    return True
+
+SIZE_UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+def parse_size(size: str) -> int:
+    """Parses a human readable size like 512M or 20G
+
+    Args:
+        size: A number optionally followed by K, M, G or T (with or without a trailing B)
+
+    Returns:
+        int: The size in bytes
+
+    Raises:
+        ValueError: If the size can't be parsed
+    """
+    text = size.strip().upper().removesuffix("B")
+    unit = text[-1] if text and text[-1] in "KMGT" else ""
+    number = text[:-1] if unit else text
+    return int(float(number) * SIZE_UNITS[unit])
+
+def format_size(size: int) -> str:
+    """Formats a size in bytes for printing (I.E. 1.5GiB)"""
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if size < 1024:
+            return f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}TiB"
+
+def format_duration(seconds: float) -> str:
+    """Formats a duration for printing (I.E. 0.42s, 12.3s or 4m05s)"""
+    if seconds < 60:
+        return f"{seconds:.2f}s" if seconds < 10 else f"{seconds:.1f}s"
+    minutes, seconds = divmod(round(seconds), 60)
+    return f"{minutes}m{seconds:02d}s"
+
+def get_folder_size(folder: Path) -> int:
+    """Adds up the size of every file in a folder
+
+    Returns:
+        int: The total size in bytes, 0 if the folder doesn't exist
+    """
+    total = 0
+    for root, _, files in os.walk(folder):
+        for name in files:
+            try:
+                total += (Path(root) / name).stat().st_size
+            except OSError:
+                continue
+    return total
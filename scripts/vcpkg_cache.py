@@ -0,0 +1,33 @@
+from scripts.build import vcpkg
+
+import argparse
+
+from pathlib import Path
+
+from scripts import util
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="TorsionEngine vcpkg binary cache maintenance")
+    parser.add_argument(
+        "binary_cache",
+        type=Path,
+        help="The vcpkg binary cache folder passed to scripts.compile --vcpkg-binary-cache")
+    parser.add_argument(
+        "--max-size",
+        required=True,
+        help="Delete the least recently used packages until the cache fits in this size (I.E. 20G)")
+    return parser.parse_args()
+
+def prune():
+    args = parse_args() # Parse arguments from cli
+
+    try:
+        max_size = util.parse_size(args.max_size)
+    except ValueError:
+        print(f"Invalid size {args.max_size}, expected something like 512M or 20G")
+        return
+
+    vcpkg.prune_binary_cache(args.binary_cache, max_size)
+
+if __name__ == "__main__":
+    prune()
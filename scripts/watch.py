@@ -0,0 +1,252 @@
+import os
+import select
+import struct
+import sys
+import time
+
+from pathlib import Path
+from typing import Callable
+
+from scripts import util
+
+# Source folders whose changes trigger a rebuild
+WATCHED_FOLDERS = [util.CXXSOURCE_FOLDER, util.SWIG_BINDINGS_FOLDER, util.CSSOURCE_FOLDER]
+
+# Folders the build itself writes into, changes inside them are ignored
+IGNORED_FOLDERS = {"bin", "obj", "vcpkg_installed", util.CSTEMP_OUT_DIR.name, ".vs", ".git"}
+
+# How long the sources have to stay unchanged before a rebuild starts, editors often save in several steps
+DEBOUNCE = 0.3
+
+# How often the polling watcher looks for changes
+POLL_INTERVAL = 1.0
+
+# inotify event flags, from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+INOTIFY_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+INOTIFY_EVENT = struct.Struct("iIII") # wd, mask, cookie, name length
+
+def is_ignored(path: Path) -> bool:
+    """Checks if a path is build output or editor/VCS state rather than a source"""
+    return any(part in IGNORED_FOLDERS for part in path.parts)
+
+def _walk_folders(folder: Path) -> list[Path]:
+    """Lists a folder and every folder inside it, skipping ignored ones"""
+    folders = []
+    for root, dirs, _ in os.walk(folder):
+        dirs[:] = [name for name in dirs if name not in IGNORED_FOLDERS]
+        folders.append(Path(root))
+    return folders
+
+class InotifyWatcher:
+    """Watches folders for changes with Linux's inotify
+
+    Note:
+        inotify only watches single folders, so every folder inside the watched ones gets
+        its own watch, and folders created later are added as they show up
+
+    Args:
+        folders: The folders to watch, including everything inside them
+
+    Raises:
+        OSError: If inotify isn't available or a folder can't be watched
+    """
+
+    def __init__(self, folders: list[Path]):
+        # Only watch mode needs ctypes, importing it here keeps it out of every other build's startup
+        import ctypes.util
+
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f"inotify_init1 failed: {os.strerror(errno)}")
+
+        self.folders = folders
+        self._watches: dict[int, Path] = {}
+        for folder in folders:
+            self._add_tree(folder)
+
+    def _add_tree(self, folder: Path):
+        import ctypes
+
+        for current in _walk_folders(folder):
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(current), INOTIFY_MASK)
+            if wd < 0:
+                errno = ctypes.get_errno()
+                raise OSError(errno, f"Can't watch {current}: {os.strerror(errno)} "
+                                     "(raising fs.inotify.max_user_watches may help)")
+            self._watches[wd] = current
+
+    def read_changes(self, timeout: float | None) -> set[Path]:
+        """Waits for changes
+
+        Args:
+            timeout: How many seconds to wait, or None to wait until something changes
+
+        Returns:
+            set[Path]: The files and folders that changed, empty if nothing did in time
+        """
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return set()
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+
+        changes: set[Path] = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+            name = data[offset + INOTIFY_EVENT.size:offset + INOTIFY_EVENT.size + length].rstrip(b"\0")
+            offset += INOTIFY_EVENT.size + length
+
+            if mask & IN_Q_OVERFLOW:
+                # Events were dropped, so anything could have changed
+                changes.update(self.folders)
+                continue
+            folder = self._watches.get(wd)
+            if mask & IN_IGNORED:
+                self._watches.pop(wd, None)
+                continue
+            if folder is None:
+                continue
+
+            path = name and folder / os.fsdecode(name) or folder
+            if is_ignored(path):
+                continue
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                try:
+                    self._add_tree(path)
+                except OSError as err:
+                    print(f"Failed to watch new folder: {err}")
+            changes.add(path)
+        return changes
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+class PollingWatcher:
+    """Watches folders for changes by comparing file modification times, for platforms without inotify
+
+    Args:
+        folders: The folders to watch, including everything inside them
+    """
+
+    def __init__(self, folders: list[Path]):
+        self.folders = folders
+        self._snapshot = self._scan()
+
+    def _scan(self) -> dict[Path, tuple[int, int]]:
+        snapshot: dict[Path, tuple[int, int]] = {}
+        for folder in self.folders:
+            for current in _walk_folders(folder):
+                try:
+                    entries = list(os.scandir(current))
+                except OSError:
+                    continue
+                for entry in entries:
+                    if not entry.is_file():
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    snapshot[Path(entry.path)] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def read_changes(self, timeout: float | None) -> set[Path]:
+        """Waits for changes
+
+        Args:
+            timeout: How many seconds to wait, or None to wait until something changes
+
+        Returns:
+            set[Path]: The files that were changed, added or removed, empty if nothing changed in time
+        """
+        deadline = timeout is not None and time.monotonic() + timeout or None
+        while True:
+            remaining = max(0.0, deadline - time.monotonic()) if deadline is not None else POLL_INTERVAL
+            time.sleep(min(POLL_INTERVAL, remaining))
+
+            snapshot = self._scan()
+            changes = {path for path in snapshot.keys() | self._snapshot.keys()
+                       if snapshot.get(path) != self._snapshot.get(path)}
+            self._snapshot = snapshot
+            if changes or (deadline is not None and time.monotonic() >= deadline):
+                return changes
+
+    def close(self):
+        pass
+
+def create_watcher(folders: list[Path] = WATCHED_FOLDERS) -> InotifyWatcher | PollingWatcher:
+    """Starts watching folders, with inotify on Linux and by polling elsewhere
+
+    Note:
+        Start watching before the first build, so edits made while it runs trigger the next one
+    """
+    folders = [folder for folder in folders if folder.exists()]
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(folders)
+        except (OSError, AttributeError) as err:
+            print(f"inotify isn't available, polling for changes every {POLL_INTERVAL}s instead: {err}")
+    return PollingWatcher(folders)
+
+def wait_for_changes(watcher: InotifyWatcher | PollingWatcher) -> set[Path]:
+    """Waits until something changes and then stays unchanged for DEBOUNCE seconds
+
+    Returns:
+        set[Path]: Everything that changed
+    """
+    changes: set[Path] = set()
+    while not changes:
+        # Events for ignored paths come back empty
+        changes = watcher.read_changes(None)
+    while True:
+        more = watcher.read_changes(DEBOUNCE)
+        if not more:
+            return changes
+        changes |= more
+
+def describe(changes: set[Path]) -> str:
+    """Summarizes changed paths for printing (I.E. "os.i, window.cpp and 3 more")"""
+    names = sorted(path.name for path in changes)
+    if len(names) <= 3:
+        return ", ".join(names)
+    return f"{', '.join(names[:2])} and {len(names) - 2} more"
+
+def watch(watcher: InotifyWatcher | PollingWatcher, rebuild: Callable[[], bool]):
+    """Rebuilds every time the watched sources change, until interrupted with Ctrl+C
+
+    Args:
+        watcher: Watches the sources, from create_watcher()
+        rebuild: Runs the stages that are out of date, returning whether the build succeeded
+    """
+    folders = ", ".join(str(folder.relative_to(util.PROJECT_ROOT)) for folder in watcher.folders)
+    try:
+        while True:
+            print(f"Watching {folders} for changes, press Ctrl+C to stop...")
+            changes = wait_for_changes(watcher)
+            print(f"Changed: {describe(changes)}, rebuilding...")
+            rebuild()
+    except KeyboardInterrupt:
+        print("Stopped watching for changes")
+    finally:
+        watcher.close()
@@ -0,0 +1,47 @@
+import os
+import subprocess
+import sys
+
+from pathlib import Path
+
+import pytest
+
+from scripts.bench import orchestration
+
+MODULES = 2
+
+pytestmark = pytest.mark.skipif(os.name != "posix", reason="The fake toolchain is started through #! scripts")
+
+def run_pgo_build(workspace: Path) -> str:
+    """Runs a PGO build in a workspace of fake tools, returning what it printed"""
+    result = subprocess.run(
+        [sys.executable, "-m", "scripts.compile", "--pgo", "--config=Release", "--compiler-cache=none"],
+        cwd=workspace, env=orchestration.get_workspace_environment(workspace, MODULES, 10),
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    assert "Torsion successfully compiled project" in result.stdout, result.stdout
+    return result.stdout
+
+def get_packaged_phases(workspace: Path) -> set[str]:
+    """Returns the PGO phases the packaged native libraries were built with"""
+    libraries = (workspace / "out" / "torsion" / "bin").glob("libmod*.so")
+    return {library.read_bytes().split(b" ", 1)[0].decode() for library in libraries}
+
+def test_pgo_rebuild_with_unchanged_sources(tmp_path: Path):
+    orchestration.create_workspace(tmp_path, MODULES, 2)
+
+    run_pgo_build(tmp_path)
+    assert get_packaged_phases(tmp_path) == {"USE"}
+
+    # The instrumented stages have to run again, the tree they built was replaced by the optimized build
+    output = run_pgo_build(tmp_path)
+    assert "Stage pgo-instrumented-cxx succeeded" in output
+    assert get_packaged_phases(tmp_path) == {"USE"}
+
+def test_pgo_reuses_shared_stages(tmp_path: Path):
+    orchestration.create_workspace(tmp_path, MODULES, 2)
+
+    output = run_pgo_build(tmp_path)
+    # SWIG, vcpkg and C# don't depend on the PGO phase, only native code is built twice
+    for stage in ("swig", "vcpkg", "cs"):
+        assert f"Stage pgo-instrumented-{stage} " not in output
+        assert f"Stage {stage} is up to date, skipping..." in output